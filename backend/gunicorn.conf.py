@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for running the FastAPI app in production.
+
+Usage (from backend/):
+    gunicorn -c gunicorn.conf.py main:app
+
+Each worker is a Uvicorn event loop, so LLM and Supabase round-trips from
+concurrent requests overlap instead of queueing behind a single process.
+"""
+import multiprocessing
+import os
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# The app sizes per-worker pools (PDF parsing) from the worker count
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the master and fork workers from it, so module
+# import cost is paid once and shared copy-on-write. Network clients are
+# created lazily inside each worker.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() != "false"
+
+# LLM-backed endpoints (lesson content, node generation) can take well over
+# the default 30s; keep workers alive long enough for a full provider chain.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
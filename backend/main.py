@@ -1,28 +1,44 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
-from supabase import create_client, Client
-from datetime import datetime
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, TypeAdapter
+from typing import AsyncIterator, Optional, List
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from postgrest.exceptions import APIError
+from storage3.utils import StorageException
+from datetime import datetime, timezone
 import os
 import uuid
 import asyncio
+import logging
+import logging.handlers
+import queue
+import shutil
+import tempfile
+import httpx
 from dotenv import load_dotenv
 from pathlib import Path
-import httpx
-import json
+import orjson
 import re
+import heapq
 import hmac
 import hashlib
 import base64
 import time
 import secrets
-from urllib.parse import urlencode, quote, parse_qs
+import traceback
+from urllib.parse import urlencode, quote, parse_qs, urlparse
+from functools import lru_cache
+import anyio.to_thread
 
 # Load .env from backend directory regardless of cwd
 env_path = Path(__file__).parent / ".env"
 load_dotenv(env_path)
 
+logger = logging.getLogger("arxlearn")
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 TOKEN_COMPANY_API_KEY = os.getenv("TOKEN_COMPANY_API_KEY", "")
 DEMO_MODE = os.getenv("DEMO_MODE", "false").lower() == "true"
@@ -30,39 +46,182 @@ DEMO_RUN_ID = str(uuid.uuid4())
 PROBLEM_BATCH_SIZE = int(os.getenv("PROBLEM_BATCH_SIZE", "3"))
 PROBLEM_CACHE: dict = {}
 PROBLEM_BATCHES: dict = {}
+PROBLEM_PREFETCH_TOPICS = max(1, int(os.getenv("PROBLEM_PREFETCH_TOPICS", "3")))
+LESSON_PREFETCH_TOPICS = int(os.getenv("LESSON_PREFETCH_TOPICS", "1"))
+LESSON_VIDEO_TIMEOUT_SECONDS = float(os.getenv("LESSON_VIDEO_TIMEOUT_SECONDS", "20"))
+LESSON_CONTENT_TIMEOUT_SECONDS = float(os.getenv("LESSON_CONTENT_TIMEOUT_SECONDS", "120"))
+LESSON_PREFETCHES: set = set()
+# Topics' next activities generated in the background at once per worker (0 disables)
+ACTIVITY_PREFETCH_CONCURRENCY = int(os.getenv("ACTIVITY_PREFETCH_CONCURRENCY", "4"))
+ACTIVITY_PREFETCH_SEMAPHORE = asyncio.Semaphore(max(1, ACTIVITY_PREFETCH_CONCURRENCY))
+ACTIVITY_PREFETCHES: set = set()
+# Strong references to fire-and-forget tasks so they aren't garbage collected
+BACKGROUND_TASKS: set = set()
+# Deferred writes (Storage uploads, material rows) that shutdown waits for
+PERSIST_TASKS: set = set()
+PERSIST_DRAIN_SECONDS = float(os.getenv("PERSIST_DRAIN_SECONDS", "30"))
+# Deferred writes retry transient failures with exponential backoff
+PERSIST_RETRY_ATTEMPTS = max(1, int(os.getenv("PERSIST_RETRY_ATTEMPTS", "3")))
+PERSIST_RETRY_BASE_SECONDS = float(os.getenv("PERSIST_RETRY_BASE_SECONDS", "0.5"))
+# Files from one multi-file upload processed at the same time
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "8"))
+# Coursework URLs from one request scraped at the same time
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "8"))
+# Figures from one authored paper uploaded at the same time
+FIGURE_UPLOAD_CONCURRENCY = int(os.getenv("FIGURE_UPLOAD_CONCURRENCY", "8"))
+# Sync SDK calls (Token Company) and file spooling run on the loop's default executor.
+BLOCKING_IO_THREADS = int(os.getenv("BLOCKING_IO_THREADS", "64"))
+# Max Google Docs fetched/compressed at once per request (Drive API quotas)
+GOOGLE_DOC_FETCH_CONCURRENCY = int(os.getenv("GOOGLE_DOC_FETCH_CONCURRENCY", "8"))
+# Node and prerequisite answers depend only on their inputs, so they stay cached longer
+NODE_CACHE_TTL_SECONDS = float(os.getenv("NODE_CACHE_TTL_SECONDS", "86400"))
 
 # Zotero OAuth 1.0a credentials
 ZOTERO_CLIENT_KEY = os.getenv("ZOTERO_CLIENT_KEY", "")
 ZOTERO_CLIENT_SECRET = os.getenv("ZOTERO_CLIENT_SECRET", "")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
-
-# Supabase client (initialized early for worker)
-supabase: Client = create_client(
-    os.getenv("NEXT_PUBLIC_SUPABASE_URL") or os.getenv("VITE_SUPABASE_URL", ""),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+# Zotero returns at most 100 items per page. Item lists are cached per
+# library with their Last-Modified-Version so unchanged libraries cost a 304.
+ZOTERO_PAGE_SIZE = 100
+ZOTERO_ITEMS_CACHE: dict = {}
+ZOTERO_ITEMS_CACHE_SIZE = 256
+# Comma-separated browser origins allowed to call the API ("*" allows any,
+# without credentials)
+CORS_ALLOW_ORIGINS = [o.strip() for o in os.getenv("CORS_ALLOW_ORIGINS", FRONTEND_URL).split(",") if o.strip()]
+
+from services.db import (
+    aclose_supabase_http,
+    close_pg_pool,
+    create_supabase_client,
+    insert_rows,
+    run_query,
+    upload_object,
 )
 
+# Supabase client (initialized early for worker). Queries and Storage calls
+# are awaited on a shared HTTP session opened on first use inside each worker.
+supabase = create_supabase_client()
 # Import Firecrawl service for chapter extraction
 from services.firecrawl import FirecrawlService, FirecrawlResponse, ChapterOutline
-from services.llm_provider import generate_json, generate_text
+from services.llm_provider import (
+    LLM_APP_TITLE,
+    LLM_HTTP_REFERER,
+    OPENROUTER_SEARCH_MAX_RESULTS,
+    OPENROUTER_SEARCH_MODELS,
+    aclose_http_client,
+    extract_json_from_response,
+    generate_json,
+    generate_text,
+    generate_text_stream,
+    get_http_client,
+    primary_model,
+)
 
 # Import PDF processor and token compression for immediate paper processing
-from services.pdf_processor import PDFProcessor
+from services.pdf_processor import PDFProcessor, shutdown_pdf_pool
 from services.token_compression import TokenCompressionService
+from services.micro_batcher import MicroBatcher
+from services.google_drive_service import download_to_tempfile
 
 # Import routers
 from routers.google_drive import router as google_drive_router
 
-app = FastAPI(title="arXlearn API", version="1.0.0")
+# Shared across requests: both are stateless after construction, and the
+# compression service caches its Token Company client on first use.
+TEXT_PDF_PROCESSOR = PDFProcessor(extract_images=False)
+FIGURE_PDF_PROCESSOR = PDFProcessor(extract_images=True)
+COMPRESSION_SERVICE = TokenCompressionService(TOKEN_COMPANY_API_KEY) if TOKEN_COMPANY_API_KEY else None
+
+
+@lru_cache(maxsize=1)
+def get_firecrawl() -> FirecrawlService:
+    """Shared Firecrawl client; raises ValueError (not cached) while FIRECRAWL_API_KEY is unset."""
+    return FirecrawlService(ttc_api_key=TOKEN_COMPANY_API_KEY)
+
+
+def _start_log_listener() -> logging.handlers.QueueListener:
+    """Queue app log records so stderr writes happen off the event loop thread."""
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)s [%(name)s] %(message)s"))
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener = _start_log_listener()
+    # Size the executors used for blocking calls so a burst of uploads
+    # doesn't queue behind the small interpreter defaults.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BLOCKING_IO_THREADS, thread_name_prefix="blocking-io")
+    )
+    anyio.to_thread.current_default_thread_limiter().total_tokens = BLOCKING_IO_THREADS
+    yield
+    # Let deferred writes finish, then stop background work (lesson
+    # prefetches) before closing the client it uses
+    if PERSIST_TASKS:
+        await asyncio.wait(list(PERSIST_TASKS), timeout=PERSIST_DRAIN_SECONDS)
+    pending = list(BACKGROUND_TASKS)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    await aclose_http_client()
+    await aclose_supabase_http()
+    await close_pg_pool()
+    shutdown_pdf_pool()
+    log_listener.stop()
+    logger.handlers.clear()
+
+
+app = FastAPI(
+    title="arXlearn API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+# Large JSON payloads (node lists, lesson content) compress well
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=CORS_ALLOW_ORIGINS,
+    # Browsers reject credentialed responses to a wildcard origin
+    allow_credentials="*" not in CORS_ALLOW_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+
+_HEALTH_BODY = b'{"status":"healthy"}'
+_HEALTH_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"content-length", str(len(_HEALTH_BODY)).encode()),
+]
+
+
+class HealthCheckMiddleware:
+    """Answer /health probes before routing, validation and JSON encoding."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/health":
+            await send({"type": "http.response.start", "status": 200, "headers": _HEALTH_HEADERS})
+            await send({"type": "http.response.body", "body": _HEALTH_BODY})
+            return
+        await self.app(scope, receive, send)
+
+
+# Added last so it is the outermost middleware
+app.add_middleware(HealthCheckMiddleware)
+
 # Include routers
 app.include_router(google_drive_router)
 
@@ -176,34 +335,13 @@ class ZoteroConnectionStatus(BaseModel):
 
 # ============ Helper Functions ============
 
-def extract_json_from_response(text: str) -> dict:
-    """Extract JSON from Gemini response, handling markdown code blocks."""
-    # Try to find JSON in code blocks first
-    json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
-    if json_match:
-        text = json_match.group(1)
-    
-    # Clean up and parse
-    text = text.strip()
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        # Try to find JSON object in the text
-        start = text.find('{')
-        end = text.rfind('}') + 1
-        if start != -1 and end > start:
-            return json.loads(text[start:end])
-        raise
-
-
 async def _compress_prompt_text(text: str) -> tuple[str, bool]:
     """Compress large user/content context before placing it inside LLM prompts."""
     if not TOKEN_COMPANY_API_KEY or not text or len(text) < 1200:
         return text, False
 
     try:
-        compression_service = TokenCompressionService(TOKEN_COMPANY_API_KEY)
-        result = await compression_service.compress_for_notes(text)
+        result = await COMPRESSION_SERVICE.compress_for_notes(text)
     except Exception as e:
         print(f"[PromptCompression] Compression failed: {e}")
         return text, False
@@ -218,6 +356,17 @@ async def _compress_prompt_text(text: str) -> tuple[str, bool]:
     return result.compressed_text, True
 
 
+_BANNED_LABEL_TERMS = frozenset({
+    "deliverable", "proposal", "report", "document", "resume", "cv",
+    "syllabus", "chapter", "unit", "lesson", "assignment", "paper",
+    "project", "coursework", "course", "module", "notes", "slides",
+    "summary", "draft", "presentation", "outline", "appendix",
+    "bibliography", "introduction", "conclusion", "abstract"
+})
+_NUMBERED_DOC_LABEL_RE = re.compile(r"^(deliverable|project|proposal|report)\s*[ivx]+$")
+_NO_LETTERS_RE = re.compile(r"^[^a-z]*$")
+
+
 def _is_generic_or_doc_label(label: str) -> bool:
     if not label:
         return True
@@ -226,30 +375,35 @@ def _is_generic_or_doc_label(label: str) -> bool:
         return True
 
     lower = cleaned.lower()
-    banned_terms = {
-        "deliverable", "proposal", "report", "document", "resume", "cv",
-        "syllabus", "chapter", "unit", "lesson", "assignment", "paper",
-        "project", "coursework", "course", "module", "notes", "slides",
-        "summary", "draft", "presentation", "outline", "appendix",
-        "bibliography", "introduction", "conclusion", "abstract"
-    }
-
-    if lower in banned_terms:
+    if lower in _BANNED_LABEL_TERMS:
         return True
 
-    for term in banned_terms:
-        if lower.startswith(f"{term} ") or lower.endswith(f" {term}") or f" {term} " in lower:
-            return True
+    # Any banned term as a whole word ("project proposal", "week notes")
+    if not _BANNED_LABEL_TERMS.isdisjoint(lower.split(" ")):
+        return True
 
-    if re.match(r"^(deliverable|project|proposal|report)\s*[ivx]+$", lower):
+    if _NUMBERED_DOC_LABEL_RE.match(lower):
         return True
 
-    if re.match(r"^[^a-z]*$", lower):
+    if _NO_LETTERS_RE.match(lower):
         return True
 
     return False
 
 
+# Inputs with no real words (blank CVs, "Untitled", "???", bare numbers) only
+# produce generic nodes at full LLM cost, so they are answered directly.
+_MEANINGFUL_WORD_RE = re.compile(r"[^\W\d_]{3,}")
+_PLACEHOLDER_INPUTS = frozenset({"untitled", "none", "n/a", "na", "null", "test", "asdf"})
+
+
+def _is_trivial_input(text: Optional[str]) -> bool:
+    cleaned = (text or "").strip()
+    if not cleaned or cleaned.lower() in _PLACEHOLDER_INPUTS:
+        return True
+    return _MEANINGFUL_WORD_RE.search(cleaned) is None
+
+
 def _filter_generated_nodes(nodes: List[dict]) -> List[dict]:
     filtered = []
     for node in nodes or []:
@@ -260,19 +414,122 @@ def _filter_generated_nodes(nodes: List[dict]) -> List[dict]:
     return filtered
 
 
-async def call_gemini(prompt: str) -> str:
-    """Compatibility wrapper: route legacy Gemini calls through the configured LLM provider."""
-    return await generate_text(prompt, task="legacy_gemini", max_tokens=8192)
+async def _lookup_node_ids(session_id: str, labels: List[Optional[str]]) -> dict:
+    """Map existing knowledge-node labels in a session to their ids with one query."""
+    wanted = sorted({label for label in labels if label})
+    if not wanted:
+        return {}
+    result = await run_query(supabase.table("knowledge_nodes").select("id,label").eq("session_id", session_id).in_("label", wanted))
+    ids = {}
+    for row in result.data or []:
+        ids.setdefault(row["label"], row["id"])
+    return ids
 
 
-async def generate_background_nodes(central_topic: str, background: str) -> List[dict]:
-    """Use Gemini to generate knowledge nodes from CV/background by extracting skills and relating them to the topic."""
-    background, _ = await _compress_prompt_text(background)
-    prompt = f"""You are analyzing a person's CV or background description to extract their skills and relate them to their learning topic.
+# A session's central_topic is fixed at creation, so handlers that only need
+# the topic share one lookup per session
+CENTRAL_TOPIC_CACHE: dict = {}
+CENTRAL_TOPIC_CACHE_SIZE = 4096
+
+
+def _remember_central_topic(session_id: str, central_topic: str) -> None:
+    CENTRAL_TOPIC_CACHE[session_id] = central_topic
+    if len(CENTRAL_TOPIC_CACHE) > CENTRAL_TOPIC_CACHE_SIZE:
+        CENTRAL_TOPIC_CACHE.pop(next(iter(CENTRAL_TOPIC_CACHE)))
+
+
+async def get_central_topic(session_id: str) -> str:
+    """Return a session's central_topic; raises a 404 HTTPException for unknown sessions."""
+    central_topic = CENTRAL_TOPIC_CACHE.get(session_id)
+    if central_topic is None:
+        result = await run_query(
+            supabase.table("learning_sessions").select("central_topic").eq("id", session_id).limit(1)
+        )
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Session not found")
+        central_topic = result.data[0].get("central_topic") or ""
+        _remember_central_topic(session_id, central_topic)
+    return central_topic
 
-INPUT:
-- Learning topic they want to study: "{central_topic}"
-- Their CV/Background: "{background}"
+
+def _spawn_background(coro) -> asyncio.Task:
+    """Run a coroutine after the response without losing track of it."""
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+
+async def _cancel_unfinished(*tasks) -> None:
+    """Cancel tasks started ahead of work that may fail, and collect their results so none are orphaned."""
+    started = [task for task in tasks if task is not None]
+    for task in started:
+        if not task.done():
+            task.cancel()
+    await asyncio.gather(*started, return_exceptions=True)
+
+
+@asynccontextmanager
+async def spool_to_tempfile(file: UploadFile) -> AsyncIterator[str]:
+    """
+    Copy an uploaded file to a temporary file in chunks and yield its path.
+
+    Lets extraction and Storage uploads read from disk instead of holding the
+    whole upload in memory. The file is deleted when the context exits.
+    """
+    fd, path = tempfile.mkstemp(suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as sink:
+            await asyncio.to_thread(shutil.copyfileobj, file.file, sink, 1 << 20)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+async def _with_retries(make_call, what: str, retry_on: tuple):
+    """Await make_call(), retrying retry_on errors with exponential backoff up to PERSIST_RETRY_ATTEMPTS times."""
+    for attempt in range(1, PERSIST_RETRY_ATTEMPTS + 1):
+        try:
+            return await make_call()
+        except retry_on as e:
+            if attempt == PERSIST_RETRY_ATTEMPTS:
+                raise
+            delay = PERSIST_RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+            logger.warning("%s failed (attempt %d/%d), retrying in %.1fs: %s", what, attempt, PERSIST_RETRY_ATTEMPTS, delay, e)
+            await asyncio.sleep(delay)
+
+
+def _spawn_persist(coro) -> asyncio.Task:
+    """Run a non-critical write after the response; shutdown drains these before exiting."""
+    task = asyncio.create_task(coro)
+    PERSIST_TASKS.add(task)
+    task.add_done_callback(PERSIST_TASKS.discard)
+    return task
+
+
+async def call_gemini(
+    prompt: str,
+    task: str = "legacy_gemini",
+    semantic_key: Optional[str] = None,
+    system: str = "",
+    cache_ttl: Optional[float] = None,
+) -> str:
+    """Compatibility wrapper: route legacy Gemini calls through the configured LLM provider.
+
+    Responses are served from the provider's exact-match cache, keyed per task.
+    Pass semantic_key (a topic or title embedded in the prompt) to also reuse
+    answers for near-duplicate phrasings of it. Static instructions go in
+    system so providers can cache that prefix across requests. cache_ttl keeps
+    the cached answer longer than the default LLM_CACHE_TTL_SECONDS.
+    """
+    return await generate_text(
+        prompt, system=system, task=task, max_tokens=8192, semantic_key=semantic_key, cache_ttl=cache_ttl
+    )
+
+
+# Static instructions for the node generators. Kept separate from the
+# per-request input so every call shares an identical, cacheable prefix.
+BACKGROUND_NODES_SYSTEM = """You are analyzing a person's CV or background description to extract their skills and relate them to their learning topic.
 
 TASK:
 1. Extract the key skills, competencies, and knowledge areas from their CV/background
@@ -280,16 +537,16 @@ TASK:
 3. Return 5-6 nodes that represent the bridge between what they already know and what they want to learn
 
 OUTPUT FORMAT (strict JSON, no markdown):
-{{
+{
   "nodes": [
-    {{
+    {
       "label": "skill name (1-2 words)",
       "domain": "broader category this skill belongs to",
       "confidence": 0.0-1.0,
-      "relevance_to_topic": "How this skill helps them learn {central_topic}"
-    }}
+      "relevance_to_topic": "How this skill helps them learn the learning topic"
+    }
   ]
-}}
+}
 
 EXAMPLE:
 If someone has Python programming skills and wants to learn Machine Learning:
@@ -298,47 +555,31 @@ If someone has Python programming skills and wants to learn Machine Learning:
 CONSTRAINTS:
 - Labels must be 1-2 words (the skill itself)
 - Confidence reflects how strong this skill appears in their background (0.5-1.0)
-- relevance_to_topic MUST explain the connection between the skill and "{central_topic}"
+- relevance_to_topic MUST explain the connection between the skill and the learning topic
 - Return exactly 5-6 nodes
 - Focus on skills that have clear relevance to their learning topic
-- Do NOT output generic document words like \"deliverable\", \"proposal\", or \"report\""""
-
-    response_text = await call_gemini(prompt)
-    result = extract_json_from_response(response_text)
-    return _filter_generated_nodes(result.get("nodes", []))
-
+- Do NOT output generic document words like "deliverable", "proposal", or "report\""""
 
-async def generate_paper_nodes(central_topic: str, existing_nodes: List[str], paper_titles: List[str]) -> List[dict]:
-    """Use Gemini to generate knowledge nodes from papers."""
-    titles_formatted = "\n".join([f"{i+1}. {t}" for i, t in enumerate(paper_titles)])
-    existing_formatted = ", ".join(existing_nodes) if existing_nodes else "None yet"
-    
-    prompt = f"""You are analyzing a researcher's reading history to map their knowledge graph.
-
-INPUT:
-- Central research question: "{central_topic}"
-- Existing knowledge nodes: {existing_formatted}
-- Papers read (titles only):
-{titles_formatted}
+PAPER_NODES_SYSTEM = """You are analyzing a researcher's reading history to map their knowledge graph.
 
 TASK:
-Identify exactly 20 specific concepts, methods, or theories this researcher likely understands based on these papers. These should be:
+Identify exactly 20 specific concepts, methods, or theories this researcher likely understands based on the papers they read. These should be:
 - More specific than the existing background nodes
 - Directly relevant to understanding their central research question
 - Represent actual learnable concepts (not paper titles)
 
 OUTPUT FORMAT (strict JSON, no markdown):
-{{
+{
   "nodes": [
-    {{
+    {
       "label": "concept name (1-3 words)",
       "type": "concept" | "method" | "theory" | "tool",
       "parent_node": "label of existing node this connects to, or null",
       "source_papers": [indices of papers that teach this],
       "mastery_estimate": 0.0-1.0
-    }}
+    }
   ]
-}}
+}
 
 CONSTRAINTS:
 - Exactly 20 nodes
@@ -346,24 +587,131 @@ CONSTRAINTS:
 - Labels must be 1-3 words
 - mastery_estimate: 0.8+ if multiple papers cover it, 0.5-0.7 if one paper"""
 
-    response_text = await call_gemini(prompt)
+PAPER_TITLE_NODES_SYSTEM = """Extract 3 key concepts from each paper title you are given.
+Do NOT return generic document terms (e.g., deliverable, proposal, report, paper).
+Each concept is {"label":"1-2 words","type":"concept|method|theory|tool","mastery_estimate":0.7}.
+Return JSON only."""
+
+
+async def generate_background_nodes(central_topic: str, background: str) -> List[dict]:
+    """Use Gemini to generate knowledge nodes from CV/background by extracting skills and relating them to the topic."""
+    if _is_trivial_input(background):
+        return []
+    background, _ = await _compress_prompt_text(background)
+    prompt = f"""INPUT:
+- Learning topic they want to study: "{central_topic}"
+- Their CV/Background: "{background}\""""
+
+    response_text = await call_gemini(prompt, task="background_nodes", system=BACKGROUND_NODES_SYSTEM)
+    result = extract_json_from_response(response_text)
+    return _filter_generated_nodes(result.get("nodes", []))
+
+
+async def generate_paper_nodes(central_topic: str, existing_nodes: List[str], paper_titles: List[str]) -> List[dict]:
+    """Use Gemini to generate knowledge nodes from papers."""
+    if all(_is_trivial_input(t) for t in paper_titles):
+        return []
+    titles_formatted = "\n".join([f"{i+1}. {t}" for i, t in enumerate(paper_titles)])
+    existing_formatted = ", ".join(existing_nodes) if existing_nodes else "None yet"
+    
+    prompt = f"""INPUT:
+- Central research question: "{central_topic}"
+- Existing knowledge nodes: {existing_formatted}
+- Papers read (titles only):
+{titles_formatted}"""
+
+    response_text = await call_gemini(prompt, task="paper_nodes", system=PAPER_NODES_SYSTEM)
     result = extract_json_from_response(response_text)
     return _filter_generated_nodes(result.get("nodes", []))
 
 
 async def generate_single_paper_nodes(paper_title: str) -> List[dict]:
-    """Lightweight Gemini call for a single paper - generates 3 key concepts from title only."""
-    prompt = f"""From paper title "{paper_title}", extract 3 key concepts.
-Do NOT return generic document terms (e.g., deliverable, proposal, report, paper).
-Return JSON only: {{"nodes":[{{"label":"1-2 words","type":"concept|method|theory|tool","mastery_estimate":0.7}}]}}"""
+    """Lightweight Gemini call for a single paper - generates 3 key concepts from title only.
+
+    Concurrent calls (parallel uploads, several users at once) are coalesced by
+    _PAPER_NODE_BATCHER into one multi-title prompt.
+    """
+    if _is_trivial_input(paper_title):
+        return []
+    return await _PAPER_NODE_BATCHER.submit(paper_title)
+
+
+async def _generate_single_paper_nodes_unbatched(paper_title: str) -> List[dict]:
+    prompt = f"""Paper title: "{paper_title}"
+
+Return: {{"nodes":[...3 concepts...]}}"""
 
-    response_text = await call_gemini(prompt)
+    # Exact-match caching only: near-duplicate titles can be different papers
+    response_text = await call_gemini(prompt, task="single_paper_nodes", system=PAPER_TITLE_NODES_SYSTEM)
     result = extract_json_from_response(response_text)
     return _filter_generated_nodes(result.get("nodes", []))
 
 
+async def _generate_paper_nodes_batch(paper_titles: List[str]) -> List[List[dict]]:
+    """Generate 3 key concepts for each of several paper titles in one call."""
+    if len(paper_titles) == 1:
+        return [await _generate_single_paper_nodes_unbatched(paper_titles[0])]
+
+    titles_text = "\n".join(f"{i}. {title}" for i, title in enumerate(paper_titles))
+    prompt = f"""Paper titles:
+{titles_text}
+
+Return: {{"papers":[{{"index":0,"nodes":[...3 concepts...]}}]}}"""
+
+    try:
+        response_text = await call_gemini(prompt, task="paper_nodes_batch", system=PAPER_TITLE_NODES_SYSTEM)
+        result = extract_json_from_response(response_text)
+        papers = result.get("papers", []) if isinstance(result, dict) else []
+    except Exception as e:
+        # An unusable batch response falls back to one prompt per title below
+        print(f"[PaperNodes] Batch of {len(paper_titles)} titles failed, retrying per title: {e}")
+        papers = []
+    by_index = {
+        paper.get("index"): paper.get("nodes", [])
+        for paper in papers
+        if isinstance(paper, dict)
+    }
+
+    nodes_by_title = [_filter_generated_nodes(by_index.get(i) or []) for i in range(len(paper_titles))]
+
+    # Titles the model skipped fall back to the single-title prompt
+    missing = [i for i, nodes in enumerate(nodes_by_title) if not nodes]
+    if missing:
+        retried = await asyncio.gather(
+            *(_generate_single_paper_nodes_unbatched(paper_titles[i]) for i in missing),
+            return_exceptions=True
+        )
+        for i, nodes in zip(missing, retried):
+            if not isinstance(nodes, Exception):
+                nodes_by_title[i] = nodes
+    return nodes_by_title
+
+
+_PAPER_NODE_BATCHER = MicroBatcher(
+    _generate_paper_nodes_batch,
+    max_batch=int(os.getenv("PAPER_NODE_BATCH_SIZE", "16")),
+    max_wait_ms=float(os.getenv("PAPER_NODE_BATCH_WAIT_MS", "25")),
+    fallback=_generate_single_paper_nodes_unbatched,
+)
+
+
 # ============ Zotero OAuth 1.0a Helpers ============
 
+def _oauth_quote(value: str) -> str:
+    """RFC 5849 percent-encoding."""
+    return quote(value, safe="")
+
+
+# Parameters identical on every request; already percent-encoded and sorted
+_STATIC_OAUTH_PARAMS = (("oauth_signature_method", "HMAC-SHA1"), ("oauth_version", "1.0"))
+
+
+def _encoded_oauth_params(params: dict):
+    """Yield (key, value) pairs percent-encoded and sorted, static params merged in."""
+    dynamic = sorted((_oauth_quote(k), _oauth_quote(v)) for k, v in params.items())
+    return heapq.merge(_STATIC_OAUTH_PARAMS, dynamic)
+
+
 def generate_oauth_signature(
     http_method: str,
     url: str,
@@ -372,20 +720,19 @@ def generate_oauth_signature(
     token_secret: str = "",
     debug: bool = False
 ) -> str:
-    """Generate OAuth 1.0a HMAC-SHA1 signature."""
-    # Sort and encode parameters
-    sorted_params = sorted(params.items())
-    param_string = "&".join([f"{quote(str(k), safe='')}" + "=" + f"{quote(str(v), safe='')}" for k, v in sorted_params])
-
-    # Create signature base string
-    signature_base = "&".join([
-        http_method.upper(),
-        quote(url, safe=""),
-        quote(param_string, safe="")
-    ])
+    """
+    Generate OAuth 1.0a HMAC-SHA1 signature.
+
+    params holds the per-request string parameters only; the signature method
+    and version from _STATIC_OAUTH_PARAMS are always included.
+    """
+    param_string = "&".join(f"{k}={v}" for k, v in _encoded_oauth_params(params))
+
+    # Create signature base string (param_string is unique per call, so not cached)
+    signature_base = f"{http_method.upper()}&{_oauth_quote(url)}&{quote(param_string, safe='')}"
 
     # Create signing key
-    signing_key = f"{quote(consumer_secret, safe='')}&{quote(token_secret, safe='')}"
+    signing_key = f"{_oauth_quote(consumer_secret)}&{_oauth_quote(token_secret)}"
 
     if debug:
         print(f"[OAuth Debug] Param string: {param_string[:100]}...")
@@ -403,10 +750,9 @@ def generate_oauth_signature(
 
 
 def build_oauth_header(params: dict) -> str:
-    """Build OAuth Authorization header from parameters."""
-    oauth_params = [(k, v) for k, v in params.items() if k.startswith("oauth_")]
-    header_parts = [f'{k}="{quote(str(v), safe="")}"' for k, v in sorted(oauth_params)]
-    return "OAuth " + ", ".join(header_parts)
+    """Build OAuth Authorization header from per-request parameters plus the static ones."""
+    oauth_params = {k: v for k, v in params.items() if k.startswith("oauth_")}
+    return "OAuth " + ", ".join(f'{k}="{v}"' for k, v in _encoded_oauth_params(oauth_params))
 
 
 async def zotero_oauth_request_token(callback_url: str) -> tuple[str, str]:
@@ -415,10 +761,8 @@ async def zotero_oauth_request_token(callback_url: str) -> tuple[str, str]:
 
     oauth_params = {
         "oauth_consumer_key": ZOTERO_CLIENT_KEY,
-        "oauth_signature_method": "HMAC-SHA1",
         "oauth_timestamp": str(int(time.time())),
         "oauth_nonce": secrets.token_hex(16),
-        "oauth_version": "1.0",
         "oauth_callback": callback_url,
     }
 
@@ -427,24 +771,24 @@ async def zotero_oauth_request_token(callback_url: str) -> tuple[str, str]:
 
     print(f"[Zotero OAuth] Requesting token with callback: {callback_url}")
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            url,
-            headers={
-                "Authorization": build_oauth_header(oauth_params),
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            timeout=30.0
-        )
+    client = get_http_client()
+    response = await client.post(
+        url,
+        headers={
+            "Authorization": build_oauth_header(oauth_params),
+            "Content-Type": "application/x-www-form-urlencoded",
+        },
+        timeout=30.0
+    )
 
-        if response.status_code != 200:
-            print(f"[Zotero OAuth] Request token error: {response.status_code} - {response.text}")
-            response.raise_for_status()
+    if response.status_code != 200:
+        print(f"[Zotero OAuth] Request token error: {response.status_code} - {response.text}")
+        response.raise_for_status()
 
-        # Parse response (oauth_token=...&oauth_token_secret=...)
-        data = parse_qs(response.text)
-        print(f"[Zotero OAuth] Got request token: {data['oauth_token'][0][:10]}...")
-        return data["oauth_token"][0], data["oauth_token_secret"][0]
+    # Parse response (oauth_token=...&oauth_token_secret=...)
+    data = parse_qs(response.text)
+    print(f"[Zotero OAuth] Got request token: {data['oauth_token'][0][:10]}...")
+    return data["oauth_token"][0], data["oauth_token_secret"][0]
 
 
 async def zotero_oauth_access_token(
@@ -458,10 +802,8 @@ async def zotero_oauth_access_token(
     oauth_params = {
         "oauth_consumer_key": ZOTERO_CLIENT_KEY,
         "oauth_token": oauth_token,
-        "oauth_signature_method": "HMAC-SHA1",
         "oauth_timestamp": str(int(time.time())),
         "oauth_nonce": secrets.token_hex(16),
-        "oauth_version": "1.0",
         "oauth_verifier": oauth_verifier,
     }
 
@@ -476,55 +818,55 @@ async def zotero_oauth_access_token(
     auth_header = build_oauth_header(oauth_params)
     print(f"[Zotero OAuth] Auth header: {auth_header[:100]}...")
 
-    async with httpx.AsyncClient() as client:
-        # Standard OAuth 1.0a: parameters in Authorization header
-        response = await client.post(
-            url,
-            headers={
-                "Authorization": auth_header,
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            content="",  # Empty body for OAuth token exchange
-            timeout=30.0
-        )
+    client = get_http_client()
+    # Standard OAuth 1.0a: parameters in Authorization header
+    response = await client.post(
+        url,
+        headers={
+            "Authorization": auth_header,
+            "Content-Type": "application/x-www-form-urlencoded",
+        },
+        content="",  # Empty body for OAuth token exchange
+        timeout=30.0
+    )
 
-        if response.status_code != 200:
-            error_body = response.text
-            print(f"[Zotero OAuth] Access token error: {response.status_code}")
-            print(f"[Zotero OAuth] Error body: {error_body}")
-
-            # Parse Zotero's OAuth error format
-            if "oauth_problem=" in error_body:
-                error_data = parse_qs(error_body)
-                oauth_problem = error_data.get("oauth_problem", ["unknown"])[0]
-                print(f"[Zotero OAuth] OAuth problem: {oauth_problem}")
-
-                if oauth_problem == "verifier_invalid":
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Invalid OAuth verifier. The authorization may have expired. Please try connecting again."
-                    )
-                elif oauth_problem == "token_rejected":
-                    raise HTTPException(
-                        status_code=400,
-                        detail="OAuth token rejected. The request token may have expired. Please try connecting again."
-                    )
-                elif oauth_problem == "signature_invalid":
-                    raise HTTPException(
-                        status_code=400,
-                        detail="OAuth signature invalid. Please contact support."
-                    )
+    if response.status_code != 200:
+        error_body = response.text
+        print(f"[Zotero OAuth] Access token error: {response.status_code}")
+        print(f"[Zotero OAuth] Error body: {error_body}")
+
+        # Parse Zotero's OAuth error format
+        if "oauth_problem=" in error_body:
+            error_data = parse_qs(error_body)
+            oauth_problem = error_data.get("oauth_problem", ["unknown"])[0]
+            print(f"[Zotero OAuth] OAuth problem: {oauth_problem}")
+
+            if oauth_problem == "verifier_invalid":
+                raise HTTPException(
+                    status_code=400,
+                    detail="Invalid OAuth verifier. The authorization may have expired. Please try connecting again."
+                )
+            elif oauth_problem == "token_rejected":
+                raise HTTPException(
+                    status_code=400,
+                    detail="OAuth token rejected. The request token may have expired. Please try connecting again."
+                )
+            elif oauth_problem == "signature_invalid":
+                raise HTTPException(
+                    status_code=400,
+                    detail="OAuth signature invalid. Please contact support."
+                )
 
-            response.raise_for_status()
+        response.raise_for_status()
 
-        # Parse response (oauth_token=...&oauth_token_secret=...&userID=...&username=...)
-        data = parse_qs(response.text)
-        return (
-            data["oauth_token"][0],
-            data["oauth_token_secret"][0],
-            data["userID"][0],
-            data.get("username", [""])[0]
-        )
+    # Parse response (oauth_token=...&oauth_token_secret=...&userID=...&username=...)
+    data = parse_qs(response.text)
+    return (
+        data["oauth_token"][0],
+        data["oauth_token_secret"][0],
+        data["userID"][0],
+        data.get("username", [""])[0]
+    )
 
 
 # ============ API Endpoints ============
@@ -532,7 +874,7 @@ async def zotero_oauth_access_token(
 @app.post("/api/user/new", response_model=UserResponse)
 async def create_user():
     """Create a new user for hackathon testing."""
-    result = supabase.table("users").insert({}).execute()
+    result = await run_query(supabase.table("users").insert({}))
     return UserResponse(user_id=result.data[0]["id"])
 
 
@@ -541,12 +883,13 @@ async def create_session(request: SessionCreateRequest):
     """Create a new learning session with central topic."""
     session_id = str(uuid.uuid4())
     
-    result = supabase.table("learning_sessions").insert({
+    result = await run_query(supabase.table("learning_sessions").insert({
         "id": session_id,
         "user_id": request.user_id,
         "central_topic": request.central_topic,
         "is_llm_generated": False
-    }).execute()
+    }))
+    _remember_central_topic(session_id, request.central_topic)
     
     return SessionResponse(
         session_id=session_id,
@@ -568,36 +911,38 @@ async def upload_cv(
     file: UploadFile = File(...)
 ):
     """Upload CV, extract text, and generate knowledge nodes."""
+    upload_task = None
     try:
         # Get session to retrieve central_topic
-        session = supabase.table("learning_sessions").select("*").eq("id", session_id).single().execute()
-        central_topic = session.data["central_topic"]
+        central_topic = await get_central_topic(session_id)
         
-        # Upload file to storage
-        file_bytes = await file.read()
+        # Spool the CV to disk and upload it from there in the background
+        # while nodes are generated
         file_path = f"{user_id}/{file.filename}"
-        
-        supabase.storage.from_("cvs").upload(file_path, file_bytes, {
-            "content-type": file.content_type or "application/pdf"
-        })
-        
-        # For now, use filename as placeholder text (real impl would use pdf2text)
-        cv_text = f"CV uploaded: {file.filename}"
+        async with spool_to_tempfile(file) as cv_path:
+            upload_task = asyncio.create_task(upload_object(
+                supabase.storage.from_("cvs"), file_path, cv_path, file.content_type or "application/pdf"
+            ))
+
+            # For now, use filename as placeholder text (real impl would use pdf2text)
+            cv_text = f"CV uploaded: {file.filename}"
+
+            # Generate nodes using Gemini; the upload must land before the
+            # profile row points at it (and before the spooled file is removed)
+            nodes = await generate_background_nodes(central_topic, cv_text)
+            await upload_task
         
         # Store profile
-        supabase.table("user_profiles").insert({
+        await run_query(supabase.table("user_profiles").insert({
             "user_id": user_id,
             "cv_url": file_path,
             "cv_text": cv_text,
             "is_llm_generated": False
-        }).execute()
-        
-        # Generate nodes using Gemini
-        nodes = await generate_background_nodes(central_topic, cv_text)
+        }))
         
-        # Store nodes in database
-        for node in nodes:
-            supabase.table("knowledge_nodes").insert({
+        # Store nodes in database (one bulk insert)
+        if nodes:
+            await insert_rows(supabase, "knowledge_nodes", [{
                 "session_id": session_id,
                 "label": node.get("label"),
                 "type": "domain",
@@ -605,12 +950,15 @@ async def upload_cv(
                 "confidence": node.get("confidence"),
                 "relevance_to_topic": node.get("relevance_to_topic"),
                 "is_llm_generated": True
-            }).execute()
+            } for node in nodes])
         
         return NodesResponse(success=True, nodes=[KnowledgeNode(**n) for n in nodes])
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Don't leave the upload running when node generation or a write failed
+        await _cancel_unfinished(upload_task)
 
 
 @app.post("/api/profile/background", response_model=NodesResponse)
@@ -618,22 +966,21 @@ async def submit_background(request: BackgroundRequest):
     """Submit background description and generate knowledge nodes."""
     try:
         # Get session to retrieve central_topic
-        session = supabase.table("learning_sessions").select("*").eq("id", request.session_id).single().execute()
-        central_topic = session.data["central_topic"]
+        central_topic = await get_central_topic(request.session_id)
         
         # Store profile
-        supabase.table("user_profiles").insert({
+        await run_query(supabase.table("user_profiles").insert({
             "user_id": request.user_id,
             "background_description": request.description,
             "is_llm_generated": False
-        }).execute()
+        }))
         
         # Generate nodes using Gemini
         nodes = await generate_background_nodes(central_topic, request.description)
         
-        # Store nodes in database
-        for node in nodes:
-            supabase.table("knowledge_nodes").insert({
+        # Store nodes in database (one bulk insert)
+        if nodes:
+            await insert_rows(supabase, "knowledge_nodes", [{
                 "session_id": request.session_id,
                 "label": node.get("label"),
                 "type": "domain",
@@ -641,12 +988,11 @@ async def submit_background(request: BackgroundRequest):
                 "confidence": node.get("confidence"),
                 "relevance_to_topic": node.get("relevance_to_topic"),
                 "is_llm_generated": True
-            }).execute()
+            } for node in nodes])
         
         return NodesResponse(success=True, nodes=[KnowledgeNode(**n) for n in nodes])
         
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -656,21 +1002,16 @@ async def submit_papers(request: PapersRequest):
     """Submit papers and generate knowledge nodes."""
     try:
         # Get session to retrieve central_topic
-        session = supabase.table("learning_sessions").select("*").eq("id", request.session_id).single().execute()
-        central_topic = session.data["central_topic"]
+        central_topic = await get_central_topic(request.session_id)
         
         # Get existing nodes
-        existing_nodes_result = supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id).execute()
+        existing_nodes_result = await run_query(supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id))
         existing_labels = [n["label"] for n in existing_nodes_result.data]
         
-        # Store papers and collect titles
-        paper_titles = []
-        for paper in request.papers:
-            title = paper.title or paper.url or "Untitled"
-            paper_titles.append(title)
-
-            # Store in academia_materials (replaces old user_papers table)
-            supabase.table("academia_materials").insert({
+        # Store papers in academia_materials (replaces old user_papers table)
+        paper_titles = [paper.title or paper.url or "Untitled" for paper in request.papers]
+        if paper_titles:
+            await run_query(supabase.table("academia_materials").insert([{
                 "user_id": request.user_id,
                 "session_id": request.session_id,
                 "title": title,
@@ -678,29 +1019,23 @@ async def submit_papers(request: PapersRequest):
                 "material_type": "paper_read",
                 "source_type": "doi_url" if paper.url else "manual_entry",
                 "is_processed": False
-            }).execute()
+            } for paper, title in zip(request.papers, paper_titles)]))
         
         # Generate nodes using Gemini
         nodes = await generate_paper_nodes(central_topic, existing_labels, paper_titles)
         
-        # Store nodes in database
-        for node in nodes:
-            # Find parent node ID if specified
-            parent_id = None
-            if node.get("parent_node"):
-                parent_result = supabase.table("knowledge_nodes").select("id").eq("session_id", request.session_id).eq("label", node["parent_node"]).execute()
-                if parent_result.data:
-                    parent_id = parent_result.data[0]["id"]
-            
-            supabase.table("knowledge_nodes").insert({
+        # Store nodes in database, resolving parent labels with one query
+        parent_ids = await _lookup_node_ids(request.session_id, [node.get("parent_node") for node in nodes])
+        if nodes:
+            await insert_rows(supabase, "knowledge_nodes", [{
                 "session_id": request.session_id,
                 "label": node.get("label"),
                 "type": node.get("type"),
-                "parent_node_id": parent_id,
+                "parent_node_id": parent_ids.get(node.get("parent_node")),
                 "mastery_estimate": node.get("mastery_estimate"),
                 "source_papers": node.get("source_papers"),
                 "is_llm_generated": True
-            }).execute()
+            } for node in nodes])
         
         return NodesResponse(success=True, nodes=[KnowledgeNode(**n) for n in nodes])
         
@@ -724,11 +1059,11 @@ async def upload_paper_file(
     3. Save COMPRESSED content to Supabase (not original)
     4. Generate knowledge nodes from title
     """
-    import asyncio
 
+    upload_task = None
+    nodes_task = None
     try:
-        # Read file and get title immediately
-        file_bytes = await file.read()
+        # Get title immediately
         paper_title = title or (file.filename.replace(".pdf", "").replace("_", " ") if file.filename else "Uploaded Paper")
 
         # Prepare file path
@@ -736,56 +1071,63 @@ async def upload_paper_file(
         file_id = str(uuid.uuid4())
         file_path = f"{user_id}/{file_id}{file_ext}"
 
-        # Initialize PDF processor and compression service
-        pdf_processor = PDFProcessor(extract_images=False)  # Text only for speed
-        compression_service = TokenCompressionService(TOKEN_COMPANY_API_KEY) if TOKEN_COMPANY_API_KEY else None
+        # Spool the PDF to disk; the upload streams from the file while its
+        # text is extracted from the same file
+        async with spool_to_tempfile(file) as pdf_path:
+            file_size_bytes = os.path.getsize(pdf_path)
 
-        # Extract text from PDF
-        extracted_text = ""
-        original_tokens = 0
-        compressed_tokens = 0
-        compression_ratio = 1.0
-        compressed_text = ""
-        compression_success = False
+            # Start the storage upload and the title-only node generation now so
+            # both overlap with text extraction and compression
+            nodes_task = asyncio.create_task(generate_single_paper_nodes(paper_title))
+            upload_task = asyncio.create_task(upload_object(
+                supabase.storage.from_("papers"), file_path, pdf_path, file.content_type or "application/pdf"
+            ))
 
-        try:
-            extracted_text = await pdf_processor.extract_text_only(file_bytes)
-            original_tokens = pdf_processor.estimate_tokens(extracted_text)
+            # Shared PDF processor and compression service
+            pdf_processor = TEXT_PDF_PROCESSOR  # Text only for speed
+            compression_service = COMPRESSION_SERVICE
 
-            # Compress via Token Company BEFORE saving
-            if compression_service and extracted_text:
-                compression_result = await compression_service.compress_for_academic_paper(extracted_text)
+            # Extract text from PDF
+            extracted_text = ""
+            original_tokens = 0
+            compressed_tokens = 0
+            compression_ratio = 1.0
+            compressed_text = ""
+            compression_success = False
 
-                if compression_result.success:
-                    compressed_text = compression_result.compressed_text
-                    compressed_tokens = compression_result.compressed_tokens
-                    compression_ratio = compression_result.compression_ratio
-                    compression_success = True
-                    print(f"[Paper Upload] Compressed {original_tokens} -> {compressed_tokens} tokens ({compression_ratio:.2%})")
+            try:
+                extracted_text = await pdf_processor.extract_text_from_file(pdf_path)
+                original_tokens = pdf_processor.estimate_tokens(extracted_text)
+
+                # Compress via Token Company BEFORE saving
+                if compression_service and extracted_text:
+                    compression_result = await compression_service.compress_for_academic_paper(extracted_text)
+
+                    if compression_result.success:
+                        compressed_text = compression_result.compressed_text
+                        compressed_tokens = compression_result.compressed_tokens
+                        compression_ratio = compression_result.compression_ratio
+                        compression_success = True
+                        print(f"[Paper Upload] Compressed {original_tokens} -> {compressed_tokens} tokens ({compression_ratio:.2%})")
+                    else:
+                        # Fallback to original on compression failure
+                        compressed_text = extracted_text
+                        compressed_tokens = original_tokens
+                        print(f"[Paper Upload] Compression failed: {compression_result.error}")
                 else:
-                    # Fallback to original on compression failure
                     compressed_text = extracted_text
                     compressed_tokens = original_tokens
-                    print(f"[Paper Upload] Compression failed: {compression_result.error}")
-            else:
-                compressed_text = extracted_text
-                compressed_tokens = original_tokens
-
-        except Exception as e:
-            print(f"[Paper Upload] PDF extraction failed: {e}")
-            # Continue without text extraction
 
-        # Upload original PDF to storage in background
-        def upload_to_storage():
-            supabase.storage.from_("papers").upload(file_path, file_bytes, {
-                "content-type": file.content_type or "application/pdf"
-            })
+            except Exception as e:
+                print(f"[Paper Upload] PDF extraction failed: {e}")
+                # Continue without text extraction
 
-        loop = asyncio.get_event_loop()
-        loop.run_in_executor(None, upload_to_storage)
+            # The original PDF must exist in storage before the record references
+            # it, and the upload reads the spooled file
+            await upload_task
 
         # Store paper record with COMPRESSED content in academia_materials
-        supabase.table("academia_materials").insert({
+        await run_query(supabase.table("academia_materials").insert({
             "user_id": user_id,
             "session_id": session_id,
             "title": paper_title,
@@ -794,229 +1136,332 @@ async def upload_paper_file(
             "storage_bucket": "papers",
             "storage_path": file_path,
             "file_name": file.filename,
-            "file_size_bytes": len(file_bytes),
+            "file_size_bytes": file_size_bytes,
             "compressed_text": compressed_text,  # Save compressed, not original
             "original_token_count": original_tokens,
             "compressed_token_count": compressed_tokens,
             "compression_ratio": compression_ratio,
             "compression_aggressiveness": 0.5,  # Academic preset
             "ttc_processed": compression_success,
-            "ttc_processed_at": datetime.utcnow().isoformat() if compression_success else None,
             "pdf_extraction_method": "pymupdf",
             "is_processed": True
-        }).execute()
+        }))
 
-        # Lightweight Gemini call - just title, 3 nodes
-        nodes = await generate_single_paper_nodes(paper_title)
+        # Lightweight Gemini call - just title, 3 nodes (started above)
+        nodes = await nodes_task
 
-        # Store nodes (minimal inserts)
-        for node in nodes:
-            supabase.table("knowledge_nodes").insert({
+        # Store nodes (one bulk insert)
+        if nodes:
+            await insert_rows(supabase, "knowledge_nodes", [{
                 "session_id": session_id,
                 "label": node.get("label"),
                 "type": node.get("type"),
                 "mastery_estimate": node.get("mastery_estimate"),
                 "is_llm_generated": True
-            }).execute()
+            } for node in nodes])
 
         return NodesResponse(success=True, nodes=[KnowledgeNode(**n) for n in nodes])
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Tasks started ahead of a failed upload or write are cancelled, not orphaned
+        await _cancel_unfinished(upload_task, nodes_task)
 
 
-class GoogleDocInput(BaseModel):
-    id: str
-    title: str
-    url: Optional[str] = None
-    mimeType: Optional[str] = None
-    relevanceScore: Optional[float] = None
+async def _fetch_google_doc(
+    doc: GoogleDocInput,
+    access_token: Optional[str],
+    semaphore: asyncio.Semaphore
+) -> str:
+    """Fetch the text content of one selected Google Doc."""
+    doc_content = ""
 
+    async with semaphore:
+        # Fetch document content if access token provided
+        if access_token:
+            try:
+                client = get_http_client()
+                # Determine how to fetch based on mime type
+                if doc.mimeType == "application/vnd.google-apps.document":
+                    # Export Google Doc as plain text
+                    export_url = f"https://www.googleapis.com/drive/v3/files/{doc.id}/export?mimeType=text/plain"
+                    response = await client.get(
+                        export_url,
+                        headers={"Authorization": f"Bearer {access_token}"},
+                        timeout=30.0
+                    )
+                    if response.status_code == 200:
+                        doc_content = response.text
+                elif doc.mimeType == "application/vnd.google-apps.spreadsheet":
+                    # Export Google Sheet as CSV
+                    export_url = f"https://www.googleapis.com/drive/v3/files/{doc.id}/export?mimeType=text/csv"
+                    response = await client.get(
+                        export_url,
+                        headers={"Authorization": f"Bearer {access_token}"},
+                        timeout=30.0
+                    )
+                    if response.status_code == 200:
+                        doc_content = response.text
+                elif doc.mimeType in ["text/plain", "text/markdown", "text/csv"]:
+                    # Download text files directly
+                    download_url = f"https://www.googleapis.com/drive/v3/files/{doc.id}?alt=media"
+                    response = await client.get(
+                        download_url,
+                        headers={"Authorization": f"Bearer {access_token}"},
+                        timeout=30.0
+                    )
+                    if response.status_code == 200:
+                        doc_content = response.text
+                elif doc.mimeType == "application/pdf":
+                    # Stream the PDF to disk and extract text from the file
+                    download_url = f"https://www.googleapis.com/drive/v3/files/{doc.id}?alt=media"
+                    async with download_to_tempfile(download_url, access_token) as pdf_path:
+                        if pdf_path:
+                            doc_content = await TEXT_PDF_PROCESSOR.extract_text_from_file(pdf_path)
+            except (httpx.HTTPError, OSError, RuntimeError, ValueError) as fetch_err:
+                logger.warning("GoogleDocs fetch failed for %s", doc.title, exc_info=fetch_err)
 
-class GoogleDocsRequest(BaseModel):
-    documents: List[GoogleDocInput]
-    session_id: str
-    user_id: int
-    access_token: Optional[str] = None  # Google OAuth access token for fetching content
+    return doc_content
 
 
-@app.post("/api/profile/google-docs", response_model=NodesResponse)
-async def submit_google_docs(request: GoogleDocsRequest):
-    """Process selected Google Docs: fetch content, compress with Token Company, store to Supabase."""
+def _content_hash(text: str) -> Optional[str]:
+    """SHA-256 of document text, used to recognise re-imported documents."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest() if text else None
+
+
+async def _find_stored_google_docs(user_id: int, session_id: str, hashes: list[Optional[str]]) -> dict[str, dict]:
+    """
+    Map content hashes to already-compressed google_docs_materials rows of this user and session.
+
+    Blobs live under the session's own Storage prefix, so reuse stays within
+    the session: deleting another session's objects can't break this one.
+    """
+    wanted = list({h for h in hashes if h})
+    if not wanted:
+        return {}
     try:
-        # Initialize compression service
-        compression_service = TokenCompressionService(TOKEN_COMPANY_API_KEY) if TOKEN_COMPANY_API_KEY else None
+        result = await run_query(
+            supabase.table("google_docs_materials")
+            .select("content_hash, content_snippet, compressed_storage_path, original_tokens, compressed_tokens, compression_ratio, ttc_processed")
+            .eq("user_id", user_id)
+            .eq("session_id", session_id)
+            .in_("content_hash", wanted)
+            .not_.is_("compressed_storage_path", "null")
+        )
+    except (APIError, httpx.HTTPError) as e:
+        logger.warning("GoogleDocs content hash lookup failed", exc_info=e)
+        return {}
+    return {row["content_hash"]: row for row in result.data or []}
+
+
+async def _compress_google_docs(
+    contents: list[str],
+    hashes: list[Optional[str]],
+    stored: dict[str, dict],
+    compression_service: Optional[TokenCompressionService]
+) -> list[dict]:
+    """Compress fetched Google Doc contents with Token Company in one batch."""
+    fetched = []
+    for doc_content, content_hash in zip(contents, hashes):
+        entry = {
+            "doc_content": doc_content,
+            "content_hash": content_hash,
+            "compressed_content": doc_content,
+            "original_tokens": 0,
+            "compressed_tokens": 0,
+            "compression_ratio": 1.0,
+            "compression_success": False,
+            "storage_path": None,
+        }
+        # Identical content was already compressed and uploaded; point at that blob
+        row = stored.get(content_hash)
+        if row:
+            entry["compressed_content"] = row.get("content_snippet") or doc_content
+            entry["original_tokens"] = row.get("original_tokens") or 0
+            entry["compressed_tokens"] = row.get("compressed_tokens") or 0
+            entry["compression_ratio"] = row.get("compression_ratio") or 1.0
+            entry["compression_success"] = bool(row.get("ttc_processed"))
+            entry["storage_path"] = row["compressed_storage_path"]
+        fetched.append(entry)
+
+    # Only new documents with content go to Token Company; results map back by index
+    indices = [i for i, entry in enumerate(fetched) if entry["doc_content"] and not entry["storage_path"]]
+    if not indices or not compression_service:
+        return fetched
+
+    # compress_text reports API failures as unsuccessful results rather than raising
+    results = await compression_service.compress_batch(
+        [contents[i] for i in indices],
+        aggressiveness=compression_service.PRESETS["notes"]
+    )
 
-        # Get session to retrieve central_topic
-        session = supabase.table("learning_sessions").select("*").eq("id", request.session_id).single().execute()
-        central_topic = session.data["central_topic"]
+    for i, compression_result in zip(indices, results):
+        entry = fetched[i]
+        if compression_result.success:
+            entry["compressed_content"] = compression_result.compressed_text
+            entry["original_tokens"] = compression_result.original_tokens
+            entry["compressed_tokens"] = compression_result.compressed_tokens
+            entry["compression_ratio"] = compression_result.compression_ratio
+            entry["compression_success"] = True
+        else:
+            # Failed results already carry the uncompressed estimate
+            entry["original_tokens"] = compression_result.original_tokens
+            entry["compressed_tokens"] = compression_result.original_tokens
+    return fetched
+
+
+async def _mark_google_docs_pending(documents: List[GoogleDocInput], session_id: str, user_id: int) -> None:
+    """Record submitted docs as persist_status 'pending' before their deferred writes start (migration 012)."""
+    if not documents:
+        return
+    rows = [{
+        "session_id": session_id,
+        "user_id": user_id,
+        "google_doc_id": doc.id,
+        "title": doc.title,
+        "url": doc.url,
+        "mime_type": doc.mimeType,
+        "relevance_score": doc.relevanceScore,
+        "is_selected": True,
+        "persist_status": "pending",
+        "persist_error": None,
+    } for doc in documents]
+    try:
+        await _with_retries(
+            lambda: run_query(supabase.table("google_docs_materials").upsert(rows, on_conflict="session_id,google_doc_id")),
+            "GoogleDocs pending status upsert",
+            (APIError, httpx.HTTPError),
+        )
+    except Exception as e:
+        logger.warning("GoogleDocs pending status upsert failed", exc_info=e)
 
-        # Get existing nodes
-        existing_nodes_result = supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id).execute()
-        existing_labels = [n["label"] for n in existing_nodes_result.data]
 
-        # Process each Google Doc
-        doc_titles = []
-        doc_contents = []
+async def _mark_google_doc_failed(session_id: str, doc_id: str, error: str) -> None:
+    try:
+        await run_query(supabase.table("google_docs_materials").update({
+            "persist_status": "failed",
+            "persist_error": error[:1000],
+        }).eq("session_id", session_id).eq("google_doc_id", doc_id))
+    except Exception as e:
+        logger.error("GoogleDocs failed status update failed for %s", doc_id, exc_info=e)
+
 
-        for doc in request.documents:
-            doc_titles.append(doc.title)
-            doc_content = ""
-            compressed_content = ""
-            original_tokens = 0
-            compressed_tokens = 0
-            compression_ratio = 1.0
-            compression_success = False
+async def _store_google_doc(
+    doc: GoogleDocInput,
+    session_id: str,
+    user_id: int,
+    fetched: dict
+) -> None:
+    """
+    Write one processed Google Doc to storage and upsert its google_docs_materials row.
 
-            # Fetch document content if access token provided
-            if request.access_token:
-                try:
-                    async with httpx.AsyncClient() as client:
-                        # Determine how to fetch based on mime type
-                        if doc.mimeType == "application/vnd.google-apps.document":
-                            # Export Google Doc as plain text
-                            export_url = f"https://www.googleapis.com/drive/v3/files/{doc.id}/export?mimeType=text/plain"
-                            response = await client.get(
-                                export_url,
-                                headers={"Authorization": f"Bearer {request.access_token}"},
-                                timeout=30.0
-                            )
-                            if response.status_code == 200:
-                                doc_content = response.text
-                        elif doc.mimeType == "application/vnd.google-apps.spreadsheet":
-                            # Export Google Sheet as CSV
-                            export_url = f"https://www.googleapis.com/drive/v3/files/{doc.id}/export?mimeType=text/csv"
-                            response = await client.get(
-                                export_url,
-                                headers={"Authorization": f"Bearer {request.access_token}"},
-                                timeout=30.0
-                            )
-                            if response.status_code == 200:
-                                doc_content = response.text
-                        elif doc.mimeType in ["text/plain", "text/markdown", "text/csv"]:
-                            # Download text files directly
-                            download_url = f"https://www.googleapis.com/drive/v3/files/{doc.id}?alt=media"
-                            response = await client.get(
-                                download_url,
-                                headers={"Authorization": f"Bearer {request.access_token}"},
-                                timeout=30.0
-                            )
-                            if response.status_code == 200:
-                                doc_content = response.text
-                        elif doc.mimeType == "application/pdf":
-                            # Download PDF and extract text
-                            download_url = f"https://www.googleapis.com/drive/v3/files/{doc.id}?alt=media"
-                            response = await client.get(
-                                download_url,
-                                headers={"Authorization": f"Bearer {request.access_token}"},
-                                timeout=60.0
-                            )
-                            if response.status_code == 200:
-                                pdf_processor = PDFProcessor(extract_images=False)
-                                doc_content = await pdf_processor.extract_text_only(response.content)
-                except Exception as fetch_err:
-                    print(f"[GoogleDocs] Failed to fetch content for {doc.title}: {fetch_err}")
-
-            # Compress content with Token Company if we have content
-            if doc_content and compression_service:
-                try:
-                    compression_result = await compression_service.compress_for_notes(doc_content)
-                    if compression_result.success:
-                        compressed_content = compression_result.compressed_text
-                        original_tokens = compression_result.original_tokens
-                        compressed_tokens = compression_result.compressed_tokens
-                        compression_ratio = compression_result.compression_ratio
-                        compression_success = True
-                    else:
-                        compressed_content = doc_content
-                        original_tokens = compression_service._estimate_tokens(doc_content)
-                        compressed_tokens = original_tokens
-                except Exception as comp_err:
-                    print(f"[GoogleDocs] Compression failed for {doc.title}: {comp_err}")
-                    compressed_content = doc_content
-            elif doc_content:
-                compressed_content = doc_content
+    Each write is retried with backoff. The row's persist_status ends as
+    'stored' or 'failed', whatever goes wrong, and is served by
+    /api/profile/google-docs/status.
+    """
+    try:
+        error = await _write_google_doc(doc, session_id, user_id, fetched)
+    except Exception as e:
+        logger.exception("GoogleDocs persist failed for %s", doc.title)
+        error = f"{type(e).__name__}: {e}"
+    if error:
+        await _mark_google_doc_failed(session_id, doc.id, error)
 
-            # Store compressed content to Supabase storage
-            storage_path = None
-            if compressed_content:
-                try:
-                    storage_path = f"{request.user_id}/{request.session_id}/google_docs/{doc.id}.json"
-                    content_json = json.dumps({
-                        "text": compressed_content,
-                        "metadata": {
-                            "doc_id": doc.id,
-                            "title": doc.title,
-                            "mime_type": doc.mimeType,
-                            "original_tokens": original_tokens,
-                            "compressed_tokens": compressed_tokens,
-                            "compression_ratio": compression_ratio
-                        }
-                    })
-                    try:
-                        supabase.storage.from_("compressed_documents").upload(
-                            storage_path,
-                            content_json.encode(),
-                            {"content-type": "application/json"}
-                        )
-                    except:
-                        supabase.storage.from_("compressed_documents").update(
-                            storage_path,
-                            content_json.encode(),
-                            {"content-type": "application/json"}
-                        )
-                except Exception as store_err:
-                    print(f"[GoogleDocs] Failed to store content for {doc.title}: {store_err}")
-                    storage_path = None
-
-            # Store in google_docs_materials table with compression stats
-            try:
-                supabase.table("google_docs_materials").upsert({
-                    "session_id": request.session_id,
-                    "user_id": request.user_id,
-                    "google_doc_id": doc.id,
+
+async def _write_google_doc(
+    doc: GoogleDocInput,
+    session_id: str,
+    user_id: int,
+    fetched: dict
+) -> Optional[str]:
+    """Upload and upsert one Google Doc; returns an error when its row could not record the outcome."""
+    error = None
+    doc_content = fetched["doc_content"]
+    compressed_content = fetched["compressed_content"]
+    original_tokens = fetched["original_tokens"]
+    compressed_tokens = fetched["compressed_tokens"]
+    compression_ratio = fetched["compression_ratio"]
+    compression_success = fetched["compression_success"]
+
+    # Store compressed content to Supabase storage unless a copy already exists;
+    # documents that could not be fetched only get their metadata row
+    storage_path = fetched["storage_path"]
+    if doc_content and not storage_path:
+        try:
+            storage_path = f"{user_id}/{session_id}/google_docs/{doc.id}.json"
+            content_json = orjson.dumps({
+                "text": compressed_content,
+                "metadata": {
+                    "doc_id": doc.id,
                     "title": doc.title,
-                    "url": doc.url,
                     "mime_type": doc.mimeType,
-                    "relevance_score": doc.relevanceScore,
-                    "is_selected": True,
-                    "content_snippet": (compressed_content or doc_content)[:4000],
-                    "compressed_storage_bucket": "compressed_documents" if storage_path else None,
-                    "compressed_storage_path": storage_path,
                     "original_tokens": original_tokens,
                     "compressed_tokens": compressed_tokens,
-                    "compression_ratio": compression_ratio,
-                    "ttc_processed": compression_success,
-                    "is_processed": bool(compressed_content)
-                }, on_conflict="session_id,google_doc_id").execute()
-            except Exception as e:
-                print(f"[GoogleDocs] Failed to store doc metadata: {e}")
-                try:
-                    supabase.table("google_docs_materials").upsert({
-                        "session_id": request.session_id,
-                        "user_id": request.user_id,
-                        "google_doc_id": doc.id,
-                        "title": doc.title,
-                        "url": doc.url,
-                        "mime_type": doc.mimeType,
-                        "relevance_score": doc.relevanceScore,
-                        "is_selected": True,
-                        "content_snippet": (compressed_content or doc_content)[:4000],
-                    }, on_conflict="session_id,google_doc_id").execute()
-                except Exception as fallback_err:
-                    print(f"[GoogleDocs] Failed fallback metadata store: {fallback_err}")
-
-            if doc_content:
-                doc_contents.append({"title": doc.title, "content": (compressed_content or doc_content)[:2000]})  # Preview for node generation
+                    "compression_ratio": compression_ratio
+                }
+            })
+            await _with_retries(
+                lambda: upload_object(
+                    supabase.storage.from_("compressed_documents"), storage_path, content_json, "application/json; charset=utf-8"
+                ),
+                f"GoogleDocs storage upload for {doc.title}",
+                (StorageException, httpx.HTTPError),
+            )
+        except (StorageException, httpx.HTTPError) as store_err:
+            logger.error("GoogleDocs storage upload failed for %s", doc.title, exc_info=store_err)
+            storage_path = None
+            error = f"Storage upload failed: {store_err}"
+
+    # Store in google_docs_materials table with compression stats
+    base_row = {
+        "session_id": session_id,
+        "user_id": user_id,
+        "google_doc_id": doc.id,
+        "title": doc.title,
+        "url": doc.url,
+        "mime_type": doc.mimeType,
+        "relevance_score": doc.relevanceScore,
+        "is_selected": True,
+        "content_snippet": (compressed_content or doc_content)[:4000],
+    }
+    full_row = {
+        **base_row,
+        "compressed_storage_bucket": "compressed_documents" if storage_path else None,
+        "compressed_storage_path": storage_path,
+        "original_tokens": original_tokens,
+        "compressed_tokens": compressed_tokens,
+        "compression_ratio": compression_ratio,
+        "ttc_processed": compression_success,
+        "is_processed": bool(compressed_content),
+        "content_hash": fetched["content_hash"],
+        "persist_status": "failed" if error else "stored",
+        "persist_error": error
+    }
 
-        # Generate nodes from document titles AND content using Gemini
-        titles_formatted = "\n".join([f"{i+1}. {t}" for i, t in enumerate(doc_titles)])
-        content_preview = "\n\n".join([f"=== {d['title']} ===\n{d['content']}" for d in doc_contents[:5]]) if doc_contents else "No content fetched"
-        existing_formatted = ", ".join(existing_labels) if existing_labels else "None yet"
+    def upsert(row: dict):
+        return _with_retries(
+            lambda: run_query(supabase.table("google_docs_materials").upsert(row, on_conflict="session_id,google_doc_id")),
+            f"GoogleDocs metadata upsert for {doc.title}",
+            (APIError, httpx.HTTPError),
+        )
+
+    try:
+        await upsert(full_row)
+        return None
+    except (APIError, httpx.HTTPError) as e:
+        # Older schemas lack the compression columns; retry with the base row
+        logger.warning("GoogleDocs metadata upsert failed for %s", doc.title, exc_info=e)
+        try:
+            await upsert(base_row)
+        except (APIError, httpx.HTTPError) as fallback_err:
+            logger.error("GoogleDocs fallback metadata upsert failed for %s", doc.title, exc_info=fallback_err)
+            return f"Metadata upsert failed: {fallback_err}"
+    return error
 
-        prompt = f"""You are analyzing a researcher's Google Drive documents to map their knowledge graph.
+
+GOOGLE_DOCS_NODES_PROMPT = """You are analyzing a researcher's Google Drive documents to map their knowledge graph.
 
 INPUT:
 - Central research question: "{central_topic}"
@@ -1024,32 +1469,112 @@ INPUT:
 - Documents found:
 {titles_formatted}
 
-CONTENT PREVIEW (first 2000 chars of each):
-{content_preview[:8000]}
+CONTENT PREVIEW (first 2000 chars of each):
+{content_preview}
+
+TASK:
+Based on both the titles AND the actual content, identify up to 15 specific concepts, methods, or theories this researcher has notes on or understands.
+
+OUTPUT FORMAT (strict JSON, no markdown):
+{{
+  "nodes": [
+    {{
+      "label": "concept name (1-3 words)",
+      "type": "concept" | "method" | "theory" | "tool",
+      "domain": "field/subject area",
+      "relevance_to_topic": "brief explanation of how this relates to their research question",
+      "mastery_estimate": 0.0-1.0
+    }}
+  ]
+}}"""
+
+
+def _bounded_join(docs: list[dict], max_docs: int = 5, max_chars: int = 8000) -> str:
+    """Join document previews under title headers, stopping once max_chars is reached."""
+    sections = []
+    length = 0
+    for d in docs[:max_docs]:
+        section = f"=== {d['title']} ===\n{d['content'][:2000]}"
+        sections.append(section)
+        length += len(section) + 2
+        if length >= max_chars:
+            break
+    return "\n\n".join(sections)[:max_chars]
+
+
+@app.get("/api/profile/google-docs/status/{session_id}")
+async def get_google_docs_status(session_id: str):
+    """Report whether each submitted Google Doc's deferred Storage and metadata writes succeeded."""
+    result = await run_query(
+        supabase.table("google_docs_materials")
+        .select("google_doc_id, persist_status, persist_error")
+        .eq("session_id", session_id)
+    )
+    return {
+        "documents": {
+            row["google_doc_id"]: {"status": row.get("persist_status"), "error": row.get("persist_error")}
+            for row in result.data or []
+        }
+    }
+
+
+@app.post("/api/profile/google-docs", response_model=NodesResponse)
+async def submit_google_docs(request: GoogleDocsRequest):
+    """Process selected Google Docs: fetch content, compress with Token Company, store to Supabase."""
+    try:
+        # Initialize compression service
+        compression_service = COMPRESSION_SERVICE
+
+        # Get session to retrieve central_topic
+        central_topic = await get_central_topic(request.session_id)
+
+        # Get existing nodes
+        existing_nodes_result = await run_query(supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id))
+        existing_labels = [n["label"] for n in existing_nodes_result.data]
+
+        # Fetch every document concurrently (bounded for Drive quotas) and
+        # compress the fetched texts in one batch
+        doc_titles = [doc.title for doc in request.documents]
+        semaphore = asyncio.Semaphore(GOOGLE_DOC_FETCH_CONCURRENCY)
+        contents = await asyncio.gather(*(
+            _fetch_google_doc(doc, request.access_token, semaphore)
+            for doc in request.documents
+        ))
+        hashes = [_content_hash(doc_content) for doc_content in contents]
+        stored = await _find_stored_google_docs(request.user_id, request.session_id, hashes)
+        fetched_docs = await _compress_google_docs(contents, hashes, stored, compression_service)
+        # Storage uploads and google_docs_materials rows don't affect the
+        # generated nodes; write them after the response
+        await _mark_google_docs_pending(request.documents, request.session_id, request.user_id)
+        for doc, fetched in zip(request.documents, fetched_docs):
+            _spawn_persist(_store_google_doc(doc, request.session_id, request.user_id, fetched))
+
+        # Previews for node generation
+        doc_contents = [
+            {"title": doc.title, "content": fetched["compressed_content"][:2000]}
+            for doc, fetched in zip(request.documents, fetched_docs)
+            if fetched["doc_content"]
+        ]
 
-TASK:
-Based on both the titles AND the actual content, identify up to 15 specific concepts, methods, or theories this researcher has notes on or understands.
+        # Generate nodes from document titles AND content using Gemini
+        titles_formatted = "\n".join([f"{i+1}. {t}" for i, t in enumerate(doc_titles)])
+        content_preview = _bounded_join(doc_contents) if doc_contents else "No content fetched"
+        existing_formatted = ", ".join(existing_labels) if existing_labels else "None yet"
 
-OUTPUT FORMAT (strict JSON, no markdown):
-{{
-  "nodes": [
-    {{
-      "label": "concept name (1-3 words)",
-      "type": "concept" | "method" | "theory" | "tool",
-      "domain": "field/subject area",
-      "relevance_to_topic": "brief explanation of how this relates to their research question",
-      "mastery_estimate": 0.0-1.0
-    }}
-  ]
-}}"""
+        prompt = GOOGLE_DOCS_NODES_PROMPT.format_map({
+            "central_topic": central_topic,
+            "existing_formatted": existing_formatted,
+            "titles_formatted": titles_formatted,
+            "content_preview": content_preview,
+        })
 
-        response_text = await call_gemini(prompt)
+        response_text = await call_gemini(prompt, task="google_docs_nodes")
         result = extract_json_from_response(response_text)
         nodes = result.get("nodes", [])
 
-        # Store nodes in database
-        for node in nodes:
-            supabase.table("knowledge_nodes").insert({
+        # Store nodes in database (one bulk insert)
+        if nodes:
+            await insert_rows(supabase, "knowledge_nodes", [{
                 "session_id": request.session_id,
                 "label": node.get("label"),
                 "type": node.get("type"),
@@ -1058,12 +1583,11 @@ OUTPUT FORMAT (strict JSON, no markdown):
                 "relevance_to_topic": node.get("relevance_to_topic"),
                 "source": "google_drive",
                 "is_llm_generated": True
-            }).execute()
+            } for node in nodes])
 
         return NodesResponse(success=True, nodes=[KnowledgeNode(**n) for n in nodes])
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1071,23 +1595,17 @@ OUTPUT FORMAT (strict JSON, no markdown):
 @app.get("/api/session/{session_id}/nodes")
 async def get_session_nodes(session_id: str):
     """Get all knowledge nodes for a session."""
-    result = supabase.table("knowledge_nodes").select("*").eq("session_id", session_id).execute()
+    result = await run_query(supabase.table("knowledge_nodes").select("*").eq("session_id", session_id))
     return {"nodes": result.data}
 
 
 @app.get("/api/session/{session_id}")
 async def get_session(session_id: str):
     """Get session details."""
-    result = supabase.table("learning_sessions").select("*").eq("id", session_id).single().execute()
+    result = await run_query(supabase.table("learning_sessions").select("*").eq("id", session_id).single())
     return result.data
 
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint."""
-    return {"status": "healthy"}
-
-
 # ============ Zotero OAuth Endpoints ============
 
 @app.post("/api/zotero/oauth/initiate", response_model=ZoteroOAuthInitiateResponse)
@@ -1107,12 +1625,12 @@ async def zotero_oauth_initiate(request: ZoteroOAuthInitiateRequest):
         state_token = secrets.token_urlsafe(32)
 
         # Store temporary OAuth state in database
-        supabase.table("zotero_oauth_states").insert({
+        await run_query(supabase.table("zotero_oauth_states").insert({
             "state_token": state_token,
             "oauth_token": oauth_token,
             "oauth_token_secret": oauth_token_secret,
             "user_id": request.user_id,
-        }).execute()
+        }))
 
         # Build authorization URL
         authorization_url = f"https://www.zotero.org/oauth/authorize?oauth_token={oauth_token}&library_access=1&notes_access=1&write_access=0"
@@ -1123,7 +1641,6 @@ async def zotero_oauth_initiate(request: ZoteroOAuthInitiateRequest):
         )
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1135,7 +1652,7 @@ async def zotero_oauth_callback(oauth_token: str, oauth_verifier: str, state: st
         print(f"[Zotero Callback] Received oauth_token={oauth_token[:10]}..., oauth_verifier={oauth_verifier[:10]}..., state={state[:10]}...")
 
         # Look up the OAuth state
-        state_result = supabase.table("zotero_oauth_states").select("*").eq("state_token", state).single().execute()
+        state_result = await run_query(supabase.table("zotero_oauth_states").select("*").eq("state_token", state).single())
         if not state_result.data:
             print(f"[Zotero Callback] State not found: {state}")
             raise HTTPException(status_code=400, detail="Invalid or expired OAuth state")
@@ -1148,12 +1665,11 @@ async def zotero_oauth_callback(oauth_token: str, oauth_verifier: str, state: st
 
         # Check if state has expired
         if expires_at:
-            from datetime import timezone
             expires_dt = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
             if datetime.now(timezone.utc) > expires_dt:
                 print(f"[Zotero Callback] State expired at {expires_at}")
                 # Clean up expired state
-                supabase.table("zotero_oauth_states").delete().eq("state_token", state).execute()
+                await run_query(supabase.table("zotero_oauth_states").delete().eq("state_token", state))
                 raise HTTPException(status_code=400, detail="OAuth state expired. Please try connecting again.")
 
         # Verify the oauth_token matches what we stored
@@ -1171,28 +1687,28 @@ async def zotero_oauth_callback(oauth_token: str, oauth_verifier: str, state: st
         )
 
         # Check if connection already exists
-        existing = supabase.table("zotero_connections").select("id").eq("user_id", user_id).execute()
+        existing = await run_query(supabase.table("zotero_connections").select("id").eq("user_id", user_id))
 
         if existing.data:
             # Update existing connection
-            supabase.table("zotero_connections").update({
+            await run_query(supabase.table("zotero_connections").update({
                 "zotero_user_id": zotero_user_id,
                 "oauth_token": access_token,
                 "oauth_token_secret": access_token_secret,
                 "username": username,
-            }).eq("user_id", user_id).execute()
+            }).eq("user_id", user_id))
         else:
             # Create new connection
-            supabase.table("zotero_connections").insert({
+            await run_query(supabase.table("zotero_connections").insert({
                 "user_id": user_id,
                 "zotero_user_id": zotero_user_id,
                 "oauth_token": access_token,
                 "oauth_token_secret": access_token_secret,
                 "username": username,
-            }).execute()
+            }))
 
         # Clean up OAuth state
-        supabase.table("zotero_oauth_states").delete().eq("state_token", state).execute()
+        await run_query(supabase.table("zotero_oauth_states").delete().eq("state_token", state))
 
         return {
             "success": True,
@@ -1203,7 +1719,6 @@ async def zotero_oauth_callback(oauth_token: str, oauth_verifier: str, state: st
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1212,7 +1727,7 @@ async def zotero_oauth_callback(oauth_token: str, oauth_verifier: str, state: st
 async def zotero_connection_status(user_id: int):
     """Check if user has connected their Zotero account."""
     try:
-        result = supabase.table("zotero_connections").select("zotero_user_id, username").eq("user_id", user_id).execute()
+        result = await run_query(supabase.table("zotero_connections").select("zotero_user_id, username").eq("user_id", user_id))
 
         if result.data and len(result.data) > 0:
             return ZoteroConnectionStatus(
@@ -1231,18 +1746,38 @@ async def zotero_connection_status(user_id: int):
 async def zotero_disconnect(user_id: int):
     """Disconnect user's Zotero account."""
     try:
-        supabase.table("zotero_connections").delete().eq("user_id", user_id).execute()
+        await run_query(supabase.table("zotero_connections").delete().eq("user_id", user_id))
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _simplify_zotero_item(item: dict) -> dict:
+    """Reduce a Zotero API item to the fields the item picker shows."""
+    data = item.get("data", {})
+    abstract = data.get("abstractNote")
+    return {
+        "key": item.get("key"),
+        "title": data.get("title", "Untitled"),
+        "itemType": data.get("itemType", "unknown"),
+        "creators": [
+            f"{c.get('firstName') or ''} {c.get('lastName') or ''}".strip()
+            for c in data.get("creators", [])
+            if c.get("creatorType") == "author"
+        ],
+        "date": data.get("date"),
+        "url": data.get("url"),
+        "DOI": data.get("DOI"),
+        "abstractNote": abstract[:500] if abstract else None
+    }
+
+
 @app.get("/api/zotero/items/{user_id}")
 async def get_zotero_items(user_id: int, limit: int = 100):
     """Fetch items from user's Zotero library."""
     try:
         # Get user's Zotero connection
-        connection = supabase.table("zotero_connections").select("*").eq("user_id", user_id).single().execute()
+        connection = await run_query(supabase.table("zotero_connections").select("*").eq("user_id", user_id).single())
 
         if not connection.data:
             raise HTTPException(status_code=404, detail="Zotero not connected")
@@ -1253,59 +1788,70 @@ async def get_zotero_items(user_id: int, limit: int = 100):
         if not oauth_token:
             raise HTTPException(status_code=400, detail="Invalid Zotero connection - missing token")
 
-        # Fetch items from Zotero API
+        # Fetch items from Zotero API; unchanged libraries answer 304
         url = f"https://api.zotero.org/users/{zotero_user_id}/items"
         headers = {
             "Authorization": f"Bearer {oauth_token}",
             "Zotero-API-Version": "3"
         }
         params = {
-            "limit": limit,
+            "limit": min(limit, ZOTERO_PAGE_SIZE),
             "sort": "dateModified",
             "direction": "desc",
             "itemType": "-attachment"  # Exclude attachments
         }
+        cache_key = (str(zotero_user_id), limit)
+        cached = ZOTERO_ITEMS_CACHE.get(cache_key)
+        if cached:
+            headers["If-Modified-Since-Version"] = cached[0]
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, params=params, timeout=30.0)
+        client = get_http_client()
+        response = await client.get(url, headers=headers, params=params, timeout=30.0)
 
-            if response.status_code == 403:
-                raise HTTPException(status_code=403, detail="Zotero access denied - please reconnect")
+        if response.status_code == 403:
+            raise HTTPException(status_code=403, detail="Zotero access denied - please reconnect")
+        if response.status_code == 304 and cached:
+            return cached[1]
 
-            response.raise_for_status()
-            items = response.json()
+        response.raise_for_status()
+        items = orjson.loads(response.content)
+
+        # Libraries larger than one page: fetch the remaining pages concurrently
+        total = min(limit, int(response.headers.get("Total-Results", len(items))))
+        if total > ZOTERO_PAGE_SIZE:
+            page_headers = {k: v for k, v in headers.items() if k != "If-Modified-Since-Version"}
+            pages = await asyncio.gather(*(
+                client.get(
+                    url,
+                    headers=page_headers,
+                    params={**params, "start": start, "limit": min(ZOTERO_PAGE_SIZE, total - start)},
+                    timeout=30.0
+                )
+                for start in range(ZOTERO_PAGE_SIZE, total, ZOTERO_PAGE_SIZE)
+            ))
+            for page in pages:
+                page.raise_for_status()
+                items.extend(orjson.loads(page.content))
 
         # Transform items to a simpler format
-        result = []
-        for item in items:
-            data = item.get("data", {})
-            if data.get("itemType") == "attachment":
-                continue
-
-            creators = data.get("creators", [])
-            authors = [
-                f"{c.get('firstName', '')} {c.get('lastName', '')}".strip()
-                for c in creators
-                if c.get("creatorType") == "author"
-            ]
-
-            result.append({
-                "key": item.get("key"),
-                "title": data.get("title", "Untitled"),
-                "itemType": data.get("itemType", "unknown"),
-                "creators": authors,
-                "date": data.get("date"),
-                "url": data.get("url"),
-                "DOI": data.get("DOI"),
-                "abstractNote": data.get("abstractNote", "")[:500] if data.get("abstractNote") else None
-            })
+        result = [
+            _simplify_zotero_item(item)
+            for item in items
+            if item.get("data", {}).get("itemType") != "attachment"
+        ]
 
-        return {"items": result, "total": len(result)}
+        payload = {"items": result, "total": len(result)}
+        version = response.headers.get("Last-Modified-Version")
+        if version:
+            ZOTERO_ITEMS_CACHE.pop(cache_key, None)
+            ZOTERO_ITEMS_CACHE[cache_key] = (version, payload)
+            if len(ZOTERO_ITEMS_CACHE) > ZOTERO_ITEMS_CACHE_SIZE:
+                ZOTERO_ITEMS_CACHE.pop(next(iter(ZOTERO_ITEMS_CACHE)))
+        return payload
 
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1338,84 +1884,91 @@ class ZoteroItemsRequest(BaseModel):
     user_id: int
 
 
+_YEAR_RE = re.compile(r"\b(1[5-9]\d{2}|20\d{2}|21\d{2})\b")
+
+
+def _publication_year(date: Optional[str]) -> Optional[int]:
+    """Pull a four-digit year out of Zotero's free-form date field."""
+    year_match = _YEAR_RE.search(date) if date else None
+    return int(year_match.group(1)) if year_match else None
+
+
 @app.post("/api/profile/zotero-items", response_model=NodesResponse)
 async def submit_zotero_items(request: ZoteroItemsRequest):
     """Process selected Zotero items and generate knowledge nodes."""
     try:
         # Get session to retrieve central_topic
-        session = supabase.table("learning_sessions").select("*").eq("id", request.session_id).single().execute()
-        central_topic = session.data["central_topic"]
+        central_topic = await get_central_topic(request.session_id)
 
-        # Get existing nodes
-        existing_nodes_result = supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id).execute()
-        existing_labels = [n["label"] for n in existing_nodes_result.data]
+        # Get existing nodes; their ids also resolve generated parent labels
+        existing_nodes_result = await run_query(supabase.table("knowledge_nodes").select("id, label").eq("session_id", request.session_id))
+        label_to_id = {n["label"]: n["id"] for n in existing_nodes_result.data}
+        existing_labels = list(label_to_id)
 
-        # Store Zotero items and collect titles
-        paper_titles = []
-        for item in request.items:
-            paper_titles.append(item.title)
-
-            # Store in academia_materials table
+        # Store Zotero items in academia_materials (one bulk insert) and collect titles
+        paper_titles = [item.title for item in request.items]
+        if request.items:
+            rows = [{
+                "session_id": request.session_id,
+                "user_id": request.user_id,
+                "title": item.title,
+                "material_type": "paper_read",
+                "source_type": "zotero_import",
+                "doi": item.DOI,
+                "url": item.url or (f"https://doi.org/{item.DOI}" if item.DOI else None),
+                "notes": item.abstractNote,
+                "authors": item.creators,
+                "publication_year": _publication_year(item.date),
+                "tags": ["zotero", item.key] if item.key else ["zotero"],
+                "is_processed": False  # No full text available from Zotero metadata
+            } for item in request.items]
             try:
-                publication_year = None
-                if item.date:
-                    year_match = re.search(r"\b(1[5-9]\d{2}|20\d{2}|21\d{2})\b", item.date)
-                    if year_match:
-                        publication_year = int(year_match.group(1))
-
-                supabase.table("academia_materials").insert({
-                    "session_id": request.session_id,
-                    "user_id": request.user_id,
-                    "title": item.title,
-                    "material_type": "paper_read",
-                    "source_type": "zotero_import",
-                    "doi": item.DOI,
-                    "url": item.url or (f"https://doi.org/{item.DOI}" if item.DOI else None),
-                    "notes": item.abstractNote,
-                    "authors": item.creators,
-                    "publication_year": publication_year,
-                    "tags": ["zotero", item.key] if item.key else ["zotero"],
-                    "is_processed": False  # No full text available from Zotero metadata
-                }).execute()
+                await run_query(supabase.table("academia_materials").insert(rows))
             except Exception as e:
-                print(f"[Zotero] Failed to store item: {e}")
+                # A bulk insert is all-or-nothing; retry item by item so one
+                # bad item doesn't drop the rest
+                logger.warning("Zotero bulk insert of %d items failed, inserting individually", len(rows), exc_info=e)
+                results = await asyncio.gather(
+                    *(run_query(supabase.table("academia_materials").insert(row)) for row in rows),
+                    return_exceptions=True
+                )
+                for item, result in zip(request.items, results):
+                    if isinstance(result, Exception):
+                        logger.warning("Zotero failed to store item %s", item.key or item.title, exc_info=result)
 
         # Generate nodes from paper titles using Gemini
         if len(paper_titles) > 5:
             # For many papers, use batch processing
             nodes = await generate_paper_nodes(central_topic, existing_labels, paper_titles)
         else:
-            # For few papers, generate nodes individually
-            all_nodes = []
-            for title in paper_titles:
-                paper_nodes = await generate_single_paper_nodes(title)
-                all_nodes.extend(paper_nodes)
-            nodes = all_nodes
-
-        # Store nodes in database
-        for node in nodes:
-            # Find parent node ID if specified
-            parent_id = None
-            if node.get("parent_node"):
-                parent_result = supabase.table("knowledge_nodes").select("id").eq("session_id", request.session_id).eq("label", node["parent_node"]).execute()
-                if parent_result.data:
-                    parent_id = parent_result.data[0]["id"]
-
-            supabase.table("knowledge_nodes").insert({
+            # For few papers, generate nodes per title concurrently
+            results = await asyncio.gather(
+                *(generate_single_paper_nodes(title) for title in paper_titles),
+                return_exceptions=True
+            )
+            nodes = []
+            for title, paper_nodes in zip(paper_titles, results):
+                if isinstance(paper_nodes, Exception):
+                    logger.warning("Zotero node generation failed for %r", title, exc_info=paper_nodes)
+                    continue
+                nodes.extend(paper_nodes)
+
+        # Store nodes in database; parent labels resolve against the prefetched nodes
+        if nodes:
+            await insert_rows(supabase, "knowledge_nodes", [{
                 "session_id": request.session_id,
                 "label": node.get("label"),
                 "type": node.get("type"),
-                "parent_node_id": parent_id,
+                "parent_node_id": label_to_id.get(node.get("parent_node")),
                 "mastery_estimate": node.get("mastery_estimate"),
                 "source_papers": node.get("source_papers"),
                 "source": "zotero",
                 "is_llm_generated": True
-            }).execute()
+            } for node in nodes])
 
         return NodesResponse(success=True, nodes=[KnowledgeNode(**n) for n in nodes])
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1463,7 +2016,7 @@ async def extract_textbook_chapters(request: ExtractChaptersRequest):
         save_to_db: Whether to save chapters to database (default: true)
     """
     try:
-        firecrawl = FirecrawlService(ttc_api_key=TOKEN_COMPANY_API_KEY)
+        firecrawl = get_firecrawl()
 
         result = await firecrawl.extract_chapters(url=request.url, compress=True)
 
@@ -1474,10 +2027,12 @@ async def extract_textbook_chapters(request: ExtractChaptersRequest):
                 error=result.error
             )
 
-        # Optionally store chapters in database with COMPRESSED markdown
+        # Optionally store chapters in database with COMPRESSED markdown; the
+        # chapter insert and the content upsert are independent and run together
         if request.save_to_db and request.session_id and request.user_id:
-            for chapter in result.chapters:
-                supabase.table("textbook_chapters").insert({
+            writes = []
+            if result.chapters:
+                writes.append(run_query(supabase.table("textbook_chapters").insert([{
                     "session_id": request.session_id,
                     "user_id": request.user_id,
                     "source_url": request.url,
@@ -1485,11 +2040,11 @@ async def extract_textbook_chapters(request: ExtractChaptersRequest):
                     "title": chapter.title,
                     "subtopics": chapter.subtopics,
                     "chapter_url": chapter.url,
-                }).execute()
+                } for chapter in result.chapters])))
 
             # Store the compressed content in a new table for the session
             if result.compressed_markdown:
-                supabase.table("scraped_content").upsert({
+                writes.append(run_query(supabase.table("scraped_content").upsert({
                     "session_id": request.session_id,
                     "user_id": request.user_id,
                     "source_url": request.url,
@@ -1498,7 +2053,9 @@ async def extract_textbook_chapters(request: ExtractChaptersRequest):
                     "original_tokens": result.original_tokens,
                     "compressed_tokens": result.compressed_tokens,
                     "compression_ratio": result.compression_ratio,
-                }, on_conflict="session_id,source_url").execute()
+                }, on_conflict="session_id,source_url")))
+
+            await asyncio.gather(*writes)
 
         return ExtractChaptersResponse(
             success=True,
@@ -1514,7 +2071,6 @@ async def extract_textbook_chapters(request: ExtractChaptersRequest):
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1528,7 +2084,7 @@ async def scrape_url(request: ScrapeUrlRequest):
     Returns both original and compressed markdown for efficiency.
     """
     try:
-        firecrawl = FirecrawlService(ttc_api_key=TOKEN_COMPANY_API_KEY)
+        firecrawl = get_firecrawl()
 
         result = await firecrawl.scrape_url(
             url=request.url,
@@ -1542,7 +2098,6 @@ async def scrape_url(request: ScrapeUrlRequest):
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1551,7 +2106,7 @@ async def scrape_url(request: ScrapeUrlRequest):
 async def get_session_chapters(session_id: str):
     """Get all extracted textbook chapters for a session."""
     try:
-        result = supabase.table("textbook_chapters").select("*").eq("session_id", session_id).execute()
+        result = await run_query(supabase.table("textbook_chapters").select("*").eq("session_id", session_id))
         return {"chapters": result.data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1586,6 +2141,10 @@ class ConceptNode(BaseModel):
     source_papers: List[str] = []  # Titles of papers that cover this
 
 
+# Validates and dumps a whole concept list in one call instead of per item
+_CONCEPT_LIST_ADAPTER = TypeAdapter(List[ConceptNode])
+
+
 class LearningPathResponse(BaseModel):
     success: bool
     domain: str = ""
@@ -1598,6 +2157,241 @@ class LearningPathResponse(BaseModel):
     error: Optional[str] = None
 
 
+async def _store_authored_object(bucket: str, path: str, data: bytes, content_type: str) -> bool:
+    """Upload one authored-paper object; failures are logged so the paper still gets its row."""
+    try:
+        await upload_object(supabase.storage.from_(bucket), path, data, content_type)
+        return True
+    except Exception as e:
+        print(f"[Papers Authored] Failed to store {bucket}/{path}: {e}")
+        return False
+
+
+def _file_digest(data: bytes) -> str:
+    """Content address for uploaded files."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+async def _ensure_authored_pdf(pdf_bytes: bytes, file_sha: str, storage_path: str, user_id: int, session_id: str) -> str:
+    """
+    Upload an authored PDF unless this session already stored identical bytes.
+
+    Returns:
+        The storage path of the PDF
+
+    Raises:
+        RuntimeError: If the upload failed; the paper is then reported as
+            failed instead of getting a row that points at a missing object
+    """
+    try:
+        existing = await run_query(
+            supabase.table("academia_materials").select("storage_path")
+            .eq("user_id", user_id)
+            .eq("session_id", session_id)
+            .eq("file_sha", file_sha)
+            .not_.is_("storage_path", "null")
+            .limit(1)
+        )
+        if existing.data:
+            return existing.data[0]["storage_path"]
+    except (APIError, httpx.HTTPError) as e:
+        logger.warning("Papers Authored digest lookup failed", exc_info=e)
+    if not await _store_authored_object("user-documents", storage_path, pdf_bytes, "application/pdf"):
+        raise RuntimeError(f"Failed to store user-documents/{storage_path}")
+    return storage_path
+
+
+async def _store_authored_figure(img, img_path: str, semaphore: asyncio.Semaphore) -> Optional[dict]:
+    """Upload one extracted figure and return its image ref, or None if the upload failed."""
+    async with semaphore:
+        if not await _store_authored_object("compressed_documents", img_path, img.png_bytes, "image/png"):
+            return None
+    return {
+        "index": img.index,
+        "path": img_path,
+        "page": img.page_number,
+        "width": img.width,
+        "height": img.height
+    }
+
+
+async def _process_authored_paper(
+    pdf_bytes: bytes,
+    file_name: str,
+    session_id: str,
+    user_id: int,
+    pdf_processor: PDFProcessor,
+    compression_service: Optional[TokenCompressionService],
+    stored_path: Optional[str] = None
+) -> tuple[dict, List[dict], List[KnowledgeNode]]:
+    """
+    Extract, compress and store one authored paper PDF.
+
+    Storage objects are written here; the academia_materials and
+    knowledge_nodes rows are returned so the caller can write every paper
+    of a request in one batch (see _persist_authored_papers).
+
+    Args:
+        stored_path: Path in user-documents when the client already uploaded
+            the PDF with a signed URL; otherwise the PDF is uploaded here
+
+    Returns:
+        The paper's academia_materials row, its knowledge_nodes rows and its nodes
+    """
+    paper_title = file_name.replace('.pdf', '').replace('_', ' ')
+    file_sha = await asyncio.to_thread(_file_digest, pdf_bytes)
+
+    # Title-only node generation overlaps extraction, compression and uploads
+    nodes_task = asyncio.create_task(generate_single_paper_nodes(paper_title))
+
+    # The PDF upload doesn't depend on extraction or compression; start it now
+    # and only wait for it before the material row is written. Uploads are
+    # content-addressed so resubmitted papers reuse the stored object.
+    pdf_upload = None
+    if stored_path:
+        storage_path = stored_path
+    else:
+        pdf_upload = asyncio.create_task(_ensure_authored_pdf(
+            pdf_bytes, file_sha, f"{user_id}/{session_id}/authored/{file_sha}.pdf", user_id, session_id
+        ))
+
+    # Started tasks are cancelled if extraction, compression or storage fails
+    figure_uploads = None
+    try:
+        # Extract text and images
+        extraction = await pdf_processor.extract_content(pdf_bytes)
+
+        # Upload figures while the text is being compressed
+        figure_semaphore = asyncio.Semaphore(FIGURE_UPLOAD_CONCURRENCY)
+        figure_uploads = asyncio.gather(*(
+            _store_authored_figure(
+                img,
+                f"{user_id}/{session_id}/authored/{file_sha}_img_{img.index}.png",
+                figure_semaphore,
+            )
+            for img in extraction.images
+        ))
+
+        # Compress text with Token Company
+        compressed_text = extraction.text
+        original_tokens = pdf_processor.estimate_tokens(extraction.text)
+        compressed_tokens = original_tokens
+        compression_ratio = 1.0
+        compression_success = False
+
+        if compression_service and extraction.text:
+            compression_result = await compression_service.compress_for_academic_paper(extraction.text)
+            if compression_result.success:
+                compressed_text = compression_result.compressed_text
+                original_tokens = compression_result.original_tokens
+                compressed_tokens = compression_result.compressed_tokens
+                compression_ratio = compression_result.compression_ratio
+                compression_success = True
+
+        image_refs = [ref for ref in await figure_uploads if ref]
+
+        # Store compressed JSON to storage
+        json_content = {
+            "text": compressed_text,
+            "image_refs": image_refs,
+            "metadata": {
+                "original_tokens": original_tokens,
+                "compressed_tokens": compressed_tokens,
+                "compression_ratio": compression_ratio,
+                "has_figures": len(image_refs) > 0,
+                "figure_count": len(image_refs)
+            }
+        }
+        json_path = f"{user_id}/{session_id}/authored/{file_sha}.json"
+        await _store_authored_object(
+            "compressed_documents", json_path, orjson.dumps(json_content), "application/json; charset=utf-8"
+        )
+
+        if pdf_upload:
+            storage_path = await pdf_upload
+
+        # Material record; resubmitting a paper to the same session updates its
+        # existing row
+        material_data = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "material_type": "paper_authored",
+            "title": paper_title,
+            "source_type": "pdf_upload",
+            "storage_bucket": "user-documents",
+            "storage_path": storage_path,
+            "file_name": file_name,
+            "file_size_bytes": len(pdf_bytes),
+            "is_processed": True,
+            "ttc_processed": compression_success,
+            "original_token_count": original_tokens,
+            "compressed_token_count": compressed_tokens,
+            "compression_ratio": compression_ratio,
+            "compressed_storage_bucket": "compressed_documents",
+            "compressed_storage_path": json_path,
+            "pdf_extraction_method": "pymupdf",
+            "file_sha": file_sha
+        }
+
+        # Nodes from the paper title (started above)
+        nodes = await nodes_task
+        node_rows = [{
+            "session_id": session_id,
+            "label": node.get("label"),
+            "type": node.get("type"),
+            "domain": node.get("domain"),
+            "mastery_estimate": 0.8,  # Higher mastery for authored papers
+            "relevance_to_topic": f"From your authored paper: {paper_title}",
+            "source": "paper_authored",
+            "is_llm_generated": True,
+            "file_sha": file_sha
+        } for node in nodes]
+        for node in nodes:
+            node["source"] = "paper_authored"
+        return material_data, node_rows, [KnowledgeNode(**node) for node in nodes]
+    finally:
+        await _cancel_unfinished(nodes_task, pdf_upload, figure_uploads)
+
+
+async def _replace_authored_nodes(session_id: str, file_shas: List[str], node_rows: List[dict]) -> None:
+    """Insert authored-paper nodes, first deleting the ones a resubmitted paper already has."""
+    if file_shas:
+        await run_query(supabase.table("knowledge_nodes").delete().eq("session_id", session_id).eq(
+            "source", "paper_authored"
+        ).in_("file_sha", file_shas))
+    await insert_rows(supabase, "knowledge_nodes", node_rows)
+
+
+async def _persist_authored_papers(names: List[str], results: list) -> PapersAuthoredResponse:
+    """Write the material and node rows of a request's processed papers in one batch each."""
+    materials = []
+    rows_by_sha = {}
+    all_nodes = []
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            print(f"[Papers Authored] Failed to process {name}: {result}")
+            continue
+        material_data, rows, nodes = result
+        materials.append(material_data)
+        rows_by_sha[material_data["file_sha"]] = rows
+        all_nodes.extend(nodes)
+
+    if materials:
+        # One row per file_sha: an upsert can't update the same row twice
+        unique = list({material["file_sha"]: material for material in materials}.values())
+        node_rows = [row for rows in rows_by_sha.values() for row in rows]
+        written = await run_query(
+            supabase.table("academia_materials").upsert(unique, on_conflict="session_id,file_sha")
+        )
+        # Nodes are only replaced once their papers' material rows are written
+        await _replace_authored_nodes(unique[0]["session_id"], list(rows_by_sha), node_rows)
+        ids = {row.get("file_sha"): row.get("id") for row in written.data or []}
+        for material in materials:
+            material["id"] = ids.get(material["file_sha"])
+
+    return PapersAuthoredResponse(success=True, materials=materials, nodes=all_nodes)
+
+
 @app.post("/api/profile/papers-authored", response_model=PapersAuthoredResponse)
 async def submit_papers_authored(
     files: List[UploadFile] = File(...),
@@ -1609,154 +2403,99 @@ async def submit_papers_authored(
     Extracts text and images, compresses with Token Company, stores to Supabase.
     """
     try:
-        pdf_processor = PDFProcessor(extract_images=True)
-        compression_service = TokenCompressionService(TOKEN_COMPANY_API_KEY) if TOKEN_COMPANY_API_KEY else None
+        pdf_processor = FIGURE_PDF_PROCESSOR
+        compression_service = COMPRESSION_SERVICE
+
+        # Files are independent; process them concurrently, bounded so large
+        # uploads don't hold every PDF and extraction in memory at once
+        pdf_files = [file for file in files if file.filename.lower().endswith('.pdf')]
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def process(file: UploadFile):
+            async with semaphore:
+                pdf_bytes = await file.read()
+                return await _process_authored_paper(
+                    pdf_bytes, file.filename, session_id, user_id, pdf_processor, compression_service
+                )
 
-        # Get session for central_topic
-        session = supabase.table("learning_sessions").select("central_topic").eq("id", session_id).single().execute()
-        central_topic = session.data.get("central_topic", "")
+        results = await asyncio.gather(*(process(file) for file in pdf_files), return_exceptions=True)
+        return await _persist_authored_papers([file.filename for file in pdf_files], results)
 
-        materials = []
-        all_nodes = []
+    except Exception as e:
+        traceback.print_exc()
+        return PapersAuthoredResponse(success=False, error=str(e))
 
-        for file in files:
-            if not file.filename.lower().endswith('.pdf'):
-                continue
 
-            pdf_bytes = await file.read()
-            paper_title = file.filename.replace('.pdf', '').replace('_', ' ')
+class PresignPaperRequest(BaseModel):
+    session_id: str
+    user_id: int
+    file_name: str
 
-            # Extract text and images
-            extraction = await pdf_processor.extract_content(pdf_bytes)
 
-            # Compress text with Token Company
-            compressed_text = extraction.text
-            original_tokens = pdf_processor.estimate_tokens(extraction.text)
-            compressed_tokens = original_tokens
-            compression_ratio = 1.0
-            compression_success = False
+class PresignPaperResponse(BaseModel):
+    upload_url: str
+    token: str
+    storage_path: str
 
-            if compression_service and extraction.text:
-                compression_result = await compression_service.compress_for_academic_paper(extraction.text)
-                if compression_result.success:
-                    compressed_text = compression_result.compressed_text
-                    original_tokens = compression_result.original_tokens
-                    compressed_tokens = compression_result.compressed_tokens
-                    compression_ratio = compression_result.compression_ratio
-                    compression_success = True
 
-            # Upload PDF to storage
-            storage_path = f"{user_id}/{session_id}/authored/{file.filename}"
-            try:
-                supabase.storage.from_("user-documents").upload(
-                    storage_path,
-                    pdf_bytes,
-                    {"content-type": "application/pdf"}
-                )
-            except Exception as e:
-                # File might already exist, try to update
-                try:
-                    supabase.storage.from_("user-documents").update(
-                        storage_path,
-                        pdf_bytes,
-                        {"content-type": "application/pdf"}
-                    )
-                except:
-                    pass
+class StoredPaper(BaseModel):
+    storage_path: str
+    file_name: str
 
-            # Upload images to storage and collect refs
-            image_refs = []
-            for img in extraction.images:
-                img_path = f"{user_id}/{session_id}/authored/img_{img.index}.png"
-                try:
-                    img_bytes = base64.b64decode(img.base64_data)
-                    supabase.storage.from_("compressed_documents").upload(
-                        img_path,
-                        img_bytes,
-                        {"content-type": "image/png"}
-                    )
-                    image_refs.append({
-                        "index": img.index,
-                        "path": img_path,
-                        "page": img.page_number,
-                        "width": img.width,
-                        "height": img.height
-                    })
-                except:
-                    pass
-
-            # Store compressed JSON to storage
-            json_content = {
-                "text": compressed_text,
-                "image_refs": image_refs,
-                "metadata": {
-                    "original_tokens": original_tokens,
-                    "compressed_tokens": compressed_tokens,
-                    "compression_ratio": compression_ratio,
-                    "has_figures": len(image_refs) > 0,
-                    "figure_count": len(image_refs)
-                }
-            }
-            json_path = f"{user_id}/{session_id}/authored/{file.filename.replace('.pdf', '')}.json"
-            try:
-                supabase.storage.from_("compressed_documents").upload(
-                    json_path,
-                    json.dumps(json_content).encode('utf-8'),
-                    {"content-type": "application/json"}
-                )
-            except:
-                pass
 
-            # Create material record
-            material_id = str(uuid.uuid4())
-            material_data = {
-                "id": material_id,
-                "session_id": session_id,
-                "user_id": user_id,
-                "material_type": "paper_authored",
-                "title": paper_title,
-                "source_type": "pdf_upload",
-                "storage_bucket": "user-documents",
-                "storage_path": storage_path,
-                "file_name": file.filename,
-                "file_size_bytes": len(pdf_bytes),
-                "is_processed": True,
-                "ttc_processed": compression_success,
-                "ttc_processed_at": datetime.utcnow().isoformat() if compression_success else None,
-                "original_token_count": original_tokens,
-                "compressed_token_count": compressed_tokens,
-                "compression_ratio": compression_ratio,
-                "compressed_storage_bucket": "compressed_documents",
-                "compressed_storage_path": json_path,
-                "pdf_extraction_method": "pymupdf"
-            }
-            supabase.table("academia_materials").insert(material_data).execute()
-            materials.append(material_data)
-
-            # Generate nodes from paper title
-            nodes = await generate_single_paper_nodes(paper_title)
-            for node in nodes:
-                node["source"] = "paper_authored"
-                supabase.table("knowledge_nodes").insert({
-                    "session_id": session_id,
-                    "label": node.get("label"),
-                    "type": node.get("type"),
-                    "domain": node.get("domain"),
-                    "mastery_estimate": 0.8,  # Higher mastery for authored papers
-                    "relevance_to_topic": f"From your authored paper: {paper_title}",
-                    "source": "paper_authored",
-                    "is_llm_generated": True
-                }).execute()
-                all_nodes.append(KnowledgeNode(**node))
+class StoredPapersAuthoredRequest(BaseModel):
+    session_id: str
+    user_id: int
+    papers: List[StoredPaper]
 
-        return PapersAuthoredResponse(
-            success=True,
-            materials=materials,
-            nodes=all_nodes
+
+@app.post("/api/profile/papers-authored/presign", response_model=PresignPaperResponse)
+async def presign_paper_authored(request: PresignPaperRequest):
+    """
+    Create a signed upload URL so the client can PUT an authored paper
+    straight to Supabase Storage instead of sending it through the API.
+    """
+    if not request.file_name.lower().endswith('.pdf') or "/" in request.file_name:
+        raise HTTPException(status_code=400, detail="Only PDF file names are supported")
+    storage_path = f"{request.user_id}/{request.session_id}/authored/{request.file_name}"
+    try:
+        signed = await supabase.storage.from_("user-documents").create_signed_upload_url(storage_path)
+        return PresignPaperResponse(
+            upload_url=signed.get("signed_url") or signed.get("signedUrl"),
+            token=signed.get("token", ""),
+            storage_path=storage_path
         )
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/profile/papers-authored/stored", response_model=PapersAuthoredResponse)
+async def submit_stored_papers_authored(request: StoredPapersAuthoredRequest):
+    """Process authored papers the client already uploaded through presign URLs."""
+    prefix = f"{request.user_id}/{request.session_id}/authored/"
+    if any(
+        not paper.storage_path.startswith(prefix) or "/" in paper.storage_path[len(prefix):]
+        for paper in request.papers
+    ):
+        raise HTTPException(status_code=400, detail="Storage paths must come from the presign endpoint")
+
+    try:
+        bucket = supabase.storage.from_("user-documents")
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def process(paper: StoredPaper):
+            async with semaphore:
+                pdf_bytes = await bucket.download(paper.storage_path)
+                return await _process_authored_paper(
+                    pdf_bytes, paper.file_name, request.session_id, request.user_id,
+                    FIGURE_PDF_PROCESSOR, COMPRESSION_SERVICE, stored_path=paper.storage_path
+                )
+
+        results = await asyncio.gather(*(process(paper) for paper in request.papers), return_exceptions=True)
+        return await _persist_authored_papers([paper.storage_path for paper in request.papers], results)
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return PapersAuthoredResponse(success=False, error=str(e))
 
@@ -1775,6 +2514,79 @@ class CourseworkUrlResponse(BaseModel):
     error: Optional[str] = None
 
 
+async def _scrape_coursework_url(
+    url: str,
+    request: CourseworkUrlRequest,
+    central_topic: str,
+    firecrawl: FirecrawlService
+) -> Optional[tuple[List[dict], List[KnowledgeNode]]]:
+    """Scrape one coursework URL and store its content, chapters and nodes; None if scraping failed."""
+    # Scrape URL and extract chapters
+    result = await firecrawl.extract_chapters(
+        url=url,
+        use_gemini_parsing=True,
+        gemini_api_key=GEMINI_API_KEY,
+        compress=True
+    )
+
+    if not result.success:
+        return None
+
+    # Node generation only needs the chapter titles; overlap it with the writes
+    chapter_titles = [ch.title for ch in result.chapters[:10]]  # Limit to 10
+    nodes_task = asyncio.create_task(generate_coursework_nodes(central_topic, chapter_titles)) if chapter_titles else None
+
+    # Store scraped content
+    content_id = str(uuid.uuid4())
+    await run_query(supabase.table("scraped_content").insert({
+        "id": content_id,
+        "session_id": request.session_id,
+        "user_id": request.user_id,
+        "source_url": url,
+        "content_type": "course_material",
+        "raw_content_preview": result.raw_markdown[:2000] if result.raw_markdown else None,
+        "compressed_content": result.compressed_markdown or "",
+        "original_tokens": result.original_tokens or 0,
+        "compressed_tokens": result.compressed_tokens or 0,
+        "compression_ratio": result.compression_ratio or 1.0,
+        "scraper_type": "firecrawl",
+        "page_title": result.metadata.get("title") if result.metadata else None,
+        "page_metadata": result.metadata
+    }))
+
+    # Store chapters (one bulk insert)
+    chapter_rows = [{
+        "session_id": request.session_id,
+        "user_id": request.user_id,
+        "scraper_id": content_id,
+        "chapter_number": chapter.chapter_number,
+        "title": chapter.title,
+        "subtopics": chapter.subtopics,
+        "source_url": url,
+        "chapter_url": chapter.url
+    } for chapter in result.chapters]
+    if chapter_rows:
+        await run_query(supabase.table("textbook_chapters").insert(chapter_rows))
+
+    # Nodes from chapter titles (started above)
+    nodes = []
+    if nodes_task:
+        nodes = await nodes_task
+        if nodes:
+            await insert_rows(supabase, "knowledge_nodes", [{
+                "session_id": request.session_id,
+                "label": node.get("label"),
+                "type": node.get("type", "concept"),
+                "domain": node.get("domain"),
+                "mastery_estimate": 0.3,  # Lower mastery - content to learn
+                "relevance_to_topic": node.get("relevance_to_topic"),
+                "source": "coursework",
+                "is_llm_generated": True
+            } for node in nodes])
+
+    return chapter_rows, [KnowledgeNode(**node) for node in nodes]
+
+
 @app.post("/api/profile/coursework-urls", response_model=CourseworkUrlResponse)
 async def submit_coursework_urls(request: CourseworkUrlRequest):
     """
@@ -1782,84 +2594,33 @@ async def submit_coursework_urls(request: CourseworkUrlRequest):
     Extracts chapters/content, compresses with Token Company, stores to Supabase.
     """
     try:
-        firecrawl = FirecrawlService(ttc_api_key=TOKEN_COMPANY_API_KEY)
+        firecrawl = get_firecrawl()
 
         # Get session for central_topic
-        session = supabase.table("learning_sessions").select("central_topic").eq("id", request.session_id).single().execute()
-        central_topic = session.data.get("central_topic", "")
+        central_topic = await get_central_topic(request.session_id)
 
         all_chapters = []
         all_nodes = []
         scraped_count = 0
 
-        for url in request.urls:
-            try:
-                # Scrape URL and extract chapters
-                result = await firecrawl.extract_chapters(
-                    url=url,
-                    use_gemini_parsing=True,
-                    gemini_api_key=GEMINI_API_KEY,
-                    compress=True
-                )
-
-                if not result.success:
-                    continue
-
-                scraped_count += 1
+        # URLs are independent; scrape them concurrently, bounded for Firecrawl
+        semaphore = asyncio.Semaphore(SCRAPE_CONCURRENCY)
 
-                # Store scraped content
-                content_id = str(uuid.uuid4())
-                supabase.table("scraped_content").insert({
-                    "id": content_id,
-                    "session_id": request.session_id,
-                    "user_id": request.user_id,
-                    "source_url": url,
-                    "content_type": "course_material",
-                    "raw_content_preview": result.raw_markdown[:2000] if result.raw_markdown else None,
-                    "compressed_content": result.compressed_markdown or "",
-                    "original_tokens": result.original_tokens or 0,
-                    "compressed_tokens": result.compressed_tokens or 0,
-                    "compression_ratio": result.compression_ratio or 1.0,
-                    "scraper_type": "firecrawl",
-                    "page_title": result.metadata.get("title") if result.metadata else None,
-                    "page_metadata": result.metadata
-                }).execute()
-
-                # Store chapters
-                for chapter in result.chapters:
-                    chapter_data = {
-                        "session_id": request.session_id,
-                        "user_id": request.user_id,
-                        "scraper_id": content_id,
-                        "chapter_number": chapter.chapter_number,
-                        "title": chapter.title,
-                        "subtopics": chapter.subtopics,
-                        "source_url": url,
-                        "chapter_url": chapter.url
-                    }
-                    supabase.table("textbook_chapters").insert(chapter_data).execute()
-                    all_chapters.append(chapter_data)
-
-                # Generate nodes from chapter titles
-                chapter_titles = [ch.title for ch in result.chapters[:10]]  # Limit to 10
-                if chapter_titles:
-                    nodes = await generate_coursework_nodes(central_topic, chapter_titles)
-                    for node in nodes:
-                        supabase.table("knowledge_nodes").insert({
-                            "session_id": request.session_id,
-                            "label": node.get("label"),
-                            "type": node.get("type", "concept"),
-                            "domain": node.get("domain"),
-                            "mastery_estimate": 0.3,  # Lower mastery - content to learn
-                            "relevance_to_topic": node.get("relevance_to_topic"),
-                            "source": "coursework",
-                            "is_llm_generated": True
-                        }).execute()
-                        all_nodes.append(KnowledgeNode(**node))
+        async def scrape(url: str):
+            async with semaphore:
+                return await _scrape_coursework_url(url, request, central_topic, firecrawl)
 
-            except Exception as e:
-                print(f"Error scraping {url}: {e}")
+        results = await asyncio.gather(*(scrape(url) for url in request.urls), return_exceptions=True)
+        for url, result in zip(request.urls, results):
+            if isinstance(result, Exception):
+                print(f"Error scraping {url}: {result}")
+                continue
+            if result is None:
                 continue
+            chapter_rows, nodes = result
+            scraped_count += 1
+            all_chapters.extend(chapter_rows)
+            all_nodes.extend(nodes)
 
         return CourseworkUrlResponse(
             success=True,
@@ -1869,7 +2630,6 @@ async def submit_coursework_urls(request: CourseworkUrlRequest):
         )
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return CourseworkUrlResponse(success=False, error=str(e))
 
@@ -1885,17 +2645,30 @@ async def submit_coursework_transcript(
     Extracts courses, compresses text with Token Company, stores to Supabase.
     """
     try:
-        pdf_processor = PDFProcessor(extract_images=False)
-        compression_service = TokenCompressionService(TOKEN_COMPANY_API_KEY) if TOKEN_COMPANY_API_KEY else None
+        pdf_processor = TEXT_PDF_PROCESSOR
+        compression_service = COMPRESSION_SERVICE
 
         # Get session for central_topic
-        session = supabase.table("learning_sessions").select("central_topic").eq("id", session_id).single().execute()
-        central_topic = session.data.get("central_topic", "")
+        central_topic = await get_central_topic(session_id)
 
-        pdf_bytes = await file.read()
+        # Spool the PDF to disk; the upload streams from the file while its
+        # text is extracted from the same file
+        storage_path = f"{user_id}/{session_id}/transcript/{file.filename}"
+        async with spool_to_tempfile(file) as pdf_path:
+            pdf_upload = asyncio.create_task(
+                upload_object(supabase.storage.from_("user-documents"), storage_path, pdf_path, "application/pdf")
+            )
+            try:
+                text = await pdf_processor.extract_text_from_file(pdf_path)
+            finally:
+                # The upload reads the spooled file, so it must finish before cleanup
+                try:
+                    await pdf_upload
+                except Exception as e:
+                    print(f"[Transcript] Failed to store PDF {storage_path}: {e}")
 
-        # Extract text from transcript
-        text = await pdf_processor.extract_text_only(pdf_bytes)
+        # Course extraction only needs the raw text; run it alongside compression
+        courses_task = asyncio.create_task(extract_courses_from_transcript(text))
 
         # Compress text with Token Company
         compressed_text = text
@@ -1916,24 +2689,15 @@ async def submit_coursework_transcript(
             except Exception as comp_err:
                 print(f"[Transcript] Compression failed: {comp_err}")
 
-        # Use Gemini to extract courses from transcript
-        courses = await extract_courses_from_transcript(text)
+        courses = await courses_task
 
-        # Upload transcript PDF to storage
-        storage_path = f"{user_id}/{session_id}/transcript/{file.filename}"
-        try:
-            supabase.storage.from_("user-documents").upload(
-                storage_path,
-                pdf_bytes,
-                {"content-type": "application/pdf"}
-            )
-        except:
-            pass
+        # Node generation overlaps the compressed-content upload and material insert
+        nodes_task = asyncio.create_task(generate_transcript_nodes(central_topic, courses)) if courses else None
 
         # Store compressed content to storage
         compressed_storage_path = f"{user_id}/{session_id}/transcript/{file.filename.replace('.pdf', '')}_compressed.json"
         try:
-            content_json = json.dumps({
+            content_json = orjson.dumps({
                 "text": compressed_text,
                 "courses": courses,
                 "metadata": {
@@ -1943,24 +2707,15 @@ async def submit_coursework_transcript(
                     "course_count": len(courses) if courses else 0
                 }
             })
-            try:
-                supabase.storage.from_("compressed_documents").upload(
-                    compressed_storage_path,
-                    content_json.encode(),
-                    {"content-type": "application/json"}
-                )
-            except:
-                supabase.storage.from_("compressed_documents").update(
-                    compressed_storage_path,
-                    content_json.encode(),
-                    {"content-type": "application/json"}
-                )
+            await upload_object(
+                supabase.storage.from_("compressed_documents"), compressed_storage_path, content_json, "application/json; charset=utf-8"
+            )
         except Exception as store_err:
             print(f"[Transcript] Failed to store compressed content: {store_err}")
             compressed_storage_path = None
 
         # Store as material with compression stats
-        supabase.table("academia_materials").insert({
+        await run_query(supabase.table("academia_materials").insert({
             "session_id": session_id,
             "user_id": user_id,
             "material_type": "educational_course",
@@ -1975,16 +2730,15 @@ async def submit_coursework_transcript(
             "compressed_token_count": compressed_tokens,
             "compression_ratio": compression_ratio,
             "ttc_processed": compression_success,
-            "ttc_processed_at": datetime.utcnow().isoformat() if compression_success else None,
             "is_processed": True
-        }).execute()
+        }))
 
         # Generate nodes from courses
         all_nodes = []
-        if courses:
-            nodes = await generate_transcript_nodes(central_topic, courses)
-            for node in nodes:
-                supabase.table("knowledge_nodes").insert({
+        if nodes_task:
+            nodes = await nodes_task
+            if nodes:
+                await insert_rows(supabase, "knowledge_nodes", [{
                     "session_id": session_id,
                     "label": node.get("label"),
                     "type": node.get("type", "concept"),
@@ -1994,117 +2748,131 @@ async def submit_coursework_transcript(
                     "relevance_to_topic": node.get("relevance_to_topic"),
                     "source": "transcript",
                     "is_llm_generated": True
-                }).execute()
-                all_nodes.append(KnowledgeNode(**node))
+                } for node in nodes])
+            all_nodes = [KnowledgeNode(**node) for node in nodes]
 
         return NodesResponse(success=True, nodes=all_nodes)
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def generate_coursework_nodes(central_topic: str, chapter_titles: List[str]) -> List[dict]:
-    """Generate knowledge nodes from coursework chapter titles."""
-    titles_formatted = "\n".join([f"- {t}" for t in chapter_titles])
-
-    prompt = f"""You are analyzing coursework chapters to identify concepts relevant to a learning topic.
-
-INPUT:
-- Learning topic: "{central_topic}"
-- Course chapters:
-{titles_formatted}
+COURSEWORK_NODES_SYSTEM = """You are analyzing coursework chapters to identify concepts relevant to a learning topic.
 
 TASK:
 Identify 4-6 key concepts from these chapters that are relevant to the learning topic.
 
 OUTPUT FORMAT (strict JSON, no markdown):
-{{
+{
   "nodes": [
-    {{
+    {
       "label": "concept name (1-3 words)",
       "type": "concept",
       "domain": "broader category",
-      "relevance_to_topic": "How this concept relates to {central_topic}"
-    }}
+      "relevance_to_topic": "How this concept relates to the learning topic"
+    }
   ]
-}}
+}
 
 CONSTRAINTS:
 - Focus on concepts that bridge the coursework to the learning topic
 - Return 4-6 nodes
 - Labels should be concise (1-3 words)
-- Do NOT output generic document words like \"chapter\", \"unit\", \"lesson\", or \"deliverable\""""
+- Do NOT output generic document words like "chapter", "unit", "lesson", or "deliverable\""""
+
+
+async def generate_coursework_nodes(central_topic: str, chapter_titles: List[str]) -> List[dict]:
+    """Generate knowledge nodes from coursework chapter titles."""
+    if all(_is_trivial_input(t) for t in chapter_titles):
+        return []
+    titles_formatted = "\n".join(f"- {t}" for t in chapter_titles)
 
-    response_text = await call_gemini(prompt)
+    prompt = f"""INPUT:
+- Learning topic: "{central_topic}"
+- Course chapters:
+{titles_formatted}"""
+
+    response_text = await call_gemini(
+        prompt, task="coursework_nodes", system=COURSEWORK_NODES_SYSTEM, cache_ttl=NODE_CACHE_TTL_SECONDS
+    )
     result = extract_json_from_response(response_text)
     return _filter_generated_nodes(result.get("nodes", []))
 
 
-async def extract_courses_from_transcript(transcript_text: str) -> List[str]:
-    """Extract course names from academic transcript text."""
-    transcript_text, _ = await _compress_prompt_text(transcript_text)
-    prompt = f"""Extract all course names/titles from this academic transcript.
-
-TRANSCRIPT TEXT:
-{transcript_text[:10000]}
+TRANSCRIPT_COURSES_SYSTEM = """Extract all course names/titles from the academic transcript you are given.
 
 OUTPUT FORMAT (strict JSON, no markdown):
-{{
+{
   "courses": [
     "Course Name 1",
     "Course Name 2"
   ]
-}}
+}
 
 CONSTRAINTS:
 - Extract actual course names, not grades or credits
 - Include course codes if present (e.g., "CS 229 Machine Learning")
 - Return at most 30 courses"""
 
-    response_text = await call_gemini(prompt)
-    result = extract_json_from_response(response_text)
-    return result.get("courses", [])
 
+async def extract_courses_from_transcript(transcript_text: str) -> List[str]:
+    """Extract course names from academic transcript text."""
+    if _is_trivial_input(transcript_text):
+        return []
+    transcript_text, _ = await _compress_prompt_text(transcript_text)
+    prompt = f"""TRANSCRIPT TEXT:
+{transcript_text[:10000]}"""
 
-async def generate_transcript_nodes(central_topic: str, courses: List[str]) -> List[dict]:
-    """Generate knowledge nodes from transcript courses."""
-    courses_formatted = "\n".join([f"- {c}" for c in courses[:20]])  # Limit to 20 courses
+    response_text = await call_gemini(
+        prompt, task="transcript_courses", system=TRANSCRIPT_COURSES_SYSTEM, cache_ttl=NODE_CACHE_TTL_SECONDS
+    )
+    result = extract_json_from_response(response_text)
+    return result.get("courses", [])
 
-    prompt = f"""You are analyzing a student's completed coursework to identify their existing knowledge.
 
-INPUT:
-- Learning topic they want to study: "{central_topic}"
-- Courses they've completed:
-{courses_formatted}
+TRANSCRIPT_NODES_SYSTEM = """You are analyzing a student's completed coursework to identify their existing knowledge.
 
 TASK:
 Identify 5-8 knowledge areas from these courses that are relevant to their learning topic.
-Focus on skills and concepts that will help them learn "{central_topic}".
+Focus on skills and concepts that will help them learn that topic.
 
 OUTPUT FORMAT (strict JSON, no markdown):
-{{
+{
   "nodes": [
-    {{
+    {
       "label": "knowledge area (1-2 words)",
       "type": "concept",
       "domain": "broader category",
       "confidence": 0.7,
       "mastery_estimate": 0.6,
-      "relevance_to_topic": "How this knowledge helps them learn {central_topic}"
-    }}
+      "relevance_to_topic": "How this knowledge helps them learn the learning topic"
+    }
   ]
-}}
+}
 
 CONSTRAINTS:
 - Labels should be concise (1-2 words)
 - confidence reflects how certain the course covers this topic
 - mastery_estimate reflects expected proficiency from taking the course
 - Return 5-8 nodes that bridge their coursework to their learning goal
-- Do NOT output generic document words like \"course\", \"module\", or \"deliverable\""""
+- Do NOT output generic document words like "course", "module", or "deliverable\""""
+
+
+async def generate_transcript_nodes(central_topic: str, courses: List[str]) -> List[dict]:
+    """Generate knowledge nodes from transcript courses."""
+    if all(_is_trivial_input(c) for c in courses):
+        return []
+    courses_formatted = "\n".join(f"- {c}" for c in courses[:20])  # Limit to 20 courses
+
+    prompt = f"""INPUT:
+- Learning topic they want to study: "{central_topic}"
+- Courses they've completed:
+{courses_formatted}"""
 
-    response_text = await call_gemini(prompt)
+    response_text = await call_gemini(
+        prompt, task="transcript_nodes", system=TRANSCRIPT_NODES_SYSTEM, cache_ttl=NODE_CACHE_TTL_SECONDS
+    )
     result = extract_json_from_response(response_text)
     return _filter_generated_nodes(result.get("nodes", []))
 
@@ -2146,20 +2914,10 @@ class PrerequisitesConfirmResponse(BaseModel):
     error: Optional[str] = None
 
 
-async def generate_prerequisites_for_topic(central_topic: str, user_background: List[str]) -> dict:
-    """Use Gemini to generate true prerequisites for learning a topic."""
-    background_formatted = "\n".join([f"- {b}" for b in user_background]) if user_background else "None provided"
-    background_formatted, _ = await _compress_prompt_text(background_formatted)
-
-    prompt = f"""You are an expert educator creating a learning path for a student.
-
-STUDENT WANTS TO LEARN: "{central_topic}"
-
-STUDENT'S EXISTING KNOWLEDGE:
-{background_formatted}
+PREREQUISITES_SYSTEM = """You are an expert educator creating a learning path for a student.
 
 TASK:
-Identify the TRUE PREREQUISITES needed to understand "{central_topic}". These should be:
+Identify the TRUE PREREQUISITES needed to understand the topic the student wants to learn. These should be:
 1. Foundational concepts that MUST be understood first
 2. Ordered from most basic to most advanced
 3. Realistic - what would a textbook chapter sequence look like?
@@ -2173,17 +2931,17 @@ For each prerequisite, assess:
   - Below 0.5: Don't include
 
 OUTPUT FORMAT (strict JSON, no markdown):
-{{
+{
   "prerequisites": [
-    {{
+    {
       "name": "prerequisite topic (2-5 words)",
       "description": "One sentence explaining what this covers and why it's needed",
       "confidence": 0.0-1.0,
       "order_index": 0,
       "is_foundational": true/false
-    }}
+    }
   ]
-}}
+}
 
 CONSTRAINTS:
 - Return 8-15 prerequisites, ordered from foundational to advanced
@@ -2193,7 +2951,24 @@ CONSTRAINTS:
 - If a prerequisite overlaps with the student's background, either skip it or set confidence < 0.5
 - Prefer prerequisites that fill gaps in the student's knowledge over ones they already know"""
 
-    response_text = await call_gemini(prompt)
+
+async def generate_prerequisites_for_topic(central_topic: str, user_background: List[str]) -> dict:
+    """Use Gemini to generate true prerequisites for learning a topic."""
+    background_formatted = "\n".join(f"- {b}" for b in user_background) if user_background else "None provided"
+    background_formatted, _ = await _compress_prompt_text(background_formatted)
+
+    prompt = f"""STUDENT WANTS TO LEARN: "{central_topic}"
+
+STUDENT'S EXISTING KNOWLEDGE:
+{background_formatted}"""
+
+    response_text = await call_gemini(
+        prompt,
+        task="prerequisites",
+        semantic_key=central_topic,
+        system=PREREQUISITES_SYSTEM,
+        cache_ttl=NODE_CACHE_TTL_SECONDS,
+    )
     result = extract_json_from_response(response_text)
     return result
 
@@ -2202,37 +2977,28 @@ CONSTRAINTS:
 async def generate_prerequisites(request: PrerequisitesGenerateRequest):
     """Generate true prerequisites for the user's learning topic."""
     try:
-        # Get session for central topic
-        session = supabase.table("learning_sessions").select("central_topic").eq("id", request.session_id).single().execute()
-        if not session.data:
-            raise HTTPException(status_code=404, detail="Session not found")
-
-        central_topic = session.data["central_topic"]
-
-        # Get user's existing knowledge from knowledge_nodes
-        knowledge_result = supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id).execute()
+        # Central topic and the user's existing knowledge are independent lookups
+        central_topic, knowledge_result = await asyncio.gather(
+            get_central_topic(request.session_id),
+            run_query(supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id)),
+        )
         user_background = [n["label"] for n in knowledge_result.data if n.get("label")]
 
         # Generate prerequisites via Gemini
         result = await generate_prerequisites_for_topic(central_topic, user_background)
-        prerequisites_data = result.get("prerequisites", [])
-
-        prerequisites = []
-        needs_confirmation = []
-
-        for i, p in enumerate(prerequisites_data):
-            prereq = PrerequisiteItem(
+        prerequisites = [
+            PrerequisiteItem(
                 name=p.get("name", ""),
                 description=p.get("description", ""),
                 confidence=p.get("confidence", 0.8),
                 order_index=i,
                 is_foundational=p.get("is_foundational", False)
             )
-            prerequisites.append(prereq)
+            for i, p in enumerate(result.get("prerequisites", []))
+        ]
 
-            # Flag low-confidence items for user confirmation
-            if 0.5 <= prereq.confidence < 0.7:
-                needs_confirmation.append(prereq)
+        # Flag low-confidence items for user confirmation
+        needs_confirmation = [prereq for prereq in prerequisites if 0.5 <= prereq.confidence < 0.7]
 
         return PrerequisitesGenerateResponse(
             success=True,
@@ -2243,7 +3009,6 @@ async def generate_prerequisites(request: PrerequisitesGenerateRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return PrerequisitesGenerateResponse(success=False, error=str(e))
 
@@ -2253,23 +3018,21 @@ async def confirm_prerequisites(request: PrerequisitesConfirmRequest):
     """Confirm prerequisites and create lesson topics."""
     try:
         # Get session
-        session = supabase.table("learning_sessions").select("central_topic").eq("id", request.session_id).single().execute()
-        if not session.data:
-            raise HTTPException(status_code=404, detail="Session not found")
+        await get_central_topic(request.session_id)  # 404s for unknown sessions
 
-        # Store confirmed prerequisites as lesson_topics
-        for i, prereq_name in enumerate(request.confirmed_prerequisites):
-            # Check if topic already exists
-            existing = supabase.table("lesson_topics").select("id").eq("session_id", request.session_id).eq("topic_name", prereq_name).execute()
-
-            if not existing.data:
-                supabase.table("lesson_topics").insert({
-                    "session_id": request.session_id,
-                    "topic_name": prereq_name,
-                    "order_index": i,
-                    "is_confirmed": True,
-                    "mastery_level": 0.0
-                }).execute()
+        # Store confirmed prerequisites as lesson_topics in one upsert; topics
+        # that already exist are left untouched
+        if request.confirmed_prerequisites:
+            await run_query(supabase.table("lesson_topics").upsert([{
+                "session_id": request.session_id,
+                "topic_name": prereq_name,
+                "order_index": i,
+                "is_confirmed": True,
+                "mastery_level": 0.0
+            } for i, prereq_name in enumerate(request.confirmed_prerequisites)],
+                on_conflict="session_id,topic_name",
+                ignore_duplicates=True
+            ))
 
         return PrerequisitesConfirmResponse(
             success=True,
@@ -2279,7 +3042,6 @@ async def confirm_prerequisites(request: PrerequisitesConfirmRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return PrerequisitesConfirmResponse(success=False, error=str(e))
 
@@ -2288,28 +3050,19 @@ async def confirm_prerequisites(request: PrerequisitesConfirmRequest):
 # LEARNING PATH GENERATION - Gap Analysis & Concept Decomposition
 # =============================================================================
 
-async def generate_learning_path_analysis(
-    central_topic: str,
-    paper_titles: List[str],
-    existing_knowledge: List[str]
-) -> dict:
-    """
-    Use Gemini to:
-    1. Identify the research domain based on paper titles
-    2. Decompose the topic into sub-concepts with prerequisites
-    3. Determine which concepts user knows (from papers) vs gaps
-    """
-    papers_formatted = "\n".join([f"- {t}" for t in paper_titles]) if paper_titles else "None"
-    knowledge_formatted = "\n".join([f"- {k}" for k in existing_knowledge]) if existing_knowledge else "None"
+def _canonical_list(items: List[str]) -> List[str]:
+    """Strip, drop case-insensitive duplicates and sort, keeping each item's original spelling."""
+    unique = {}
+    for item in items:
+        item = item.strip()
+        if item:
+            unique.setdefault(item.casefold(), item)
+    return [unique[key] for key in sorted(unique)]
 
-    prompt = f"""You are an expert academic advisor analyzing a researcher's knowledge to create a personalized learning path.
 
-INPUT:
-- Research question/topic: "{central_topic}"
-- Papers the user has read:
-{papers_formatted}
-- Existing knowledge nodes from their background:
-{knowledge_formatted}
+LEARNING_PATH_ANALYSIS_SYSTEM = """You are an expert academic advisor analyzing a researcher's knowledge to create a personalized learning path.
+
+You are given the researcher's question/topic, the papers they have read, and existing knowledge nodes from their background.
 
 TASK:
 1. DOMAIN IDENTIFICATION: Based on the papers read and topic, identify the primary research domain and subdomain.
@@ -2326,11 +3079,11 @@ TASK:
    - Mark is_known: false if this is a gap in their knowledge
 
 OUTPUT FORMAT (strict JSON, no markdown):
-{{
+{
   "domain": "primary research domain",
   "subdomain": "specific subdomain or intersection",
   "concepts": [
-    {{
+    {
       "name": "concept name (2-4 words)",
       "description": "1-2 sentence explanation of what this concept covers",
       "is_prerequisite": true/false,
@@ -2339,10 +3092,10 @@ OUTPUT FORMAT (strict JSON, no markdown):
       "estimated_hours": number of hours to learn,
       "is_known": true/false,
       "source_papers": ["titles of papers that cover this concept"]
-    }}
+    }
   ],
   "learning_path_order": ["ordered", "list", "of", "concept", "names", "to", "learn"]
-}}
+}
 
 CONSTRAINTS:
 - Return 15-25 concepts total
@@ -2353,7 +3106,44 @@ CONSTRAINTS:
 - is_known should be true ONLY if the user's papers clearly cover this concept
 - Concepts with is_known=true should NOT be in learning_path_order (they already know it)"""
 
-    response_text = await call_gemini(prompt)
+LEARNING_PATH_ANALYSIS_PROMPT = """INPUT:
+- Research question/topic: "{central_topic}"
+- Papers the user has read:
+{papers}
+- Existing knowledge nodes from their background:
+{knowledge}"""
+
+
+async def generate_learning_path_analysis(
+    central_topic: str,
+    paper_titles: List[str],
+    existing_knowledge: List[str]
+) -> dict:
+    """
+    Use Gemini to:
+    1. Identify the research domain based on paper titles
+    2. Decompose the topic into sub-concepts with prerequisites
+    3. Determine which concepts user knows (from papers) vs gaps
+
+    Inputs are deduplicated and sorted first, so the same papers and
+    knowledge in any order build an identical prompt and share one cached
+    answer (kept for NODE_CACHE_TTL_SECONDS).
+    """
+    paper_titles = _canonical_list(paper_titles)
+    existing_knowledge = _canonical_list(existing_knowledge)
+    prompt = LEARNING_PATH_ANALYSIS_PROMPT.format_map({
+        "central_topic": central_topic,
+        "papers": "\n".join(f"- {t}" for t in paper_titles) or "None",
+        "knowledge": "\n".join(f"- {k}" for k in existing_knowledge) or "None",
+    })
+
+    response_text = await call_gemini(
+        prompt,
+        task="learning_path_analysis",
+        semantic_key=central_topic,
+        system=LEARNING_PATH_ANALYSIS_SYSTEM,
+        cache_ttl=NODE_CACHE_TTL_SECONDS,
+    )
     result = extract_json_from_response(response_text)
     return result
 
@@ -2371,24 +3161,19 @@ async def generate_learning_path(request: LearningPathRequest):
     5. Stores results in Supabase for monitoring
     """
     try:
-        # Get session to retrieve central_topic
-        session = supabase.table("learning_sessions").select("*").eq("id", request.session_id).single().execute()
-        if not session.data:
-            raise HTTPException(status_code=404, detail="Session not found")
-
-        central_topic = session.data["central_topic"]
-
-        # Fetch all papers the user has read for this session
-        papers_result = supabase.table("academia_materials").select("title, material_type").eq("session_id", request.session_id).eq("user_id", request.user_id).execute()
+        # The session's central_topic, the papers the user has read and their
+        # existing knowledge nodes are independent reads; fetch them together
+        central_topic, papers_result, knowledge_result = await asyncio.gather(
+            get_central_topic(request.session_id),
+            run_query(supabase.table("academia_materials").select("title, material_type").eq("session_id", request.session_id).eq("user_id", request.user_id)),
+            run_query(supabase.table("knowledge_nodes").select("label, domain, type").eq("session_id", request.session_id)),
+        )
 
         paper_titles = [
             p["title"] for p in papers_result.data
             if p.get("title") and p.get("material_type") == "paper_read"
         ]
 
-        # Get existing knowledge nodes from background
-        knowledge_result = supabase.table("knowledge_nodes").select("label, domain, type").eq("session_id", request.session_id).execute()
-
         existing_knowledge = [n["label"] for n in knowledge_result.data if n.get("label")]
 
         # Generate learning path using Gemini
@@ -2404,68 +3189,37 @@ async def generate_learning_path(request: LearningPathRequest):
         concepts_data = analysis.get("concepts", [])
         learning_path_order = analysis.get("learning_path_order", [])
 
-        # Separate known concepts from gaps
-        known_concepts = []
-        knowledge_gaps = []
-        concepts = []
-        total_hours = 0.0
-
-        for c in concepts_data:
-            concept = ConceptNode(
-                name=c.get("name", ""),
-                description=c.get("description", ""),
-                is_prerequisite=c.get("is_prerequisite", False),
-                prerequisites=c.get("prerequisites", []),
-                difficulty_level=c.get("difficulty_level", 1),
-                estimated_hours=c.get("estimated_hours", 1.0),
-                is_known=c.get("is_known", False),
-                source_papers=c.get("source_papers", [])
-            )
-            concepts.append(concept)
-
-            if concept.is_known:
-                known_concepts.append(concept.name)
-            else:
-                knowledge_gaps.append(concept.name)
-                total_hours += concept.estimated_hours
-
-        # Store in topic_concepts table
-        concepts_json = [c.model_dump() for c in concepts]
-
-        # Check if entry already exists
-        existing_tc = supabase.table("topic_concepts").select("id").eq("session_id", request.session_id).eq("user_id", request.user_id).execute()
-
-        if existing_tc.data:
-            # Update existing
-            supabase.table("topic_concepts").update({
-                "research_topic": central_topic,
-                "concepts": {
-                    "domain": domain,
-                    "subdomain": subdomain,
-                    "concepts": concepts_json,
-                    "learning_path_order": learning_path_order
-                },
-                "updated_at": datetime.utcnow().isoformat()
-            }).eq("id", existing_tc.data[0]["id"]).execute()
-            topic_concepts_id = existing_tc.data[0]["id"]
-        else:
-            # Create new
-            tc_result = supabase.table("topic_concepts").insert({
-                "session_id": request.session_id,
-                "user_id": request.user_id,
-                "research_topic": central_topic,
-                "concepts": {
-                    "domain": domain,
-                    "subdomain": subdomain,
-                    "concepts": concepts_json,
-                    "learning_path_order": learning_path_order
-                }
-            }).execute()
-            topic_concepts_id = tc_result.data[0]["id"]
+        # Validate every concept in one call, then separate known concepts from gaps
+        concepts = _CONCEPT_LIST_ADAPTER.validate_python(
+            [{"name": "", "description": "", **c} for c in concepts_data]
+        )
+        known_concepts = [concept.name for concept in concepts if concept.is_known]
+        gap_concepts = [concept for concept in concepts if not concept.is_known]
+        knowledge_gaps = [concept.name for concept in gap_concepts]
+        total_hours = sum((concept.estimated_hours for concept in gap_concepts), 0.0)
+
+        # Store in topic_concepts table. supabase-py encodes request bodies
+        # itself (httpx json=), so the concepts go over as plain Python values;
+        # bytes pre-encoded with orjson would only be decoded and re-encoded.
+        concepts_json = _CONCEPT_LIST_ADAPTER.dump_python(concepts)
+
+        # One row per session and user; regenerating updates it in place
+        updated_at = datetime.now(timezone.utc).isoformat()
+        tc_result = await run_query(supabase.table("topic_concepts").upsert({
+            "session_id": request.session_id,
+            "user_id": request.user_id,
+            "research_topic": central_topic,
+            "concepts": {
+                "domain": domain,
+                "subdomain": subdomain,
+                "concepts": concepts_json,
+                "learning_path_order": learning_path_order
+            },
+            "updated_at": updated_at
+        }, on_conflict="session_id,user_id"))
+        topic_concepts_id = tc_result.data[0]["id"]
 
         # Store knowledge similarity/gap analysis
-        existing_uks = supabase.table("user_knowledge_similarity").select("id").eq("session_id", request.session_id).eq("user_id", request.user_id).execute()
-
         knowledge_data = {
             "known_concepts": [{"name": k, "source": "papers"} for k in known_concepts],
             "knowledge_gaps": knowledge_gaps,
@@ -2474,21 +3228,14 @@ async def generate_learning_path(request: LearningPathRequest):
             "coverage_percentage": len(known_concepts) / max(len(concepts), 1) * 100
         }
 
-        if existing_uks.data:
-            supabase.table("user_knowledge_similarity").update({
-                "topic_concepts_id": topic_concepts_id,
-                "known_concepts": knowledge_data,
-                "learning_path_suggestion": f"Focus on {len(knowledge_gaps)} concepts: {', '.join(learning_path_order[:5])}{'...' if len(learning_path_order) > 5 else ''}",
-                "updated_at": datetime.utcnow().isoformat()
-            }).eq("id", existing_uks.data[0]["id"]).execute()
-        else:
-            supabase.table("user_knowledge_similarity").insert({
-                "session_id": request.session_id,
-                "user_id": request.user_id,
-                "topic_concepts_id": topic_concepts_id,
-                "known_concepts": knowledge_data,
-                "learning_path_suggestion": f"Focus on {len(knowledge_gaps)} concepts: {', '.join(learning_path_order[:5])}{'...' if len(learning_path_order) > 5 else ''}"
-            }).execute()
+        await run_query(supabase.table("user_knowledge_similarity").upsert({
+            "session_id": request.session_id,
+            "user_id": request.user_id,
+            "topic_concepts_id": topic_concepts_id,
+            "known_concepts": knowledge_data,
+            "learning_path_suggestion": f"Focus on {len(knowledge_gaps)} concepts: {', '.join(learning_path_order[:5])}{'...' if len(learning_path_order) > 5 else ''}",
+            "updated_at": updated_at
+        }, on_conflict="session_id,user_id"))
 
         return LearningPathResponse(
             success=True,
@@ -2504,7 +3251,6 @@ async def generate_learning_path(request: LearningPathRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return LearningPathResponse(success=False, error=str(e))
 
@@ -2514,13 +3260,13 @@ async def get_learning_path(session_id: str):
     """Get the stored learning path for a session."""
     try:
         # Get topic concepts
-        tc_result = supabase.table("topic_concepts").select("*").eq("session_id", session_id).single().execute()
+        tc_result = await run_query(supabase.table("topic_concepts").select("*").eq("session_id", session_id).single())
 
         if not tc_result.data:
             raise HTTPException(status_code=404, detail="Learning path not found. Generate one first.")
 
         # Get knowledge similarity
-        uks_result = supabase.table("user_knowledge_similarity").select("*").eq("session_id", session_id).single().execute()
+        uks_result = await run_query(supabase.table("user_knowledge_similarity").select("*").eq("session_id", session_id).single())
 
         return {
             "topic_concepts": tc_result.data,
@@ -2539,6 +3285,7 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "openai/gpt-4o-mini")
 PREREQ_LOW_THRESHOLD = float(os.getenv("PREREQ_LOW_THRESHOLD", "0.3"))
 PREREQ_HIGH_THRESHOLD = float(os.getenv("PREREQ_HIGH_THRESHOLD", "0.7"))
+OPENALEX_API_KEY = os.getenv("OPENALEX_API_KEY")
 
 # Import content aggregator
 from services.content_aggregator import ContentAggregator, ContentType, SourceType
@@ -2584,16 +3331,156 @@ class CompleteActivityResponse(BaseModel):
     error: Optional[str] = None
 
 
+# Problem activities carry their JSON payload inline as a data URL
+PROBLEM_DATA_URL_PREFIX = "data:application/json,"
+
+
+def _parse_problem_data(embed_url: Optional[str]) -> Optional[dict]:
+    """Decode a problem activity's inline JSON, or None if it has none."""
+    if not embed_url or not embed_url.startswith(PROBLEM_DATA_URL_PREFIX):
+        return None
+    try:
+        return orjson.loads(embed_url[len(PROBLEM_DATA_URL_PREFIX):])
+    except orjson.JSONDecodeError:
+        return None
+
+
 @app.get("/api/prerequisites/{session_id}")
 async def get_prerequisites(session_id: str):
     """Get all prerequisites for a session."""
     try:
-        result = supabase.table("lesson_topics").select("*").eq("session_id", session_id).order("order_index").execute()
+        result = await run_query(supabase.table("lesson_topics").select("*").eq("session_id", session_id).order("order_index"))
         return {"prerequisites": result.data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _next_activity_response(activity: dict, current_topic: dict) -> NextActivityResponse:
+    """Build the next-activity response for a stored lesson_activities row."""
+    # Parse problem data if it's a problem type
+    is_problem = activity["activity_type"] == ContentType.PROBLEM.value
+    problem_data = _parse_problem_data(activity["embed_url"]) if is_problem else None
+    
+    return NextActivityResponse(
+        success=True,
+        activity=ActivityItem(
+            id=activity["id"],
+            topic_id=current_topic["id"],
+            topic_name=current_topic["topic_name"],
+            activity_type=activity["activity_type"],
+            title=activity["title"],
+            embed_url=activity["embed_url"],
+            source_type=activity["source_type"],
+            source_title=activity.get("source_title"),
+            duration_minutes=activity.get("duration_minutes"),
+            order_index=activity["order_index"],
+            is_problem=is_problem,
+            problem_data=problem_data
+        ),
+        topic_progress={
+            "topic_name": current_topic["topic_name"],
+            "mastery_level": current_topic["mastery_level"],
+            "order_index": current_topic["order_index"]
+        }
+    )
+
+
+async def _create_next_activity(topic_id: str, topic_name: str, activity_count: int) -> Optional[dict]:
+    """
+    Find content for a topic's next activity and store it as incomplete.
+
+    Activities are unique per (topic_id, order_index) (migration 011), so when
+    a background prefetch and a request race for the same slot, both end up
+    with the row that was stored first.
+
+    Returns:
+        The stored lesson_activities row, or None when no content was found
+    """
+    aggregator = ContentAggregator(OPENROUTER_API_KEY, OPENALEX_API_KEY)
+    used_aggregator_search = False
+    
+    # Determine activity type based on count
+    if activity_count == 0:
+        # First activity: video
+        content_items = await aggregator.search_youtube(topic_name, max_results=1)
+        if not content_items:
+            search_result = await aggregator.search_content_for_topic(
+                topic_name,
+                content_types=[ContentType.VIDEO],
+                max_items=1
+            )
+            content_items = search_result.items
+            used_aggregator_search = True
+    elif activity_count == 1:
+        # Second activity: reading
+        content_items = await aggregator.search_openalex(topic_name, max_results=1)
+    elif activity_count % 3 == 2:
+        # Every third activity: problem
+        problem = await aggregator.generate_problem(topic_name)
+        content_items = [problem] if problem else []
+    else:
+        # Mix of videos and readings
+        search_result = await aggregator.search_content_for_topic(topic_name, max_items=1)
+        content_items = search_result.items
+        used_aggregator_search = True
+    
+    if not content_items and not used_aggregator_search:
+        # Fallback: try general search
+        search_result = await aggregator.search_content_for_topic(topic_name, max_items=1)
+        content_items = search_result.items
+    
+    if not content_items:
+        return None
+    
+    content = content_items[0]
+    
+    # Store the new activity
+    stored = await run_query(supabase.table("lesson_activities").upsert({
+        "topic_id": topic_id,
+        "activity_type": content.content_type.value,
+        "title": content.title,
+        "embed_url": content.embed_url,
+        "source_type": content.source_type.value,
+        "source_title": content.source_title,
+        "duration_minutes": content.duration_minutes,
+        "order_index": activity_count,
+        "completed": False
+    }, on_conflict="topic_id,order_index", ignore_duplicates=True))
+    if stored.data:
+        return stored.data[0]
+    
+    existing = await run_query(supabase.table("lesson_activities").select("*").eq("topic_id", topic_id).eq("order_index", activity_count).limit(1))
+    return existing.data[0] if existing.data else None
+
+
+async def _prefetch_next_activity(topic_id: str, activity_count: int) -> None:
+    """
+    Store a topic's next activity while the learner is still on the last one.
+
+    The next /api/lesson/next-activity call then finds it already stored
+    instead of waiting on content search or problem generation.
+    """
+    key = (topic_id, activity_count)
+    if key in ACTIVITY_PREFETCHES:
+        return
+    ACTIVITY_PREFETCHES.add(key)
+    try:
+        async with ACTIVITY_PREFETCH_SEMAPHORE:
+            topic_result, pending_result = await asyncio.gather(
+                run_query(supabase.table("lesson_topics").select("topic_name, completed_at").eq("id", topic_id).limit(1)),
+                run_query(supabase.table("lesson_activities").select("id").eq("topic_id", topic_id).eq("completed", False).limit(1)),
+            )
+            if not topic_result.data or topic_result.data[0].get("completed_at") or pending_result.data:
+                return
+            topic_name = topic_result.data[0]["topic_name"]
+            if await _create_next_activity(topic_id, topic_name, activity_count):
+                print(f"[LessonActivity] Prefetched activity {activity_count} for '{topic_name}'")
+    except Exception as e:
+        print(f"[LessonActivity] Prefetch for topic {topic_id} failed: {e}")
+    finally:
+        ACTIVITY_PREFETCHES.discard(key)
+
+
 @app.get("/api/lesson/next-activity", response_model=NextActivityResponse)
 async def get_next_activity(session_id: str, user_id: int):
     """
@@ -2602,14 +3489,15 @@ async def get_next_activity(session_id: str, user_id: int):
     """
     try:
         # Get current topic (first incomplete, confirmed topic)
-        topics_result = supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1).execute()
+        topics_result = await run_query(supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1))
         
         if not topics_result.data:
-            # Check if course is complete
-            all_topics = supabase.table("lesson_topics").select("id").eq("session_id", session_id).eq("is_confirmed", True).execute()
-            completed_topics = supabase.table("lesson_topics").select("id").eq("session_id", session_id).eq("is_confirmed", True).not_.is_("completed_at", "null").execute()
+            # Check if course is complete (one read; completed topics counted here)
+            all_topics = await run_query(supabase.table("lesson_topics").select("id, completed_at").eq("session_id", session_id).eq("is_confirmed", True))
+            total = len(all_topics.data)
+            done = sum(1 for t in all_topics.data if t.get("completed_at"))
             
-            if len(all_topics.data) > 0 and len(all_topics.data) == len(completed_topics.data):
+            if total and total == done:
                 return NextActivityResponse(success=True, is_course_complete=True)
             
             return NextActivityResponse(success=False, error="No topics found. Generate prerequisites first.")
@@ -2619,54 +3507,22 @@ async def get_next_activity(session_id: str, user_id: int):
         topic_name = current_topic["topic_name"]
         
         # Check for existing incomplete activity
-        existing_activity = supabase.table("lesson_activities").select("*").eq("topic_id", topic_id).eq("completed", False).order("order_index").limit(1).execute()
+        existing_activity = await run_query(supabase.table("lesson_activities").select("*").eq("topic_id", topic_id).eq("completed", False).order("order_index").limit(1))
         
         if existing_activity.data:
-            activity = existing_activity.data[0]
-            
-            # Parse problem data if it's a problem type
-            problem_data = None
-            is_problem = activity["activity_type"] == "problem"
-            if is_problem and activity["embed_url"] and activity["embed_url"].startswith("data:application/json,"):
-                try:
-                    problem_data = json.loads(activity["embed_url"].replace("data:application/json,", ""))
-                except:
-                    pass
-            
-            return NextActivityResponse(
-                success=True,
-                activity=ActivityItem(
-                    id=activity["id"],
-                    topic_id=topic_id,
-                    topic_name=topic_name,
-                    activity_type=activity["activity_type"],
-                    title=activity["title"],
-                    embed_url=activity["embed_url"],
-                    source_type=activity["source_type"],
-                    source_title=activity.get("source_title"),
-                    duration_minutes=activity.get("duration_minutes"),
-                    order_index=activity["order_index"],
-                    is_problem=is_problem,
-                    problem_data=problem_data
-                ),
-                topic_progress={
-                    "topic_name": topic_name,
-                    "mastery_level": current_topic["mastery_level"],
-                    "order_index": current_topic["order_index"]
-                }
-            )
+            return _next_activity_response(existing_activity.data[0], current_topic)
         
         # No existing activity - need to generate new ones
         # Count completed activities for this topic
-        completed_count = supabase.table("lesson_activities").select("id").eq("topic_id", topic_id).eq("completed", True).execute()
+        completed_count = await run_query(supabase.table("lesson_activities").select("id").eq("topic_id", topic_id).eq("completed", True))
         activity_count = len(completed_count.data)
         
         # Check if topic should be marked complete (mastery threshold)
         if current_topic["mastery_level"] >= 0.8 or activity_count >= 5:
             # Mark topic as complete
-            supabase.table("lesson_topics").update({
-                "completed_at": datetime.utcnow().isoformat()
-            }).eq("id", topic_id).execute()
+            await run_query(supabase.table("lesson_topics").update({
+                "completed_at": datetime.now(timezone.utc).isoformat()
+            }).eq("id", topic_id))
             
             return NextActivityResponse(
                 success=True,
@@ -2679,93 +3535,13 @@ async def get_next_activity(session_id: str, user_id: int):
             )
         
         # Generate new activity using content aggregator
-        aggregator = ContentAggregator(OPENROUTER_API_KEY, os.getenv("OPENALEX_API_KEY"))
-        used_aggregator_search = False
-        
-        # Determine activity type based on count
-        if activity_count == 0:
-            # First activity: video
-            content_items = await aggregator.search_youtube(topic_name, max_results=1)
-            if not content_items:
-                search_result = await aggregator.search_content_for_topic(
-                    topic_name,
-                    content_types=[ContentType.VIDEO],
-                    max_items=1
-                )
-                content_items = search_result.items
-                used_aggregator_search = True
-        elif activity_count == 1:
-            # Second activity: reading
-            content_items = await aggregator.search_openalex(topic_name, max_results=1)
-        elif activity_count % 3 == 2:
-            # Every third activity: problem
-            problem = await aggregator.generate_problem(topic_name)
-            content_items = [problem] if problem else []
-        else:
-            # Mix of videos and readings
-            search_result = await aggregator.search_content_for_topic(topic_name, max_items=1)
-            content_items = search_result.items
-            used_aggregator_search = True
-        
-        if not content_items and not used_aggregator_search:
-            # Fallback: try general search
-            search_result = await aggregator.search_content_for_topic(topic_name, max_items=1)
-            content_items = search_result.items
-        
-        if not content_items:
+        activity = await _create_next_activity(topic_id, topic_name, activity_count)
+        if activity is None:
             return NextActivityResponse(success=False, error=f"Could not find content for topic: {topic_name}")
         
-        content = content_items[0]
-        
-        # Store the new activity
-        new_activity = supabase.table("lesson_activities").insert({
-            "topic_id": topic_id,
-            "activity_type": content.content_type.value,
-            "title": content.title,
-            "embed_url": content.embed_url,
-            "source_type": content.source_type.value,
-            "source_title": content.source_title,
-            "duration_minutes": content.duration_minutes,
-            "order_index": activity_count,
-            "completed": False
-        }).execute()
-        
-        activity = new_activity.data[0]
-        
-        # Parse problem data if it's a problem type
-        problem_data = None
-        is_problem = content.content_type == ContentType.PROBLEM
-        if is_problem and content.embed_url and content.embed_url.startswith("data:application/json,"):
-            try:
-                problem_data = json.loads(content.embed_url.replace("data:application/json,", ""))
-            except:
-                pass
-        
-        return NextActivityResponse(
-            success=True,
-            activity=ActivityItem(
-                id=activity["id"],
-                topic_id=topic_id,
-                topic_name=topic_name,
-                activity_type=content.content_type.value,
-                title=content.title,
-                embed_url=content.embed_url,
-                source_type=content.source_type.value,
-                source_title=content.source_title,
-                duration_minutes=content.duration_minutes,
-                order_index=activity_count,
-                is_problem=is_problem,
-                problem_data=problem_data
-            ),
-            topic_progress={
-                "topic_name": topic_name,
-                "mastery_level": current_topic["mastery_level"],
-                "order_index": current_topic["order_index"]
-            }
-        )
+        return _next_activity_response(activity, current_topic)
     
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return NextActivityResponse(success=False, error=str(e))
 
@@ -2776,57 +3552,24 @@ async def complete_activity(request: CompleteActivityRequest):
     Mark an activity as complete and update mastery level.
     """
     try:
-        # Get the activity
-        activity_result = supabase.table("lesson_activities").select("*, lesson_topics(*)").eq("id", request.activity_id).single().execute()
-        
-        if not activity_result.data:
+        # Marks the activity complete, recomputes the topic's mastery and
+        # closes a mastered topic in one transaction (migration 010)
+        result = await run_query(supabase.rpc("complete_activity_rpc", {
+            "p_activity_id": request.activity_id,
+            "p_user_response": request.user_response,
+            "p_feedback": request.feedback
+        }))
+
+        if not result.data:
             raise HTTPException(status_code=404, detail="Activity not found")
-        
-        activity = activity_result.data
-        topic_id = activity["topic_id"]
-        
-        # Mark activity as complete
-        supabase.table("lesson_activities").update({
-            "completed": True,
-            "completed_at": datetime.utcnow().isoformat(),
-            "user_response": request.user_response
-        }).eq("id", request.activity_id).execute()
-        
-        # Get topic and calculate new mastery
-        topic_result = supabase.table("lesson_topics").select("*").eq("id", topic_id).single().execute()
-        topic = topic_result.data
-        
-        # Count completed activities
-        completed = supabase.table("lesson_activities").select("id").eq("topic_id", topic_id).eq("completed", True).execute()
-        completed_count = len(completed.data)
-        
-        # Calculate mastery based on completed activities (simple formula)
-        # Each activity adds ~0.2 to mastery, capped at 1.0
-        base_mastery = completed_count * 0.2
-        
-        # Adjust based on feedback
-        if request.feedback == "confused":
-            # Reduce mastery gain when confused
-            base_mastery = max(0, base_mastery - 0.1)
-        elif request.feedback == "too_easy":
-            # Boost mastery when content is too easy
-            base_mastery = base_mastery + 0.15
-        
-        new_mastery = min(1.0, base_mastery)
-        
-        # Update topic mastery
-        supabase.table("lesson_topics").update({
-            "mastery_level": new_mastery
-        }).eq("id", topic_id).execute()
-        
-        # Check if topic is complete
-        topic_complete = new_mastery >= 0.8 or completed_count >= 5
-        
-        if topic_complete:
-            supabase.table("lesson_topics").update({
-                "completed_at": datetime.utcnow().isoformat()
-            }).eq("id", topic_id).execute()
-        
+
+        completion = result.data[0]
+        new_mastery = completion["new_mastery"]
+        topic_complete = completion["topic_complete"]
+
+        if not topic_complete and ACTIVITY_PREFETCH_CONCURRENCY > 0:
+            _spawn_background(_prefetch_next_activity(completion["topic_id"], completion["completed_count"]))
+
         return CompleteActivityResponse(
             success=True,
             mastery_updated=True,
@@ -2837,7 +3580,6 @@ async def complete_activity(request: CompleteActivityRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return CompleteActivityResponse(success=False, error=str(e))
 
@@ -2847,7 +3589,7 @@ async def skip_topic(session_id: str, user_id: int):
     """Skip the current topic and move to the next one."""
     try:
         # Get current topic
-        topics_result = supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1).execute()
+        topics_result = await run_query(supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1))
         
         if not topics_result.data:
             return {"success": False, "error": "No active topic to skip"}
@@ -2855,10 +3597,10 @@ async def skip_topic(session_id: str, user_id: int):
         current_topic = topics_result.data[0]
         
         # Mark as complete (skipped)
-        supabase.table("lesson_topics").update({
-            "completed_at": datetime.utcnow().isoformat(),
+        await run_query(supabase.table("lesson_topics").update({
+            "completed_at": datetime.now(timezone.utc).isoformat(),
             "mastery_level": 0.0  # No mastery for skipped topics
-        }).eq("id", current_topic["id"]).execute()
+        }).eq("id", current_topic["id"]))
         
         return {"success": True, "skipped_topic": current_topic["topic_name"]}
     
@@ -2871,7 +3613,7 @@ async def get_lesson_progress(session_id: str):
     """Get overall lesson progress for a session."""
     try:
         # Get all topics
-        topics = supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).order("order_index").execute()
+        topics = await run_query(supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).order("order_index"))
         
         total = len(topics.data)
         completed = sum(1 for t in topics.data if t.get("completed_at"))
@@ -2948,9 +3690,20 @@ async def generate_simplified_lesson(
     user_background: List[str],
     abstraction_level: int = 2,
     current_content: Optional[str] = None
+) -> str:
+    """Generate lesson content at a specified abstraction level."""
+    prompt = await build_simplified_lesson_prompt(topic, user_background, abstraction_level, current_content)
+    return await call_gemini(prompt, task="simplified_lesson")
+
+
+async def build_simplified_lesson_prompt(
+    topic: str,
+    user_background: List[str],
+    abstraction_level: int = 2,
+    current_content: Optional[str] = None
 ) -> str:
     """
-    Generate lesson content at a specified abstraction level.
+    Build the lesson prompt for a specified abstraction level.
 
     Levels:
     1 = ELI5 (Explain Like I'm 5) - Very simple analogies, no jargon
@@ -3045,8 +3798,7 @@ CONTENT:
 Match complexity to level {abstraction_level}. About {"400-600" if abstraction_level <= 2 else "600-900"} words.
 Output ONLY the Markdown lesson content."""
 
-    response = await call_gemini(prompt)
-    return response
+    return prompt
 
 
 async def generate_lesson_text(topic: str, user_background: List[str]) -> str:
@@ -3079,10 +3831,18 @@ CONTENT STRUCTURE:
 
 About 600-1000 words. Start directly with the content - no code fences."""
 
-    response = await call_gemini(prompt)
+    response = await call_gemini(prompt, task="lesson_text", semantic_key=topic)
     return response
 
 
+PROBLEM_SEARCH_PROVIDER = os.getenv(
+    "PROBLEM_SEARCH_PROVIDER",
+    "openrouter" if OPENROUTER_API_KEY else "auto"
+).strip().lower()
+PROBLEM_SEARCH_TIMEOUT_SECONDS = float(os.getenv("PROBLEM_SEARCH_TIMEOUT_SECONDS", "45"))
+OPENROUTER_PROBLEM_TIMEOUT_SECONDS = float(os.getenv("OPENROUTER_PROBLEM_TIMEOUT_SECONDS", "70"))
+
+
 async def _generate_problem_search_text(
     prompt: str,
     *,
@@ -3092,10 +3852,7 @@ async def _generate_problem_search_text(
     search_prompt: str
 ) -> str:
     """Search for sourced problems with a fast fallback to the original online model."""
-    provider = os.getenv(
-        "PROBLEM_SEARCH_PROVIDER",
-        "openrouter" if OPENROUTER_API_KEY else "auto"
-    ).strip().lower()
+    provider = PROBLEM_SEARCH_PROVIDER
 
     if provider == "openrouter" and OPENROUTER_API_KEY:
         return await _call_openrouter_problem_search(
@@ -3105,7 +3862,6 @@ async def _generate_problem_search_text(
             search_prompt=search_prompt
         )
 
-    timeout_seconds = float(os.getenv("PROBLEM_SEARCH_TIMEOUT_SECONDS", "45"))
     try:
         return await asyncio.wait_for(
             generate_text(
@@ -3116,7 +3872,7 @@ async def _generate_problem_search_text(
                 temperature=temperature,
                 search_prompt=search_prompt
             ),
-            timeout=timeout_seconds
+            timeout=PROBLEM_SEARCH_TIMEOUT_SECONDS
         )
     except Exception as e:
         if OPENROUTER_API_KEY and provider in {"auto", "claude", ""}:
@@ -3140,37 +3896,36 @@ async def _call_openrouter_problem_search(
     if not OPENROUTER_API_KEY:
         raise RuntimeError("OPENROUTER_API_KEY not configured for problem search fallback")
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": os.getenv("LLM_HTTP_REFERER", "https://arxlearn.app"),
-                "X-Title": os.getenv("LLM_APP_TITLE", "arXlearn")
-            },
-            json={
-                "model": os.getenv("OPENROUTER_SEARCH_MODEL", "openai/gpt-4o-mini:online"),
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "plugins": [{
-                    "id": "web",
-                    "max_results": int(os.getenv("OPENROUTER_SEARCH_MAX_RESULTS", "3")),
-                    "search_prompt": search_prompt
-                }]
-            },
-            timeout=float(os.getenv("OPENROUTER_PROBLEM_TIMEOUT_SECONDS", "70"))
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
+    client = get_http_client()
+    response = await client.post(
+        "https://openrouter.ai/api/v1/chat/completions",
+        headers={
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": LLM_HTTP_REFERER,
+            "X-Title": LLM_APP_TITLE
+        },
+        json={
+            "model": primary_model(OPENROUTER_SEARCH_MODELS),
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "plugins": [{
+                "id": "web",
+                "max_results": OPENROUTER_SEARCH_MAX_RESULTS,
+                "search_prompt": search_prompt
+            }]
+        },
+        timeout=OPENROUTER_PROBLEM_TIMEOUT_SECONDS
+    )
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    return data["choices"][0]["message"]["content"]
 
 
 async def _parse_problem_search_response(content: str, *, task: str, max_tokens: int) -> List[dict]:
     try:
-        from services.llm_provider import extract_json_from_response as _extract_provider_json
-        parsed = _extract_provider_json(content)
+        parsed = extract_json_from_response(content)
     except Exception:
         parsed = await generate_json(
             f"""Repair this intended JSON array of sourced practice problems.
@@ -3199,15 +3954,15 @@ async def _source_url_is_reachable(source_url: str) -> bool:
         "User-Agent": "Mozilla/5.0 (compatible; arXlearn/1.0; +https://arxlearn.app)"
     }
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            response = None
-            try:
-                response = await client.head(source_url, headers=headers, timeout=8.0)
-            except Exception:
-                pass
-            if response is None or response.status_code in {403, 405} or response.status_code >= 400:
-                response = await client.get(source_url, headers=headers, timeout=12.0)
-            return response.status_code < 400
+        client = get_http_client()
+        response = None
+        try:
+            response = await client.head(source_url, headers=headers, timeout=8.0, follow_redirects=True)
+        except Exception:
+            pass
+        if response is None or response.status_code in {403, 405} or response.status_code >= 400:
+            response = await client.get(source_url, headers=headers, timeout=12.0, follow_redirects=True)
+        return response.status_code < 400
     except Exception as e:
         print(f"[LessonContent] Problem source URL failed validation: {source_url} ({e})")
         return False
@@ -3600,8 +4355,7 @@ IMPORTANT:
             search_prompt=search_prompt
         )
         try:
-            from services.llm_provider import extract_json_from_response as _extract_provider_json
-            parsed = _extract_provider_json(content)
+            parsed = extract_json_from_response(content)
         except Exception:
             parsed = await generate_json(
                 f"""Repair this intended JSON object of sourced practice problems grouped by topic.
@@ -3622,14 +4376,21 @@ Return ONLY the JSON object. Keep only complete visible problem records and do n
                 by_topic[name] = problems
 
         # Normalize sources for each topic
-        for name, problems in by_topic.items():
+        for problems in by_topic.values():
             for p in problems:
                 inferred = _source_from_url(p.get("source_url", ""))
                 if inferred:
                     p["source"] = inferred
                 elif _is_generic_source(p.get("source", "")):
                     p["source"] = ""
-            by_topic[name] = _filter_sourced_problems(await _infer_problem_sources_with_llm(problems))
+
+        # Source inference is independent per topic; run the calls together
+        names = list(by_topic)
+        inferred_lists = await asyncio.gather(
+            *(_infer_problem_sources_with_llm(by_topic[name]) for name in names)
+        )
+        for name, problems in zip(names, inferred_lists):
+            by_topic[name] = _filter_sourced_problems(problems)
 
         return by_topic
     except Exception as e:
@@ -3642,7 +4403,6 @@ def _source_from_url(source_url: str) -> Optional[str]:
     if not source_url:
         return None
     try:
-        from urllib.parse import urlparse
         host = urlparse(source_url).netloc.lower()
     except Exception:
         return None
@@ -3683,7 +4443,6 @@ def _is_valid_sourced_problem(problem: dict) -> bool:
         return False
 
     try:
-        from urllib.parse import urlparse
         host = urlparse(source_url).netloc.lower()
     except Exception:
         return False
@@ -3752,7 +4511,7 @@ Rules:
 - If unclear, use "Educational source"
 
 Items:
-{json.dumps(items, indent=2)}
+{orjson.dumps(items, option=orjson.OPT_INDENT_2).decode()}
 """
 
     try:
@@ -3806,9 +4565,9 @@ async def _get_batched_problems(
     # If order_index is missing, derive it from topic ordering
     if order_index_value is None:
         try:
-            topics_result = supabase.table("lesson_topics").select("topic_name, order_index").eq(
+            topics_result = await run_query(supabase.table("lesson_topics").select("topic_name, order_index").eq(
                 "session_id", session_id
-            ).eq("is_confirmed", True).order("order_index").execute()
+            ).eq("is_confirmed", True).order("order_index"))
             ordered = topics_result.data or []
             for t in ordered:
                 if t.get("topic_name") == topic_name:
@@ -3827,9 +4586,9 @@ async def _get_batched_problems(
     # Create a new batch starting at the current topic
     batch_topics = []
     try:
-        topics_result = supabase.table("lesson_topics").select("topic_name, order_index").eq(
+        topics_result = await run_query(supabase.table("lesson_topics").select("topic_name, order_index").eq(
             "session_id", session_id
-        ).eq("is_confirmed", True).order("order_index").execute()
+        ).eq("is_confirmed", True).order("order_index"))
 
         for t in topics_result.data or []:
             try:
@@ -3844,7 +4603,7 @@ async def _get_batched_problems(
     if not batch_topics:
         batch_topics = [topic_name]
 
-    prefetch_limit = max(1, int(os.getenv("PROBLEM_PREFETCH_TOPICS", "3")))
+    prefetch_limit = PROBLEM_PREFETCH_TOPICS
     batch_topics = batch_topics[:prefetch_limit]
     if prefetch_limit <= 1:
         problems = await scrape_math_problems_from_sources(topic_name, num_problems)
@@ -3886,6 +4645,42 @@ async def _get_batched_problems(
     return session_cache[topic_name]
 
 
+async def _prefetch_next_lesson_texts(session_id: str, order_index, user_background: List[str]) -> None:
+    """
+    Warm the LLM response cache with lesson text for the upcoming topic(s).
+
+    The next /api/lesson/content call for that topic builds the identical
+    prompt, so it is served from cache instead of waiting on generation.
+    """
+    try:
+        current_index = int(order_index)
+    except (TypeError, ValueError):
+        return
+
+    try:
+        upcoming = await run_query(supabase.table("lesson_topics").select("topic_name").eq(
+            "session_id", session_id
+        ).eq("is_confirmed", True).is_("completed_at", "null").gt(
+            "order_index", current_index
+        ).order("order_index").limit(LESSON_PREFETCH_TOPICS))
+    except Exception as e:
+        print(f"[LessonContent] Prefetch lookup failed: {e}")
+        return
+
+    for row in upcoming.data or []:
+        key = (session_id, row.get("topic_name"))
+        if not key[1] or key in LESSON_PREFETCHES:
+            continue
+        LESSON_PREFETCHES.add(key)
+        try:
+            await generate_lesson_text(key[1], user_background)
+            print(f"[LessonContent] Prefetched lesson text for '{key[1]}'")
+        except Exception as e:
+            print(f"[LessonContent] Prefetch for '{key[1]}' failed: {e}")
+        finally:
+            LESSON_PREFETCHES.discard(key)
+
+
 async def _find_lesson_video(
     aggregator: ContentAggregator,
     topic_name: str,
@@ -3926,9 +4721,9 @@ async def get_lesson_content(request: LessonContentRequest):
     try:
         # Get current topic if not specified
         if request.topic_id:
-            topic_result = supabase.table("lesson_topics").select("*").eq("id", request.topic_id).single().execute()
+            topic_result = await run_query(supabase.table("lesson_topics").select("*").eq("id", request.topic_id).single())
         else:
-            topic_result = supabase.table("lesson_topics").select("*").eq("session_id", request.session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1).execute()
+            topic_result = await run_query(supabase.table("lesson_topics").select("*").eq("session_id", request.session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1))
             if topic_result.data:
                 topic_result.data = topic_result.data[0] if isinstance(topic_result.data, list) else topic_result.data
 
@@ -3939,31 +4734,31 @@ async def get_lesson_content(request: LessonContentRequest):
         topic_name = topic_data["topic_name"]
 
         # Get user's background knowledge
-        knowledge_result = supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id).execute()
+        knowledge_result = await run_query(supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id))
         user_background = [n["label"] for n in knowledge_result.data if n.get("label")]
 
         # Create content aggregator for video search
-        aggregator = ContentAggregator(OPENROUTER_API_KEY, os.getenv("OPENALEX_API_KEY"))
+        aggregator = ContentAggregator(OPENROUTER_API_KEY, OPENALEX_API_KEY)
 
         # Generate lesson text, fetch video, and scrape problems in parallel
-        import asyncio
         lesson_task = asyncio.create_task(generate_lesson_text(topic_name, user_background))
         order_index = topic_data.get("order_index", 0)
         problems_task = asyncio.create_task(
             _get_batched_problems(request.session_id, topic_name, order_index, 3)
         )
-        video_timeout = float(os.getenv("LESSON_VIDEO_TIMEOUT_SECONDS", "20"))
         video_task = asyncio.create_task(
-            asyncio.wait_for(_find_lesson_video(aggregator, topic_name, user_background), timeout=video_timeout)
+            asyncio.wait_for(_find_lesson_video(aggregator, topic_name, user_background), timeout=LESSON_VIDEO_TIMEOUT_SECONDS)
         ) if aggregator else None
 
+        if LESSON_PREFETCH_TOPICS > 0:
+            _spawn_background(_prefetch_next_lesson_texts(request.session_id, order_index, user_background))
+
         # Wait for all with timeout, but keep whichever pieces finished.
         tasks_by_name = {"lesson": lesson_task, "problems": problems_task}
         if video_task:
             tasks_by_name["video"] = video_task
 
-        timeout_seconds = float(os.getenv("LESSON_CONTENT_TIMEOUT_SECONDS", "120"))
-        done, pending = await asyncio.wait(tasks_by_name.values(), timeout=timeout_seconds)
+        done, pending = await asyncio.wait(tasks_by_name.values(), timeout=LESSON_CONTENT_TIMEOUT_SECONDS)
         for task in pending:
             task.cancel()
 
@@ -3971,7 +4766,7 @@ async def get_lesson_content(request: LessonContentRequest):
             task = tasks_by_name.get(name)
             if not task or task not in done:
                 if task:
-                    print(f"[LessonContent] {name} generation timed out after {timeout_seconds}s")
+                    print(f"[LessonContent] {name} generation timed out after {LESSON_CONTENT_TIMEOUT_SECONDS}s")
                 return default
             try:
                 return task.result()
@@ -4030,11 +4825,31 @@ async def get_lesson_content(request: LessonContentRequest):
         )
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return LessonContentResponse(success=False, error=str(e))
 
 
+async def _load_simplify_context(request: SimplifyContentRequest) -> Optional[tuple]:
+    """Return (topic_name, user_background) for a simplify request, or None."""
+    # Get topic info
+    if request.topic_id:
+        topic_result = await run_query(supabase.table("lesson_topics").select("*").eq("id", request.topic_id).single())
+    else:
+        topic_result = await run_query(supabase.table("lesson_topics").select("*").eq("session_id", request.session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1))
+        if topic_result.data:
+            topic_result.data = topic_result.data[0] if isinstance(topic_result.data, list) else topic_result.data
+
+    if not topic_result.data:
+        return None
+
+    topic_data = topic_result.data if isinstance(topic_result.data, dict) else topic_result.data[0]
+
+    # Get user's background knowledge
+    knowledge_result = await run_query(supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id))
+    user_background = [n["label"] for n in knowledge_result.data if n.get("label")]
+    return topic_data["topic_name"], user_background
+
+
 @app.post("/api/lesson/simplify-content", response_model=SimplifyContentResponse)
 async def simplify_lesson_content(request: SimplifyContentRequest):
     """
@@ -4052,23 +4867,10 @@ async def simplify_lesson_content(request: SimplifyContentRequest):
         # Validate abstraction level
         target_level = max(1, min(5, request.target_abstraction_level))
 
-        # Get topic info
-        if request.topic_id:
-            topic_result = supabase.table("lesson_topics").select("*").eq("id", request.topic_id).single().execute()
-        else:
-            topic_result = supabase.table("lesson_topics").select("*").eq("session_id", request.session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1).execute()
-            if topic_result.data:
-                topic_result.data = topic_result.data[0] if isinstance(topic_result.data, list) else topic_result.data
-
-        if not topic_result.data:
+        context = await _load_simplify_context(request)
+        if not context:
             return SimplifyContentResponse(success=False, error="No active topic found")
-
-        topic_data = topic_result.data if isinstance(topic_result.data, dict) else topic_result.data[0]
-        topic_name = topic_data["topic_name"]
-
-        # Get user's background knowledge
-        knowledge_result = supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id).execute()
-        user_background = [n["label"] for n in knowledge_result.data if n.get("label")]
+        topic_name, user_background = context
 
         # Generate simplified content
         simplified_content = await generate_simplified_lesson(
@@ -4086,20 +4888,60 @@ async def simplify_lesson_content(request: SimplifyContentRequest):
         )
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return SimplifyContentResponse(success=False, error=str(e))
 
 
+@app.post("/api/lesson/simplify-content/stream")
+async def stream_simplified_lesson_content(request: SimplifyContentRequest):
+    """
+    Server-Sent Events variant of /api/lesson/simplify-content.
+
+    Emits a `meta` event with the topic and level, then `data: {"delta": ...}`
+    chunks as the model generates, and finally `data: [DONE]`.
+    """
+    target_level = max(1, min(5, request.target_abstraction_level))
+    context = await _load_simplify_context(request)
+    if not context:
+        raise HTTPException(status_code=404, detail="No active topic found")
+    topic_name, user_background = context
+
+    prompt = await build_simplified_lesson_prompt(
+        topic=topic_name,
+        user_background=user_background,
+        abstraction_level=target_level,
+        current_content=request.current_content
+    )
+
+    async def event_stream():
+        meta = {"topic_name": topic_name, "abstraction_level": target_level}
+        yield b"event: meta\ndata: " + orjson.dumps(meta) + b"\n\n"
+        try:
+            # Same task/max_tokens as call_gemini so both paths share cached lessons
+            async for delta in generate_text_stream(prompt, task="simplified_lesson", max_tokens=8192):
+                yield b"data: " + orjson.dumps({"delta": delta}) + b"\n\n"
+        except Exception as e:
+            print(f"[Simplify] Stream failed: {e}")
+            yield b"event: error\ndata: " + orjson.dumps({"error": str(e)}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # "identity" keeps GZipMiddleware from buffering the event stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Content-Encoding": "identity"},
+    )
+
+
 @app.get("/api/lesson/current-topic/{session_id}")
 async def get_current_topic(session_id: str):
     """Get the current active topic for a session."""
     try:
-        topic_result = supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1).execute()
+        topic_result = await run_query(supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).is_("completed_at", "null").order("order_index").limit(1))
 
         if not topic_result.data:
             # Check if all topics are complete
-            all_topics = supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True).execute()
+            all_topics = await run_query(supabase.table("lesson_topics").select("*").eq("session_id", session_id).eq("is_confirmed", True))
             if all_topics.data and all(t.get("completed_at") for t in all_topics.data):
                 return {"success": True, "course_complete": True, "topic": None}
             return {"success": False, "error": "No active topic"}
@@ -4112,4 +4954,5 @@ async def get_current_topic(session_id: str):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # "auto" picks uvloop/httptools when installed via uvicorn[standard]
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="auto")
@@ -6,21 +6,23 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime, timezone
-import os
-
-from supabase import create_client, Client
+import traceback
 
+from services.db import create_supabase_client, run_query
 from services.google_drive_service import (
+    call_claude,
     comprehensive_document_search,
+    download_to_tempfile,
+    extract_json_from_response,
     list_google_drive_docs,
     use_claude_to_select_relevant_docs,
 )
+from services.llm_provider import get_http_client
+from services.pdf_processor import PDFProcessor
 
 # Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv("NEXT_PUBLIC_SUPABASE_URL") or os.getenv("VITE_SUPABASE_URL", ""),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
-)
+supabase = create_supabase_client()
+PDF_PROCESSOR = PDFProcessor(extract_images=False)
 
 router = APIRouter(prefix="/api/google-drive", tags=["Google Drive"])
 
@@ -75,7 +77,7 @@ async def connect_google_drive(request: GoogleDriveConnectRequest):
     """Store Google Drive OAuth tokens for a user."""
     try:
         # Check if user already has a connection
-        existing = supabase.table("google_drive_connections").select("id").eq("user_id", request.user_id).execute()
+        existing = await run_query(supabase.table("google_drive_connections").select("id").eq("user_id", request.user_id))
 
         expires_at = None
         if request.expires_at:
@@ -93,11 +95,11 @@ async def connect_google_drive(request: GoogleDriveConnectRequest):
 
         if existing.data:
             # Update existing connection
-            supabase.table("google_drive_connections").update(data).eq("user_id", request.user_id).execute()
+            await run_query(supabase.table("google_drive_connections").update(data).eq("user_id", request.user_id))
         else:
             # Create new connection
             data["created_at"] = datetime.now(timezone.utc).isoformat()
-            supabase.table("google_drive_connections").insert(data).execute()
+            await run_query(supabase.table("google_drive_connections").insert(data))
 
         return {"success": True, "message": "Google Drive connected successfully"}
 
@@ -109,10 +111,10 @@ async def connect_google_drive(request: GoogleDriveConnectRequest):
 async def disconnect_google_drive(request: GoogleDriveDisconnectRequest):
     """Disconnect Google Drive for a user."""
     try:
-        supabase.table("google_drive_connections").update({
+        await run_query(supabase.table("google_drive_connections").update({
             "is_active": False,
             "updated_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("user_id", request.user_id).execute()
+        }).eq("user_id", request.user_id))
 
         return {"success": True, "message": "Google Drive disconnected"}
 
@@ -124,7 +126,7 @@ async def disconnect_google_drive(request: GoogleDriveDisconnectRequest):
 async def get_connection_status(user_id: int):
     """Check if user has Google Drive connected."""
     try:
-        result = supabase.table("google_drive_connections").select("google_email, is_active, created_at").eq("user_id", user_id).eq("is_active", True).execute()
+        result = await run_query(supabase.table("google_drive_connections").select("google_email, is_active, created_at").eq("user_id", user_id).eq("is_active", True))
 
         if result.data:
             return {
@@ -146,7 +148,7 @@ async def search_relevant_documents(request: GoogleDriveSearchRequest):
     """
     try:
         # Get user's Google Drive connection
-        connection = supabase.table("google_drive_connections").select("access_token").eq("user_id", request.user_id).eq("is_active", True).single().execute()
+        connection = await run_query(supabase.table("google_drive_connections").select("access_token").eq("user_id", request.user_id).eq("is_active", True).single())
 
         if not connection.data:
             raise HTTPException(status_code=400, detail="Google Drive not connected")
@@ -154,7 +156,7 @@ async def search_relevant_documents(request: GoogleDriveSearchRequest):
         access_token = connection.data["access_token"]
 
         # Get session details
-        session = supabase.table("learning_sessions").select("central_topic").eq("id", request.session_id).single().execute()
+        session = await run_query(supabase.table("learning_sessions").select("central_topic").eq("id", request.session_id).single())
 
         if not session.data:
             raise HTTPException(status_code=404, detail="Session not found")
@@ -162,7 +164,7 @@ async def search_relevant_documents(request: GoogleDriveSearchRequest):
         central_topic = session.data["central_topic"]
 
         # Get existing knowledge nodes
-        nodes_result = supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id).execute()
+        nodes_result = await run_query(supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id))
         existing_nodes = [n["label"] for n in nodes_result.data] if nodes_result.data else []
 
         # Perform comprehensive search using Claude
@@ -175,7 +177,7 @@ async def search_relevant_documents(request: GoogleDriveSearchRequest):
         # Store selected documents in database
         for doc in selected_docs:
             try:
-                supabase.table("google_docs_materials").upsert({
+                await run_query(supabase.table("google_docs_materials").upsert({
                     "session_id": request.session_id,
                     "user_id": request.user_id,
                     "google_doc_id": doc["id"],
@@ -185,7 +187,7 @@ async def search_relevant_documents(request: GoogleDriveSearchRequest):
                     "relevance_score": doc.get("relevanceScore"),
                     "search_query": central_topic,
                     "is_selected": True,
-                }, on_conflict="session_id,google_doc_id").execute()
+                }, on_conflict="session_id,google_doc_id"))
             except Exception as e:
                 print(f"[GoogleDrive] Failed to store doc {doc['id']}: {e}")
 
@@ -199,7 +201,6 @@ async def search_relevant_documents(request: GoogleDriveSearchRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -212,20 +213,21 @@ async def process_google_docs(request: GoogleDocsProcessRequest):
     """
     try:
         # Get session details
-        session = supabase.table("learning_sessions").select("central_topic").eq("id", request.session_id).single().execute()
+        session = await run_query(supabase.table("learning_sessions").select("central_topic").eq("id", request.session_id).single())
 
         if not session.data:
             raise HTTPException(status_code=404, detail="Session not found")
 
         central_topic = session.data["central_topic"]
 
-        # Get existing nodes
-        nodes_result = supabase.table("knowledge_nodes").select("label").eq("session_id", request.session_id).execute()
-        existing_nodes = [n["label"] for n in nodes_result.data] if nodes_result.data else []
+        # Get existing nodes; their ids double as the parent lookup table
+        nodes_result = await run_query(supabase.table("knowledge_nodes").select("id,label").eq("session_id", request.session_id))
+        label_to_id = {}
+        for row in nodes_result.data or []:
+            label_to_id.setdefault(row["label"], row["id"])
+        existing_nodes = list(label_to_id)
 
         # Generate nodes from document titles using Gemini (similar to papers)
-        from services.google_drive_service import call_claude
-
         doc_titles = [doc.title for doc in request.documents]
         titles_formatted = "\n".join([f"{i+1}. {t}" for i, t in enumerate(doc_titles)])
 
@@ -253,28 +255,20 @@ OUTPUT FORMAT (strict JSON, no markdown):
 }}"""
 
         response_text = await call_claude(prompt)
-        from services.google_drive_service import extract_json_from_response
         result = extract_json_from_response(response_text)
         nodes = result.get("nodes", [])
 
-        # Store nodes in database
-        for node in nodes:
-            # Find parent node ID if specified
-            parent_id = None
-            if node.get("parent_node"):
-                parent_result = supabase.table("knowledge_nodes").select("id").eq("session_id", request.session_id).eq("label", node["parent_node"]).execute()
-                if parent_result.data:
-                    parent_id = parent_result.data[0]["id"]
-
-            supabase.table("knowledge_nodes").insert({
+        # Store nodes in database (one bulk insert)
+        if nodes:
+            await run_query(supabase.table("knowledge_nodes").insert([{
                 "session_id": request.session_id,
                 "label": node.get("label"),
                 "type": node.get("type"),
-                "parent_node_id": parent_id,
+                "parent_node_id": label_to_id.get(node.get("parent_node")),
                 "mastery_estimate": node.get("mastery_estimate"),
                 "source": "google_drive",
                 "is_llm_generated": True
-            }).execute()
+            } for node in nodes]))
 
         return {
             "success": True,
@@ -284,7 +278,6 @@ OUTPUT FORMAT (strict JSON, no markdown):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -302,59 +295,50 @@ async def fetch_doc_content(request: FetchDocContentRequest):
     Fetch the content of a single Google Drive document.
     Uses the provided access token or fetches from stored connection.
     """
-    import httpx
-
     try:
         # Get access token - either from request or from stored connection
         access_token = request.access_token
         if not access_token:
             # Fetch from database
-            connection = supabase.table("google_drive_connections").select("access_token").eq("user_id", request.user_id).eq("is_active", True).single().execute()
+            connection = await run_query(supabase.table("google_drive_connections").select("access_token").eq("user_id", request.user_id).eq("is_active", True).single())
             if not connection.data:
                 raise HTTPException(status_code=400, detail="Google Drive not connected")
             access_token = connection.data["access_token"]
 
         content = ""
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer {access_token}"}
-
-            if request.mime_type == "application/vnd.google-apps.document":
-                # Export Google Doc as plain text
-                export_url = f"https://www.googleapis.com/drive/v3/files/{request.doc_id}/export?mimeType=text/plain"
-                response = await client.get(export_url, headers=headers, timeout=30.0)
-                if response.status_code == 200:
-                    content = response.text
-                else:
-                    print(f"[GoogleDrive] Export failed for doc {request.doc_id}: {response.status_code} - {response.text}")
-
-            elif request.mime_type == "application/vnd.google-apps.spreadsheet":
-                # Export Google Sheet as CSV
-                export_url = f"https://www.googleapis.com/drive/v3/files/{request.doc_id}/export?mimeType=text/csv"
-                response = await client.get(export_url, headers=headers, timeout=30.0)
-                if response.status_code == 200:
-                    content = response.text
-
-            elif request.mime_type in ["text/plain", "text/markdown", "text/csv"]:
-                # Download text files directly
-                download_url = f"https://www.googleapis.com/drive/v3/files/{request.doc_id}?alt=media"
-                response = await client.get(download_url, headers=headers, timeout=30.0)
-                if response.status_code == 200:
-                    content = response.text
-
-            elif request.mime_type == "application/pdf":
-                # Download PDF - return a note that PDF content needs special processing
-                download_url = f"https://www.googleapis.com/drive/v3/files/{request.doc_id}?alt=media"
-                response = await client.get(download_url, headers=headers, timeout=60.0)
-                if response.status_code == 200:
-                    # Try to extract text from PDF
+        client = get_http_client()
+        headers = {"Authorization": f"Bearer {access_token}"}
+
+        if request.mime_type == "application/vnd.google-apps.document":
+            # Export Google Doc as plain text
+            export_url = f"https://www.googleapis.com/drive/v3/files/{request.doc_id}/export?mimeType=text/plain"
+            response = await client.get(export_url, headers=headers, timeout=30.0)
+            if response.status_code == 200:
+                content = response.text
+            else:
+                print(f"[GoogleDrive] Export failed for doc {request.doc_id}: {response.status_code} - {response.text}")
+
+        elif request.mime_type == "application/vnd.google-apps.spreadsheet":
+            # Export Google Sheet as CSV
+            export_url = f"https://www.googleapis.com/drive/v3/files/{request.doc_id}/export?mimeType=text/csv"
+            response = await client.get(export_url, headers=headers, timeout=30.0)
+            if response.status_code == 200:
+                content = response.text
+
+        elif request.mime_type in ["text/plain", "text/markdown", "text/csv"]:
+            # Download text files directly
+            download_url = f"https://www.googleapis.com/drive/v3/files/{request.doc_id}?alt=media"
+            response = await client.get(download_url, headers=headers, timeout=30.0)
+            if response.status_code == 200:
+                content = response.text
+
+        elif request.mime_type == "application/pdf":
+            # Stream the PDF to disk and extract text off the event loop
+            download_url = f"https://www.googleapis.com/drive/v3/files/{request.doc_id}?alt=media"
+            async with download_to_tempfile(download_url, access_token) as pdf_path:
+                if pdf_path:
                     try:
-                        import fitz  # PyMuPDF
-                        pdf_doc = fitz.open(stream=response.content, filetype="pdf")
-                        text_parts = []
-                        for page in pdf_doc:
-                            text_parts.append(page.get_text())
-                        content = "\n".join(text_parts)
-                        pdf_doc.close()
+                        content = await PDF_PROCESSOR.extract_text_from_file(pdf_path)
                     except Exception as pdf_err:
                         print(f"[GoogleDrive] PDF extraction failed: {pdf_err}")
                         content = "[PDF content - extraction failed]"
@@ -367,6 +351,5 @@ async def fetch_doc_content(request: FetchDocContentRequest):
         }
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
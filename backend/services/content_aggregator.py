@@ -5,15 +5,15 @@ Uses local educational APIs first, then the configured LLM provider to search
 and aggregate content from YouTube, OpenAlex, Khan Academy, MIT OCW, and web.
 """
 import os
-import httpx
 import json
+import orjson
 import re
 from urllib.parse import parse_qs, urlparse
 from typing import Optional, List, Dict, Any
 from dataclasses import dataclass
 from enum import Enum
 from .token_compression import TokenCompressionService
-from .llm_provider import extract_json_from_response, generate_json, generate_text
+from .llm_provider import extract_json_from_response, generate_json, generate_text, get_http_client
 
 
 class ContentType(str, Enum):
@@ -368,10 +368,10 @@ Return ONLY the JSON array, no other text."""
                 "key": self.youtube_api_key,
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(search_url, params=params, timeout=15.0)
-                response.raise_for_status()
-                data = response.json()
+            client = get_http_client()
+            response = await client.get(search_url, params=params, timeout=15.0)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
 
             items = data.get("items", [])
             video_ids = [item.get("id", {}).get("videoId") for item in items]
@@ -386,10 +386,10 @@ Return ONLY the JSON array, no other text."""
                     "id": ",".join(video_ids[:50]),
                     "key": self.youtube_api_key,
                 }
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(videos_url, params=params, timeout=15.0)
-                    response.raise_for_status()
-                    data = response.json()
+                client = get_http_client()
+                response = await client.get(videos_url, params=params, timeout=15.0)
+                response.raise_for_status()
+                data = orjson.loads(response.content)
 
                 for item in data.get("items", []):
                     details_by_id[item.get("id")] = {
@@ -516,23 +516,23 @@ Return ONLY the JSON array, no other text."""
         items = []
         
         try:
-            async with httpx.AsyncClient() as client:
-                params = {
-                    "search": topic,
-                    "per_page": max_results,
-                    "filter": "is_oa:true",  # Open access only
-                    "sort": "cited_by_count:desc"
-                }
-                if self.openalex_api_key:
-                    params["api_key"] = self.openalex_api_key
-                
-                response = await client.get(
-                    "https://api.openalex.org/works",
-                    params=params,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                data = response.json()
+            client = get_http_client()
+            params = {
+                "search": topic,
+                "per_page": max_results,
+                "filter": "is_oa:true",  # Open access only
+                "sort": "cited_by_count:desc"
+            }
+            if self.openalex_api_key:
+                params["api_key"] = self.openalex_api_key
+            
+            response = await client.get(
+                "https://api.openalex.org/works",
+                params=params,
+                timeout=30.0
+            )
+            response.raise_for_status()
+            data = orjson.loads(response.content)
             
             for work in data.get("results", []):
                 # Get best available URL (prefer PDF)
@@ -0,0 +1,251 @@
+"""
+Async helpers for the Supabase client.
+
+The app uses supabase-py's AsyncClient, so PostgREST queries and Storage
+calls are awaited on the event loop instead of blocking a worker thread per
+call. Every client from create_supabase_client shares one pooled HTTP/2
+session, so concurrent queries and uploads multiplex over warm connections.
+
+When SUPABASE_DB_URL is set and asyncpg is installed, insert_rows writes
+bulk rows with COPY over a direct Postgres connection instead of PostgREST.
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Union
+
+import httpx
+import orjson
+from supabase import AsyncClient, AsyncClientOptions
+
+
+SUPABASE_URL = os.getenv("NEXT_PUBLIC_SUPABASE_URL") or os.getenv("VITE_SUPABASE_URL", "")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+# Connections per worker for PostgREST and Storage, shared by every client
+SUPABASE_HTTP_MAX_CONNECTIONS = int(os.getenv("SUPABASE_HTTP_MAX_CONNECTIONS", "128"))
+# Large enough for uploads of big PDFs
+SUPABASE_HTTP_TIMEOUT = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "120"))
+_SUPABASE_HTTP: httpx.AsyncClient | None = None
+
+SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL", "")
+SUPABASE_DB_POOL_SIZE = int(os.getenv("SUPABASE_DB_POOL_SIZE", "8"))
+_PG_POOL = None
+_PG_POOL_LOCK = asyncio.Lock()
+# Set when SUPABASE_DB_URL can't be used (asyncpg missing), so bulk inserts stay on PostgREST
+_PG_DISABLED = False
+# Connect timeout for the direct pool; after a failed connect, bulk inserts
+# use PostgREST for SUPABASE_DB_RETRY_SECONDS before connecting again
+SUPABASE_DB_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_DB_CONNECT_TIMEOUT", "5"))
+SUPABASE_DB_RETRY_SECONDS = float(os.getenv("SUPABASE_DB_RETRY_SECONDS", "60"))
+_PG_RETRY_AT = 0.0
+# Column name -> Postgres type name per table, for coercing COPY values
+_COLUMN_TYPES: dict[str, dict[str, str]] = {}
+
+logger = logging.getLogger("arxlearn.db")
+
+
+def _supabase_http() -> httpx.AsyncClient:
+    # Opens no connections until the first request, so a client created at
+    # import (before Gunicorn forks) still gets a pool per worker
+    global _SUPABASE_HTTP
+    if _SUPABASE_HTTP is None:
+        _SUPABASE_HTTP = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=max(1, SUPABASE_HTTP_MAX_CONNECTIONS // 2),
+            ),
+            timeout=SUPABASE_HTTP_TIMEOUT,
+            follow_redirects=True,
+        )
+    return _SUPABASE_HTTP
+
+
+def create_supabase_client() -> AsyncClient:
+    """Create a service-role Supabase client on the shared HTTP session."""
+    return AsyncClient(
+        SUPABASE_URL,
+        SUPABASE_SERVICE_ROLE_KEY,
+        AsyncClientOptions(httpx_client=_supabase_http()),
+    )
+
+
+async def aclose_supabase_http() -> None:
+    """Close the shared Supabase HTTP session (call on app shutdown)."""
+    global _SUPABASE_HTTP
+    if _SUPABASE_HTTP is not None:
+        await _SUPABASE_HTTP.aclose()
+        _SUPABASE_HTTP = None
+
+
+async def run_query(query: Any) -> Any:
+    """
+    Execute a supabase-py query builder.
+
+    Args:
+        query: A builder such as supabase.table("x").select("*").eq("id", 1)
+
+    Returns:
+        The builder's APIResponse
+    """
+    return await query.execute()
+
+
+async def upload_object(bucket: Any, path: str, data: Union[bytes, str], content_type: str) -> Any:
+    """
+    Create or overwrite a Storage object in one request.
+
+    Args:
+        bucket: A storage bucket client such as supabase.storage.from_("papers")
+        path: Object path inside the bucket
+        data: Object body, or a local file path to stream it from
+        content_type: MIME type stored with the object
+
+    Returns:
+        The storage client's upload response
+    """
+    options = {"content-type": content_type, "x-upsert": "true"}
+    if isinstance(data, str):
+        # Opened here so the handle is closed once the upload is sent
+        with open(data, "rb") as body:
+            return await bucket.upload(path, body, options)
+    return await bucket.upload(path, data, options)
+
+
+async def _pg_pool():
+    # Created on first use so each (forked) app worker owns its connections
+    global _PG_POOL, _PG_DISABLED, _PG_RETRY_AT
+    if _PG_POOL is not None or _PG_DISABLED or not SUPABASE_DB_URL or time.monotonic() < _PG_RETRY_AT:
+        return _PG_POOL
+    async with _PG_POOL_LOCK:
+        if _PG_POOL is None and not _PG_DISABLED and time.monotonic() >= _PG_RETRY_AT:
+            try:
+                import asyncpg
+            except ImportError:
+                logger.warning("SUPABASE_DB_URL is set but the asyncpg package is not installed; using PostgREST for bulk inserts")
+                _PG_DISABLED = True
+                return None
+            # statement_cache_size=0 keeps this usable behind Supabase's
+            # transaction-mode pooler, which doesn't support prepared statements
+            try:
+                _PG_POOL = await asyncpg.create_pool(
+                    dsn=SUPABASE_DB_URL,
+                    min_size=min(2, SUPABASE_DB_POOL_SIZE),
+                    max_size=SUPABASE_DB_POOL_SIZE,
+                    statement_cache_size=0,
+                    timeout=SUPABASE_DB_CONNECT_TIMEOUT,
+                )
+            except Exception:
+                _PG_RETRY_AT = time.monotonic() + SUPABASE_DB_RETRY_SECONDS
+                logger.warning(
+                    "Could not connect to SUPABASE_DB_URL, using PostgREST for %.0fs",
+                    SUPABASE_DB_RETRY_SECONDS, exc_info=True,
+                )
+                return None
+    return _PG_POOL
+
+
+async def close_pg_pool() -> None:
+    """Close the direct Postgres pool (call on app shutdown)."""
+    global _PG_POOL
+    if _PG_POOL is not None:
+        await _PG_POOL.close()
+        _PG_POOL = None
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "t", "1", "yes", "y")
+    return bool(value)
+
+
+def _to_json(value: Any) -> str:
+    return value if isinstance(value, str) else orjson.dumps(value).decode()
+
+
+def _to_timestamp(value: Any) -> Any:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if isinstance(value, str) else value
+
+
+# PostgREST casts JSON values to the column type server-side; COPY sends
+# binary values, so asyncpg needs Python objects of the matching type
+_COERCERS = {
+    "int2": int,
+    "int4": int,
+    "int8": int,
+    "float4": float,
+    "float8": float,
+    "numeric": lambda value: Decimal(str(value)),
+    "bool": _to_bool,
+    "text": str,
+    "varchar": str,
+    "bpchar": str,
+    "json": _to_json,
+    "jsonb": _to_json,
+    "timestamp": _to_timestamp,
+    "timestamptz": _to_timestamp,
+}
+
+
+async def _column_types(conn: Any, table: str) -> dict[str, str]:
+    types = _COLUMN_TYPES.get(table)
+    if types is None:
+        rows = await conn.fetch(
+            "SELECT a.attname, t.typname FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid"
+            " WHERE a.attrelid = $1::regclass AND a.attnum > 0 AND NOT a.attisdropped",
+            table,
+        )
+        types = _COLUMN_TYPES[table] = {row["attname"]: row["typname"] for row in rows}
+    return types
+
+
+def _copy_records(rows: list[dict], columns: list[str], types: dict[str, str]) -> list[tuple]:
+    coercers = [_COERCERS.get(types.get(column, "")) for column in columns]
+    return [
+        tuple(
+            value if value is None or coerce is None else coerce(value)
+            for value, coerce in zip((row.get(column) for column in columns), coercers)
+        )
+        for row in rows
+    ]
+
+
+async def insert_rows(client: Any, table: str, rows: list[dict]) -> None:
+    """
+    Bulk-insert rows, using COPY over a direct connection when one is configured.
+
+    Values are coerced to the target columns' types first, as PostgREST would.
+    COPY runs as one statement, so a failure writes nothing. Errors raised by
+    Postgres itself (constraint or type violations) propagate; connection and
+    client-side encoding failures fall back to a single PostgREST insert, as
+    do an unset SUPABASE_DB_URL and a missing asyncpg.
+
+    Args:
+        client: The supabase client used for the PostgREST fallback
+        table: Target table name
+        rows: Row dicts; missing keys are written as NULL, as in a PostgREST bulk insert
+    """
+    if not rows:
+        return
+
+    pool = await _pg_pool()
+    if pool is not None:
+        import asyncpg
+
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        try:
+            async with pool.acquire() as conn:
+                records = _copy_records(rows, columns, await _column_types(conn, table))
+                await conn.copy_records_to_table(table, records=records, columns=columns)
+            return
+        except asyncpg.PostgresError:
+            logger.exception("COPY of %d rows into %s was rejected", len(rows), table)
+            raise
+        except Exception:
+            logger.warning("COPY into %s failed, using PostgREST", table, exc_info=True)
+
+    await run_query(client.table(table).insert(rows))
@@ -2,13 +2,15 @@
 Complete Document Processing Pipeline
 Orchestrates PDF extraction, compression, and storage.
 """
-import base64
 import json
 import logging
 from typing import Optional, Any
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
 
+import orjson
+
+from .db import run_query, upload_object
 from .pdf_processor import PDFProcessor, PDFExtraction
 from .token_compression import TokenCompressionService, CompressionResult
 
@@ -80,7 +82,7 @@ class DocumentPipeline:
         """
         try:
             # 1. Download PDF from Supabase
-            response = self.supabase.storage.from_(bucket).download(storage_path)
+            response = await self.supabase.storage.from_(bucket).download(storage_path)
             pdf_bytes = response
 
             # 2. Extract text and images
@@ -126,7 +128,7 @@ class DocumentPipeline:
                 material_id=material_id,
                 original_text=extraction.text,
                 compressed_text=compressed_text,
-                images=images_data,
+                images=extraction.images,
                 original_tokens=original_tokens,
                 compressed_tokens=compressed_tokens,
                 compression_ratio=compression_ratio
@@ -177,7 +179,7 @@ class DocumentPipeline:
         """
         try:
             # Download PDF
-            response = self.supabase.storage.from_(bucket).download(storage_path)
+            response = await self.supabase.storage.from_(bucket).download(storage_path)
             pdf_bytes = response
 
             # Extract text only
@@ -293,7 +295,7 @@ class DocumentPipeline:
             material_id: ID of the record to update
             original_text: Full extracted text
             compressed_text: Compressed text
-            images: List of extracted image dicts with base64 data
+            images: ExtractedImage list; PNG bytes are uploaded as-is
             original_tokens: Token count before compression
             compressed_tokens: Token count after compression
             compression_ratio: Compression ratio achieved
@@ -301,49 +303,37 @@ class DocumentPipeline:
         bucket_name = "compressed_documents"
 
         # Get user_id for storage path
-        material = self.supabase.table("academia_materials").select(
+        material = await run_query(self.supabase.table("academia_materials").select(
             "user_id"
-        ).eq("id", material_id).single().execute()
+        ).eq("id", material_id).single())
         user_id = material.data.get("user_id", "unknown")
 
         # 1. Upload images as individual files to storage
         image_refs = []
         for img in images:
-            img_path = f"{user_id}/{material_id}/img_{img['index']}.png"
+            img_path = f"{user_id}/{material_id}/img_{img.index}.png"
 
             try:
-                # Decode base64 to bytes
-                img_bytes = base64.b64decode(img["base64"])
-
-                # Delete old image if exists
-                try:
-                    self.supabase.storage.from_(bucket_name).remove([img_path])
-                except Exception:
-                    pass  # File might not exist
-
-                # Upload image
-                self.supabase.storage.from_(bucket_name).upload(
-                    img_path,
-                    img_bytes,
-                    {"content-type": "image/png"}
-                )
+                # Upload image, replacing any previous version
+                await upload_object(self.supabase.storage.from_(bucket_name), img_path, img.png_bytes, "image/png")
 
                 # Store reference (not base64 data)
                 image_refs.append({
-                    "index": img["index"],
+                    "index": img.index,
                     "path": img_path,
-                    "page": img.get("page"),
-                    "width": img.get("width"),
-                    "height": img.get("height"),
-                    "alt": img.get("alt", "")
+                    "page": img.page_number,
+                    "width": img.width,
+                    "height": img.height,
+                    "alt": img.alt_text
                 })
-                logger.info(f"Uploaded image {img['index']} to {img_path}")
+                logger.info(f"Uploaded image {img.index} to {img_path}")
 
             except Exception as e:
-                logger.error(f"Failed to upload image {img['index']} for material {material_id}: {e}")
-                raise RuntimeError(f"Image upload failed for index {img['index']}: {e}")
+                logger.error(f"Failed to upload image {img.index} for material {material_id}: {e}")
+                raise RuntimeError(f"Image upload failed for index {img.index}: {e}")
 
         # 2. Create JSON content with image references (not base64 data)
+        processed_at = datetime.now(timezone.utc).isoformat()
         json_content = {
             "text": compressed_text,
             "image_refs": image_refs,
@@ -354,7 +344,7 @@ class DocumentPipeline:
                 "compression_ratio": compression_ratio,
                 "has_figures": len(image_refs) > 0,
                 "figure_count": len(image_refs),
-                "processed_at": datetime.utcnow().isoformat(),
+                "processed_at": processed_at,
                 "format_version": "2.0"  # New format with image_refs
             }
         }
@@ -363,18 +353,8 @@ class DocumentPipeline:
         json_path = f"{user_id}/{material_id}.json"
 
         try:
-            # Delete old JSON if exists
-            try:
-                self.supabase.storage.from_(bucket_name).remove([json_path])
-            except Exception:
-                pass  # File might not exist
-
-            json_bytes = json.dumps(json_content).encode('utf-8')
-            self.supabase.storage.from_(bucket_name).upload(
-                json_path,
-                json_bytes,
-                {"content-type": "application/json"}
-            )
+            json_bytes = orjson.dumps(json_content)
+            await upload_object(self.supabase.storage.from_(bucket_name), json_path, json_bytes, "application/json; charset=utf-8")
             logger.info(f"Uploaded compressed JSON to {json_path}")
 
         except Exception as e:
@@ -383,7 +363,7 @@ class DocumentPipeline:
 
         # 4. Update database with storage paths only (NO inline data)
         try:
-            self.supabase.table("academia_materials").update({
+            await run_query(self.supabase.table("academia_materials").update({
                 "original_text": None,
                 "compressed_text": None,
                 "extracted_images": None,  # Clear inline images
@@ -394,9 +374,9 @@ class DocumentPipeline:
                 "compression_ratio": compression_ratio,
                 "compression_aggressiveness": self.aggressiveness,
                 "ttc_processed": True,
-                "ttc_processed_at": datetime.utcnow().isoformat(),
+                "ttc_processed_at": processed_at,
                 "pdf_extraction_method": "pymupdf"
-            }).eq("id", material_id).execute()
+            }).eq("id", material_id))
             logger.info(f"Updated material {material_id} with storage path {json_path}")
 
         except Exception as e:
@@ -419,10 +399,10 @@ class DocumentPipeline:
         Returns:
             Combined content dict for Claude with signed image URLs
         """
-        materials = self.supabase.table("academia_materials").select(
+        materials = await run_query(self.supabase.table("academia_materials").select(
             "id, title, compressed_text, extracted_images, compressed_token_count, "
             "compressed_storage_bucket, compressed_storage_path"
-        ).in_("id", material_ids).eq("ttc_processed", True).execute()
+        ).in_("id", material_ids).eq("ttc_processed", True))
 
         combined_content = {
             "documents": [],
@@ -438,7 +418,7 @@ class DocumentPipeline:
 
             if storage_bucket and storage_path:
                 try:
-                    response = self.supabase.storage.from_(storage_bucket).download(storage_path)
+                    response = await self.supabase.storage.from_(storage_bucket).download(storage_path)
                     content = json.loads(response.decode('utf-8'))
                     text = content.get("text", "")
 
@@ -448,9 +428,10 @@ class DocumentPipeline:
                         for img_ref in image_refs:
                             # Generate signed URL for each image
                             try:
-                                signed_url_response = self.supabase.storage.from_(
-                                    storage_bucket
-                                ).create_signed_url(img_ref["path"], signed_url_expiry)
+                                signed_url_response = await self.supabase.storage.from_(storage_bucket).create_signed_url(
+                                    img_ref["path"],
+                                    signed_url_expiry
+                                )
 
                                 images.append({
                                     "index": img_ref["index"],
@@ -9,12 +9,14 @@ Now includes token compression via The Token Company API.
 """
 
 import httpx
+import orjson
 import os
+import re
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
 
 from .token_compression import TokenCompressionService, CompressionResult
-from .llm_provider import generate_json
+from .llm_provider import generate_json, get_http_client
 
 
 class ChapterOutline(BaseModel):
@@ -89,15 +91,15 @@ class FirecrawlService:
             "removeBase64Images": True,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                api_url,
-                headers=self._get_headers(),
-                json=payload,
-                timeout=timeout
-            )
-            response.raise_for_status()
-            result = response.json()
+        client = get_http_client()
+        response = await client.post(
+            api_url,
+            headers=self._get_headers(),
+            json=payload,
+            timeout=timeout
+        )
+        response.raise_for_status()
+        result = orjson.loads(response.content)
 
         # Apply token compression if enabled and service is available
         if compress and self.compression_service and result.get("success"):
@@ -151,15 +153,15 @@ class FirecrawlService:
         if prompt:
             payload["prompt"] = prompt
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                api_url,
-                headers=self._get_headers(),
-                json=payload,
-                timeout=timeout
-            )
-            response.raise_for_status()
-            return response.json()
+        client = get_http_client()
+        response = await client.post(
+            api_url,
+            headers=self._get_headers(),
+            json=payload,
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
 
     async def extract_chapters(
         self,
@@ -315,8 +317,6 @@ Rules:
 
     def _parse_chapters_basic(self, markdown: str) -> List[ChapterOutline]:
         """Basic chapter extraction from markdown headers."""
-        import re
-
         chapters = []
         lines = markdown.split('\n')
 
@@ -2,33 +2,33 @@
 Google Drive integration service with Claude-powered document selection.
 """
 
-import httpx
-import json
+import os
 import re
-from typing import List, Optional
+import secrets
+import tempfile
+import orjson
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
 from datetime import datetime
-
-from services.llm_provider import generate_text, has_provider
-
-
-def extract_json_from_response(text: str) -> dict:
-    """Extract JSON from Claude response, handling markdown code blocks."""
-    # Try to find JSON in code blocks first
-    json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
-    if json_match:
-        text = json_match.group(1)
-
-    # Clean up and parse
-    text = text.strip()
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        # Try to find JSON object in the text
-        start = text.find('{')
-        end = text.rfind('}') + 1
-        if start != -1 and end > start:
-            return json.loads(text[start:end])
-        raise
+from urllib.parse import urlencode
+
+from services.llm_provider import extract_json_from_response, generate_text, get_http_client, has_provider
+
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+DRIVE_BATCH_URL = "https://www.googleapis.com/batch/drive/v3"
+# Drive accepts at most 100 calls per batch request. Only metadata calls can
+# be batched; file exports and alt=media downloads must be fetched one by one.
+DRIVE_BATCH_MAX_REQUESTS = 100
+_DRIVE_FILE_FIELDS = "files(id,name,mimeType,webViewLink,modifiedTime)"
+_RECENT_DOCS_PARAMS = {
+    "q": "mimeType='application/vnd.google-apps.document' or mimeType='application/pdf'",
+    "fields": _DRIVE_FILE_FIELDS,
+    "pageSize": 100,
+    "orderBy": "modifiedTime desc"
+}
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?')
+_CONTENT_ID_RE = re.compile(r"Content-ID:\s*<response-item(\d+)>", re.IGNORECASE)
+_HTTP_STATUS_RE = re.compile(r"^HTTP/[\d.]+ (\d{3})", re.MULTILINE)
 
 
 async def call_claude(prompt: str, system: str = "") -> str:
@@ -46,46 +46,122 @@ async def call_claude(prompt: str, system: str = "") -> str:
         raise
 
 
-async def search_google_drive(access_token: str, query: str) -> List[dict]:
-    """Search Google Drive for documents matching the query."""
-    url = "https://www.googleapis.com/drive/v3/files"
-    headers = {"Authorization": f"Bearer {access_token}"}
-
+def _search_params(query: str) -> dict:
     # Escape single quotes in the query
     safe_query = query.replace("'", "\\'")
 
     # Search for documents (Google Docs, PDFs, text files)
-    params = {
+    return {
         "q": f"fullText contains '{safe_query}' and (mimeType='application/vnd.google-apps.document' or mimeType='application/pdf' or mimeType='text/plain')",
-        "fields": "files(id,name,mimeType,webViewLink,modifiedTime)",
+        "fields": _DRIVE_FILE_FIELDS,
         "pageSize": 50,
         "orderBy": "modifiedTime desc"
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers, params=params, timeout=30.0)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("files", [])
+
+async def search_google_drive(access_token: str, query: str) -> List[dict]:
+    """Search Google Drive for documents matching the query."""
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    client = get_http_client()
+    response = await client.get(DRIVE_FILES_URL, headers=headers, params=_search_params(query), timeout=30.0)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    return data.get("files", [])
 
 
 async def list_google_drive_docs(access_token: str) -> List[dict]:
     """List recent documents from Google Drive."""
-    url = "https://www.googleapis.com/drive/v3/files"
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    params = {
-        "q": "mimeType='application/vnd.google-apps.document' or mimeType='application/pdf'",
-        "fields": "files(id,name,mimeType,webViewLink,modifiedTime)",
-        "pageSize": 100,
-        "orderBy": "modifiedTime desc"
-    }
+    client = get_http_client()
+    response = await client.get(DRIVE_FILES_URL, headers=headers, params=_RECENT_DOCS_PARAMS, timeout=30.0)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    return data.get("files", [])
+
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers, params=params, timeout=30.0)
+@asynccontextmanager
+async def download_to_tempfile(url: str, access_token: str, timeout: float = 60.0) -> AsyncIterator[Optional[str]]:
+    """
+    Stream a Drive download to a temporary file without buffering it in memory.
+
+    Yields the file's path, or None if Drive didn't return 200. The file is
+    deleted when the context exits.
+    """
+    client = get_http_client()
+    path = None
+    try:
+        async with client.stream("GET", url, headers={"Authorization": f"Bearer {access_token}"}, timeout=timeout) as response:
+            if response.status_code == 200:
+                fd, path = tempfile.mkstemp(suffix=".download")
+                with os.fdopen(fd, "wb") as sink:
+                    async for chunk in response.aiter_bytes(65536):
+                        sink.write(chunk)
+        yield path
+    finally:
+        if path:
+            os.unlink(path)
+
+
+def _parse_drive_batch_response(content_type: str, body: str, count: int) -> List[Optional[dict]]:
+    """Split a multipart/mixed batch response into per-call JSON bodies (None on error)."""
+    match = _BOUNDARY_RE.search(content_type)
+    if not match:
+        raise ValueError(f"Drive batch response is not multipart: {content_type}")
+
+    results: List[Optional[dict]] = [None] * count
+    for part in body.split(f"--{match.group(1)}"):
+        content_id = _CONTENT_ID_RE.search(part)
+        status = _HTTP_STATUS_RE.search(part)
+        if not content_id or not status or status.group(1) != "200":
+            continue
+        index = int(content_id.group(1))
+        # Part layout: MIME headers, blank line, HTTP status + headers, blank line, body
+        sections = part.replace("\r\n", "\n").split("\n\n", 2)
+        if index < count and len(sections) == 3:
+            results[index] = orjson.loads(sections[2].strip())
+    return results
+
+
+async def drive_batch_list_files(access_token: str, queries: List[dict]) -> List[Optional[List[dict]]]:
+    """
+    Run several files.list calls in one Drive batch request per 100 calls.
+
+    Args:
+        access_token: Google OAuth access token
+        queries: files.list query parameters, one dict per call
+
+    Returns:
+        The files of each call in order, or None for calls that failed
+    """
+    client = get_http_client()
+    results: List[Optional[List[dict]]] = []
+    for offset in range(0, len(queries), DRIVE_BATCH_MAX_REQUESTS):
+        chunk = queries[offset:offset + DRIVE_BATCH_MAX_REQUESTS]
+        boundary = f"batch_{secrets.token_hex(8)}"
+        body = "".join(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <item{i}>\r\n\r\n"
+            f"GET /drive/v3/files?{urlencode(params)}\r\n"
+            f"Authorization: Bearer {access_token}\r\n\r\n"
+            for i, params in enumerate(chunk)
+        ) + f"--{boundary}--\r\n"
+
+        response = await client.post(
+            DRIVE_BATCH_URL,
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": f"multipart/mixed; boundary={boundary}",
+            },
+            content=body.encode("utf-8"),
+            timeout=30.0
+        )
         response.raise_for_status()
-        data = response.json()
-        return data.get("files", [])
+        parsed = _parse_drive_batch_response(response.headers.get("content-type", ""), response.text, len(chunk))
+        results.extend(data.get("files", []) if data is not None else None for data in parsed)
+    return results
 
 
 async def use_claude_to_select_relevant_docs(
@@ -220,29 +296,26 @@ async def comprehensive_document_search(
         search_terms = [central_topic] + central_topic.split()[:3]
         print(f"[GoogleDrive] Using fallback search terms: {search_terms}")
 
-    # Step 2: Search Google Drive with each term and collect unique documents
+    # Step 2: Search Google Drive with each term, plus recent documents, in
+    # one batch request and collect unique documents
+    terms = search_terms[:5]  # Limit to 5 searches to avoid rate limits
+    try:
+        listings = await drive_batch_list_files(
+            access_token, [_search_params(term) for term in terms] + [_RECENT_DOCS_PARAMS]
+        )
+    except Exception as e:
+        print(f"[GoogleDrive] Batch search failed: {e}")
+        listings = [None] * (len(terms) + 1)
+
     all_documents = {}
-    for term in search_terms[:5]:  # Limit to 5 searches to avoid rate limits
-        try:
-            print(f"[GoogleDrive] Searching for: '{term}'")
-            docs = await search_google_drive(access_token, term)
-            print(f"[GoogleDrive] Found {len(docs)} docs for '{term}'")
-            for doc in docs:
-                if doc["id"] not in all_documents:
-                    all_documents[doc["id"]] = doc
-        except Exception as e:
-            print(f"[GoogleDrive] Search failed for term '{term}': {e}")
+    for label, docs in zip([f"'{term}'" for term in terms] + ["recent docs"], listings):
+        if docs is None:
+            print(f"[GoogleDrive] Search failed for {label}")
             continue
-
-    # Also get recent documents
-    try:
-        recent_docs = await list_google_drive_docs(access_token)
-        print(f"[GoogleDrive] Found {len(recent_docs)} recent docs")
-        for doc in recent_docs:
+        print(f"[GoogleDrive] Found {len(docs)} docs for {label}")
+        for doc in docs:
             if doc["id"] not in all_documents:
                 all_documents[doc["id"]] = doc
-    except Exception as e:
-        print(f"[GoogleDrive] Failed to list recent docs: {e}")
 
     print(f"[GoogleDrive] Total unique documents found: {len(all_documents)}")
 
@@ -11,14 +11,17 @@ import asyncio
 import json
 import uuid
 import os
-import re
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, List, Dict, Any, Callable
 from dataclasses import dataclass
 from pathlib import Path
 
+import orjson
+
+from services.db import run_query, upload_object
 from services.token_compression import TokenCompressionService
-from services.llm_provider import generate_text
+from services.llm_provider import extract_json_from_response, generate_text
+from services.llm_batch import batch_mode_available, generate_text_batch
 
 
 @dataclass
@@ -65,6 +68,7 @@ class LearningPathPipeline:
 
     BATCH_SIZE = 5
     RATE_LIMIT_DELAY = 2.0  # Conservative - 2 seconds between Gemini calls
+    REALTIME_FALLBACK_CONCURRENCY = 2  # Real-time calls when batch summaries fall back
 
     def __init__(
         self,
@@ -122,22 +126,30 @@ class LearningPathPipeline:
                 "total_batches": total_batches
             })
 
-            # Step 2: Generate batch summaries with rate limiting
+            # Step 2: Generate batch summaries. This job is not interactive, so
+            # prefer the discounted Batches API when it is enabled.
             batch_summaries: List[BatchSummary] = []
-            for i, batch in enumerate(batches):
-                print(f"[LearningPath] Processing batch {i+1}/{total_batches}")
-
-                summary = await self._process_batch(batch, i)
-                batch_summaries.append(summary)
-
+            if batch_mode_available():
+                batch_summaries = await self._process_batches_offline(batches)
                 await self._update_job_status(job_id, "batch_processing", {
-                    "batches_processed": i + 1,
+                    "batches_processed": total_batches,
                     "total_batches": total_batches
                 })
+            else:
+                for i, batch in enumerate(batches):
+                    print(f"[LearningPath] Processing batch {i+1}/{total_batches}")
+
+                    summary = await self._process_batch(batch, i)
+                    batch_summaries.append(summary)
+
+                    await self._update_job_status(job_id, "batch_processing", {
+                        "batches_processed": i + 1,
+                        "total_batches": total_batches
+                    })
 
-                # Rate limit between batches
-                if i < total_batches - 1:
-                    await asyncio.sleep(self.rate_limit_delay)
+                    # Rate limit between batches
+                    if i < total_batches - 1:
+                        await asyncio.sleep(self.rate_limit_delay)
 
             # Step 3: Compress and create meta-summary
             await self._update_job_status(job_id, "summarizing")
@@ -167,10 +179,10 @@ class LearningPathPipeline:
     async def _fetch_materials(self, user_id: int, session_id: str) -> List[Dict]:
         """Fetch all processed materials for the session."""
         # Fetch from academia_materials
-        result = self.supabase.table("academia_materials").select(
+        result = await run_query(self.supabase.table("academia_materials").select(
             "id, title, compressed_text, original_text, material_type, source_type, notes, "
             "compressed_storage_bucket, compressed_storage_path"
-        ).eq("user_id", user_id).eq("session_id", session_id).execute()
+        ).eq("user_id", user_id).eq("session_id", session_id))
 
         materials = []
         for row in result.data:
@@ -178,9 +190,9 @@ class LearningPathPipeline:
             content = row.get("compressed_text") or row.get("original_text") or ""
             if not content and row.get("compressed_storage_bucket") and row.get("compressed_storage_path"):
                 try:
-                    stored = self.supabase.storage.from_(
-                        row["compressed_storage_bucket"]
-                    ).download(row["compressed_storage_path"])
+                    stored = await self.supabase.storage.from_(row["compressed_storage_bucket"]).download(
+                        row["compressed_storage_path"]
+                    )
                     if isinstance(stored, bytes):
                         stored = stored.decode("utf-8")
                     stored_content = json.loads(stored)
@@ -198,9 +210,9 @@ class LearningPathPipeline:
                 })
 
         # Also fetch from google_docs_materials
-        gdocs_result = self.supabase.table("google_docs_materials").select(
+        gdocs_result = await run_query(self.supabase.table("google_docs_materials").select(
             "id, title, content_snippet"
-        ).eq("user_id", user_id).eq("session_id", session_id).execute()
+        ).eq("user_id", user_id).eq("session_id", session_id))
 
         for row in gdocs_result.data:
             if row.get("content_snippet"):
@@ -222,8 +234,31 @@ class LearningPathPipeline:
             batches.append(materials[i:i + self.batch_size])
         return batches
 
+    async def _process_batches_offline(self, batches: List[List[Dict]]) -> List[BatchSummary]:
+        """Summarize every batch through one Message Batches request."""
+        prompts = {str(i): self._build_batch_prompt(batch) for i, batch in enumerate(batches)}
+        texts = await generate_text_batch(
+            prompts,
+            task="learning_path_pipeline",
+            max_tokens=8192,
+            temperature=0.7,
+            realtime_concurrency=self.REALTIME_FALLBACK_CONCURRENCY
+        )
+        missing = [key for key in prompts if key not in texts]
+        if missing:
+            raise RuntimeError(f"Batch summaries failed for batches {', '.join(missing)}")
+
+        return [
+            self._parse_batch_summary(batch, i, texts[str(i)])
+            for i, batch in enumerate(batches)
+        ]
+
     async def _process_batch(self, batch: List[Dict], batch_index: int) -> BatchSummary:
         """Process a batch of documents with Gemini."""
+        response_text = await self._call_gemini(self._build_batch_prompt(batch))
+        return self._parse_batch_summary(batch, batch_index, response_text)
+
+    def _build_batch_prompt(self, batch: List[Dict]) -> str:
         # Format documents for prompt
         docs_formatted = json.dumps({
             "documents": [
@@ -246,8 +281,9 @@ Here are the documents to analyze:
 {docs_formatted}
 
 Return ONLY valid JSON with no markdown formatting or code blocks."""
+        return prompt
 
-        response_text = await self._call_gemini(prompt)
+    def _parse_batch_summary(self, batch: List[Dict], batch_index: int, response_text: str) -> BatchSummary:
         result = self._extract_json(response_text)
 
         return BatchSummary(
@@ -326,8 +362,10 @@ CRITICAL REQUIREMENTS:
 Return ONLY valid JSON with no markdown formatting or code blocks."""
 
         response_text = await self._call_gemini(prompt)
-        result = self._extract_json(response_text)
+        return self._validate_dag(self._extract_json(response_text))
 
+    def _validate_dag(self, result: Dict) -> Dict:
+        """Normalize the decomposed nodes and attach DAG metadata."""
         # Validate and enhance the result
         nodes = result.get("nodes", [])
 
@@ -504,7 +542,7 @@ Return ONLY valid JSON with no markdown formatting or code blocks."""
             "learning_path_id": learning_path_id,
             "session_id": session_id,
             "user_id": user_id,
-            "created_at": datetime.utcnow().isoformat() + "Z",
+            "created_at": datetime.now(timezone.utc).isoformat(),
             "metadata": knowledge_dag.get("metadata", {}),
             "nodes": knowledge_dag.get("nodes", []),
             "edges": self._build_edges(knowledge_dag.get("nodes", [])),
@@ -521,37 +559,27 @@ Return ONLY valid JSON with no markdown formatting or code blocks."""
         # Upload to storage bucket
         storage_path = f"{user_id}/{session_id}/learning_path.json"
 
-        try:
-            self.supabase.storage.from_("learning_paths").upload(
-                storage_path,
-                json.dumps(document, indent=2).encode("utf-8"),
-                {"content-type": "application/json"}
-            )
-        except Exception as e:
-            # Try to remove and re-upload if exists
-            if "already exists" in str(e).lower() or "duplicate" in str(e).lower():
-                self.supabase.storage.from_("learning_paths").remove([storage_path])
-                self.supabase.storage.from_("learning_paths").upload(
-                    storage_path,
-                    json.dumps(document, indent=2).encode("utf-8"),
-                    {"content-type": "application/json"}
-                )
-            else:
-                raise
+        await upload_object(
+            self.supabase.storage.from_("learning_paths"),
+            storage_path,
+            orjson.dumps(document),
+            "application/json; charset=utf-8"
+        )
 
         # Save to database
-        self.supabase.table("learning_paths").insert({
+        await run_query(self.supabase.table("learning_paths").insert({
             "id": learning_path_id,
             "session_id": session_id,
             "user_id": user_id,
             "storage_path": storage_path,
             "total_nodes": knowledge_dag["metadata"]["total_nodes"],
             "max_depth": knowledge_dag["metadata"]["max_depth"]
-        }).execute()
+        }))
 
-        # Also store nodes in knowledge_nodes table for querying
-        for node in knowledge_dag.get("nodes", []):
-            self.supabase.table("knowledge_nodes").insert({
+        # Also store nodes in knowledge_nodes table for querying (one bulk insert)
+        dag_nodes = knowledge_dag.get("nodes", [])
+        if dag_nodes:
+            await run_query(self.supabase.table("knowledge_nodes").insert([{
                 "id": node["id"],
                 "session_id": session_id,
                 "learning_path_id": learning_path_id,
@@ -561,18 +589,18 @@ Return ONLY valid JSON with no markdown formatting or code blocks."""
                 "depth_level": node.get("depth", 0),
                 "source": "learning_path",
                 "is_llm_generated": True
-            }).execute()
+            } for node in dag_nodes]))
 
-        # Store edges in knowledge_prerequisites with reasoning
-        for edge in document["edges"]:
-            prereq_data = {
+        # Store edges in knowledge_prerequisites with reasoning; nodes must
+        # exist first for the foreign keys
+        if document["edges"]:
+            await run_query(self.supabase.table("knowledge_prerequisites").insert([{
                 "learning_path_id": learning_path_id,
                 "source_node_id": edge["source"],
                 "target_node_id": edge["target"],
                 "relationship": edge.get("type", "requires"),
                 "reasoning": edge.get("reasoning", ""),
-            }
-            self.supabase.table("knowledge_prerequisites").insert(prereq_data).execute()
+            } for edge in document["edges"]]))
 
         return LearningPathResult(
             success=True,
@@ -623,11 +651,11 @@ Return ONLY valid JSON with no markdown formatting or code blocks."""
             update_data["error_message"] = error_message
 
         if status == "completed":
-            update_data["completed_at"] = datetime.utcnow().isoformat()
+            update_data["completed_at"] = datetime.now(timezone.utc).isoformat()
 
-        self.supabase.table("learning_path_jobs").update(
+        await run_query(self.supabase.table("learning_path_jobs").update(
             update_data
-        ).eq("id", job_id).execute()
+        ).eq("id", job_id))
 
     async def _call_gemini(self, prompt: str) -> str:
         """Compatibility wrapper: route legacy Gemini calls through the configured provider."""
@@ -640,18 +668,4 @@ Return ONLY valid JSON with no markdown formatting or code blocks."""
 
     def _extract_json(self, text: str) -> Dict:
         """Extract JSON from response, handling markdown code blocks."""
-        # Try to find JSON in code blocks first
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
-        if json_match:
-            text = json_match.group(1)
-
-        text = text.strip()
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            # Try to find JSON object in the text
-            start = text.find('{')
-            end = text.rfind('}') + 1
-            if start != -1 and end > start:
-                return json.loads(text[start:end])
-            raise
+        return extract_json_from_response(text)
@@ -0,0 +1,284 @@
+"""
+Provider batch APIs (Anthropic Message Batches, Gemini Batch Mode) for
+non-interactive LLM work.
+
+Batch requests cost roughly half the real-time price and finish within
+minutes to hours. That suits background jobs such as learning-path generation,
+not request/response endpoints. When LLM_BATCH_ENABLED is off or the batch
+provider is not configured, prompts run through the real-time provider chain
+instead.
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+import orjson
+
+from .llm_provider import (
+    ANTHROPIC_API_KEY,
+    ANTHROPIC_VERSION,
+    CLAUDE_MODELS,
+    GEMINI_API_KEY,
+    GEMINI_MODELS,
+    LLMProviderError,
+    generate_text,
+    get_http_client,
+    primary_model,
+)
+
+
+ANTHROPIC_BATCHES_URL = "https://api.anthropic.com/v1/messages/batches"
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+GEMINI_BATCH_URL = GEMINI_API_BASE + "/models/{model}:batchGenerateContent"
+_GEMINI_DONE_STATES = frozenset({
+    "BATCH_STATE_SUCCEEDED", "BATCH_STATE_FAILED", "BATCH_STATE_CANCELLED", "BATCH_STATE_EXPIRED",
+    "JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED",
+})
+
+LLM_BATCH_ENABLED = os.getenv("LLM_BATCH_ENABLED", "false").lower() == "true"
+LLM_BATCH_POLL_SECONDS = float(os.getenv("LLM_BATCH_POLL_SECONDS", "30"))
+LLM_BATCH_TIMEOUT_SECONDS = float(os.getenv("LLM_BATCH_TIMEOUT_SECONDS", str(24 * 3600)))
+# "auto" uses Claude when configured, otherwise Gemini
+LLM_BATCH_PROVIDER = os.getenv("LLM_BATCH_PROVIDER", "auto").strip().lower()
+# Concurrent real-time calls when batch requests fall back, unless the caller
+# passes realtime_concurrency; a failed batch must not burst every prompt at once
+LLM_BATCH_REALTIME_CONCURRENCY = int(os.getenv("LLM_BATCH_REALTIME_CONCURRENCY", "4"))
+
+
+def _batch_provider() -> Optional[str]:
+    if LLM_BATCH_PROVIDER in ("auto", "claude") and ANTHROPIC_API_KEY:
+        return "claude"
+    if LLM_BATCH_PROVIDER in ("auto", "gemini") and GEMINI_API_KEY:
+        return "gemini"
+    return None
+
+
+def batch_mode_available() -> bool:
+    """Return whether prompts will be sent through a provider batch API."""
+    return LLM_BATCH_ENABLED and _batch_provider() is not None
+
+
+def _headers() -> dict:
+    return {
+        "x-api-key": ANTHROPIC_API_KEY,
+        "anthropic-version": ANTHROPIC_VERSION,
+        "content-type": "application/json",
+    }
+
+
+async def submit_batch(
+    prompts: dict[str, str],
+    *,
+    system: str = "",
+    max_tokens: int = 4096,
+    temperature: float = 0.3,
+) -> str:
+    """
+    Submit prompts as one message batch.
+
+    Args:
+        prompts: Mapping of custom_id to prompt text
+        system: Optional system prompt shared by every request
+        max_tokens: Output budget per request
+        temperature: Sampling temperature
+
+    Returns:
+        The batch id
+    """
+    model = primary_model(CLAUDE_MODELS)
+    requests = []
+    for custom_id, prompt in prompts.items():
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        if system:
+            params["system"] = system
+        requests.append({"custom_id": custom_id, "params": params})
+
+    response = await get_http_client().post(ANTHROPIC_BATCHES_URL, headers=_headers(), json={"requests": requests})
+    response.raise_for_status()
+    return orjson.loads(response.content)["id"]
+
+
+async def wait_for_batch(batch_id: str) -> dict:
+    """Poll a batch until processing has ended and return its final status."""
+    deadline = time.monotonic() + LLM_BATCH_TIMEOUT_SECONDS
+    while True:
+        response = await get_http_client().get(f"{ANTHROPIC_BATCHES_URL}/{batch_id}", headers=_headers())
+        response.raise_for_status()
+        batch = orjson.loads(response.content)
+        if batch.get("processing_status") == "ended":
+            return batch
+        if time.monotonic() > deadline:
+            raise LLMProviderError(f"Message batch {batch_id} did not finish in time")
+        await asyncio.sleep(LLM_BATCH_POLL_SECONDS)
+
+
+async def fetch_batch_results(batch: dict) -> dict[str, str]:
+    """Download a finished batch's JSONL results as {custom_id: text} for successful requests."""
+    results_url = batch.get("results_url")
+    if not results_url:
+        return {}
+
+    response = await get_http_client().get(results_url, headers=_headers())
+    response.raise_for_status()
+
+    texts: dict[str, str] = {}
+    for line in response.text.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        result = item.get("result", {})
+        if result.get("type") != "succeeded":
+            continue
+        blocks = result.get("message", {}).get("content", [])
+        text = "\n".join(b.get("text", "") for b in blocks if b.get("type") == "text").strip()
+        if text:
+            texts[item["custom_id"]] = text
+    return texts
+
+
+async def submit_gemini_batch(
+    prompts: dict[str, str],
+    *,
+    system: str = "",
+    max_tokens: int = 4096,
+    temperature: float = 0.3,
+) -> str:
+    """
+    Submit prompts as one Gemini batch job with inline requests.
+
+    Args:
+        prompts: Mapping of custom_id to prompt text
+        system: Optional system instruction shared by every request
+        max_tokens: Output budget per request
+        temperature: Sampling temperature
+
+    Returns:
+        The batch resource name ("batches/...")
+    """
+    requests = []
+    for custom_id, prompt in prompts.items():
+        request = {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": temperature, "maxOutputTokens": max_tokens},
+        }
+        if system:
+            request["systemInstruction"] = {"parts": [{"text": system}]}
+        requests.append({"request": request, "metadata": {"key": custom_id}})
+
+    response = await get_http_client().post(
+        GEMINI_BATCH_URL.format(model=primary_model(GEMINI_MODELS)),
+        params={"key": GEMINI_API_KEY},
+        json={"batch": {"display_name": "arxlearn-batch", "input_config": {"requests": {"requests": requests}}}},
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)["name"]
+
+
+async def wait_for_gemini_batch(name: str) -> dict:
+    """Poll a Gemini batch until it reaches a terminal state and return it."""
+    deadline = time.monotonic() + LLM_BATCH_TIMEOUT_SECONDS
+    while True:
+        response = await get_http_client().get(f"{GEMINI_API_BASE}/{name}", params={"key": GEMINI_API_KEY})
+        response.raise_for_status()
+        batch = orjson.loads(response.content)
+        state = (batch.get("metadata") or {}).get("state") or batch.get("state")
+        if batch.get("done") or state in _GEMINI_DONE_STATES:
+            return batch
+        if time.monotonic() > deadline:
+            raise LLMProviderError(f"Gemini batch {name} did not finish in time")
+        await asyncio.sleep(LLM_BATCH_POLL_SECONDS)
+
+
+def parse_gemini_batch_results(batch: dict) -> dict[str, str]:
+    """Extract {custom_id: text} for successful requests of a finished Gemini batch."""
+    output = batch.get("response") or (batch.get("metadata") or {}).get("output") or {}
+    inlined = output.get("inlinedResponses") or {}
+    if isinstance(inlined, dict):
+        inlined = inlined.get("inlinedResponses", [])
+
+    texts: dict[str, str] = {}
+    for item in inlined:
+        custom_id = (item.get("metadata") or {}).get("key")
+        candidates = (item.get("response") or {}).get("candidates") or []
+        if not custom_id or not candidates:
+            continue
+        parts = (candidates[0].get("content") or {}).get("parts", [])
+        text = "".join(part.get("text", "") for part in parts).strip()
+        if text:
+            texts[custom_id] = text
+    return texts
+
+
+async def _run_provider_batch(
+    prompts: dict[str, str],
+    *,
+    task: str,
+    system: str,
+    max_tokens: int,
+    temperature: float,
+) -> dict[str, str]:
+    provider = _batch_provider()
+    if provider == "gemini":
+        name = await submit_gemini_batch(prompts, system=system, max_tokens=max_tokens, temperature=temperature)
+        print(f"[LLM Batch] Submitted {len(prompts)} Gemini requests for task '{task}' as {name}")
+        return parse_gemini_batch_results(await wait_for_gemini_batch(name))
+
+    batch_id = await submit_batch(prompts, system=system, max_tokens=max_tokens, temperature=temperature)
+    print(f"[LLM Batch] Submitted {len(prompts)} requests for task '{task}' as {batch_id}")
+    return await fetch_batch_results(await wait_for_batch(batch_id))
+
+
+async def generate_text_batch(
+    prompts: dict[str, str],
+    *,
+    task: str = "batch",
+    system: str = "",
+    max_tokens: int = 4096,
+    temperature: float = 0.3,
+    realtime_concurrency: Optional[int] = None,
+) -> dict[str, str]:
+    """
+    Generate text for many prompts, using a provider batch API when available.
+
+    Requests that fail inside the batch (or every request, when batch mode is
+    off) are retried through the real-time provider chain.
+
+    Returns:
+        Mapping of custom_id to generated text; ids that fail everywhere are omitted
+    """
+    texts: dict[str, str] = {}
+    if prompts and batch_mode_available():
+        try:
+            texts = await _run_provider_batch(
+                prompts, task=task, system=system, max_tokens=max_tokens, temperature=temperature
+            )
+        except Exception as e:
+            print(f"[LLM Batch] Batch for task '{task}' failed, using real-time calls: {e}")
+
+    remaining = [custom_id for custom_id in prompts if custom_id not in texts]
+    if not remaining:
+        return texts
+
+    semaphore = asyncio.Semaphore(max(1, realtime_concurrency or LLM_BATCH_REALTIME_CONCURRENCY))
+
+    async def run(custom_id: str) -> None:
+        async with semaphore:
+            try:
+                texts[custom_id] = await generate_text(
+                    prompts[custom_id],
+                    system=system,
+                    task=task,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+            except Exception as e:
+                print(f"[LLM Batch] Real-time call for {custom_id} failed: {e}")
+
+    await asyncio.gather(*(run(custom_id) for custom_id in remaining))
+    return texts
@@ -4,15 +4,23 @@ Claude-first LLM provider with Gemini and OpenRouter fallbacks.
 This keeps ArXLearn's model calls swappable from Railway environment
 variables without forcing each feature to know provider-specific payloads.
 """
+import asyncio
+import importlib.util
 import json
 import os
 import re
+import time
+from enum import Enum
 from pathlib import Path
-from typing import Any, Optional
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Optional
 
 import httpx
+import orjson
 from dotenv import load_dotenv
 
+from .response_cache import ExactCache, SemanticCache
+from .tokenizer import count_tokens
 
 load_dotenv(Path(__file__).resolve().parent.parent / ".env")
 
@@ -20,42 +28,244 @@ ANTHROPIC_URL = "https://api.anthropic.com/v1/messages"
 GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+# Environment is read once at import; request paths only touch these constants.
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
+ANTHROPIC_VERSION = os.getenv("ANTHROPIC_VERSION", "2023-06-01")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "auto").strip().lower()
+LLM_FALLBACK_ENABLED = os.getenv("LLM_FALLBACK_ENABLED", "true").lower() != "false"
+CLAUDE_SEARCH_ENABLED = os.getenv("CLAUDE_SEARCH_ENABLED", "true").lower() != "false"
+CLAUDE_SEARCH_MAX_USES = int(os.getenv("CLAUDE_SEARCH_MAX_USES", "3"))
+OPENROUTER_SEARCH_MAX_RESULTS = int(os.getenv("OPENROUTER_SEARCH_MAX_RESULTS", "3"))
+LLM_HTTP_REFERER = os.getenv("LLM_HTTP_REFERER", "https://arxlearn.app")
+LLM_APP_TITLE = os.getenv("LLM_APP_TITLE", "arXlearn")
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() != "false"
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+_EXACT_CACHE = ExactCache(
+    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+    redis_url=os.getenv("REDIS_URL") or None,
+)
+# Identical generate_text calls in flight share one provider round-trip
+_INFLIGHT: dict[str, asyncio.Task] = {}
+
+
+def _model_list(env_name: str, default: str) -> tuple[str, ...]:
+    """Parse a comma-separated model env var; later entries are failover targets."""
+    models = tuple(m.strip() for m in os.getenv(env_name, default).split(",") if m.strip())
+    return models or (default,)
+
+
+CLAUDE_MODELS = _model_list("CLAUDE_MODEL", "claude-sonnet-4-6")
+GEMINI_MODELS = _model_list("GEMINI_MODEL", "gemini-2.0-flash")
+OPENROUTER_MODELS = _model_list("OPENROUTER_MODEL", os.getenv("DEFAULT_MODEL", "openai/gpt-4o-mini"))
+OPENROUTER_SEARCH_MODELS = _model_list("OPENROUTER_SEARCH_MODEL", "openai/gpt-4o-mini:online")
+
+# "failover" tries models in configured order; "latency" prefers the model
+# with the lowest recent latency. Either way, a model that was rate limited
+# or errored is skipped for LLM_MODEL_COOLDOWN_SECONDS.
+LLM_MODEL_ROUTING = os.getenv("LLM_MODEL_ROUTING", "failover").strip().lower()
+LLM_MODEL_COOLDOWN_SECONDS = float(os.getenv("LLM_MODEL_COOLDOWN_SECONDS", "30"))
+
+# Short, low-output prompts (source labels, one-line definitions) go to a
+# cheaper, faster model per provider. LLM_FAST_TIER_MAX_PROMPT_TOKENS=0
+# disables the downgrade.
+CLAUDE_FAST_MODEL = os.getenv("CLAUDE_FAST_MODEL", "claude-haiku-4-5")
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.0-flash-lite")
+OPENROUTER_FAST_MODEL = os.getenv("OPENROUTER_FAST_MODEL", "openai/gpt-4o-mini")
+FAST_TIER_MAX_PROMPT_TOKENS = int(os.getenv("LLM_FAST_TIER_MAX_PROMPT_TOKENS", "256"))
+FAST_TIER_MAX_OUTPUT_TOKENS = 1024
+_FAST_TIER_TASKS = frozenset({"problem_source_inference"})
+_SIMPLE_PROMPT_RE = re.compile(r"^\s*(?:define|list|summarize)\b", re.IGNORECASE)
+# Routing only compares against small thresholds, so longer texts are
+# estimated at ~4 characters per token rather than encoded on the event loop
+TOKEN_COUNT_EXACT_MAX_CHARS = 50_000
+
+# Claude only caches prompt prefixes of at least ~1024 tokens; shorter system
+# prompts are sent as plain strings. Gemini and OpenRouter models cache stable
+# prefixes implicitly, so static instructions belong in `system`.
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("LLM_PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+# HTTP/2 lets concurrent provider calls multiplex over one TLS connection;
+# it needs the optional h2 package (httpx[http2]).
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+_http_client: Optional[httpx.AsyncClient] = None
+
+_SEMANTIC_CACHE = SemanticCache(
+    threshold=float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.92")),
+    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+)
+
 
 class LLMProviderError(RuntimeError):
     """Raised when no configured provider can satisfy an LLM request."""
 
 
+# Fenced ```json blocks in model output; compiled once for every response parser
+JSON_FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```")
+_JSON_OPENER_RE = re.compile(r"[\[{]")
+# Reasoning models may prepend a <think>...</think> block to their answer
+_THINK_RE = re.compile(r"<think>[\s\S]*?</think>", re.IGNORECASE)
+# strict=False accepts raw newlines and tabs inside strings, which models emit
+_JSON_DECODER = json.JSONDecoder(strict=False)
+
+
+class Provider(str, Enum):
+    """LLM providers in the fallback chain."""
+    CLAUDE = "claude"
+    GEMINI = "gemini"
+    OPENROUTER = "openrouter"
+
+
+def _balanced_json_end(text: str, start: int) -> Optional[int]:
+    # Index just past the bracket that closes the opener at start, skipping
+    # brackets inside strings; None when the value is truncated
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
 def extract_json_from_response(text: str) -> Any:
-    """Extract JSON from model output, handling code fences and surrounding prose."""
-    text = (text or "").strip()
-    json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
+    """Extract JSON from model output, handling think blocks, code fences and surrounding prose."""
+    text = _THINK_RE.sub("", text or "").strip()
+    json_match = JSON_FENCE_RE.search(text)
     if json_match:
         text = json_match.group(1).strip()
 
     try:
-        return json.loads(text)
+        return orjson.loads(text)
     except json.JSONDecodeError:
         pass
 
-    object_start = text.find("{")
-    array_start = text.find("[")
+    # Decode the first top-level "{" or "[" value and ignore surrounding prose.
+    # Arrays contain objects, so preferring "{" would corrupt wrapped arrays.
+    # Numeric citation markers like "[1]" before the JSON are skipped.
+    match = _JSON_OPENER_RE.search(text)
+    while match:
+        start = match.start()
+        end = _balanced_json_end(text, start)
+        if end is None:
+            raise json.JSONDecodeError("Unterminated JSON value", text, start)
+        value = _JSON_DECODER.decode(text[start:end])
+        if not (isinstance(value, list) and value and all(isinstance(v, (int, float)) for v in value)):
+            return value
+        match = _JSON_OPENER_RE.search(text, end)
 
-    # Use whichever JSON opener appears first. Arrays contain objects, so
-    # preferring "{" would corrupt fenced/prose-wrapped arrays.
-    if array_start != -1 and (object_start == -1 or array_start < object_start):
-        array_end = text.rfind("]") + 1
-        if array_end > array_start:
-            return json.loads(text[array_start:array_end])
+    raise json.JSONDecodeError("No JSON object or array found", text, 0)
 
-    object_end = text.rfind("}") + 1
-    if object_start != -1 and object_end > object_start:
-        return json.loads(text[object_start:object_end])
 
-    array_end = text.rfind("]") + 1
-    if array_start != -1 and array_end > array_start:
-        return json.loads(text[array_start:array_end])
+class _ModelBalancer:
+    """Per-model EWMA latency and cooldowns used to order failover candidates."""
 
-    raise json.JSONDecodeError("No JSON object or array found", text, 0)
+    def __init__(self, routing: str, cooldown_seconds: float, alpha: float = 0.3):
+        self.routing = routing
+        self.cooldown_seconds = cooldown_seconds
+        self.alpha = alpha
+        self._latency: dict[str, float] = {}
+        self._cooldown_until: dict[str, float] = {}
+
+    def ordered(self, models: tuple[str, ...]) -> tuple[str, ...]:
+        if len(models) <= 1:
+            return models
+        now = time.monotonic()
+        if self.routing == "latency":
+            key = lambda m: (self._cooldown_until.get(m, 0.0) > now, self._latency.get(m, 0.0))
+        else:
+            key = lambda m: self._cooldown_until.get(m, 0.0) > now
+        # sorted() is stable, so ties keep the configured order
+        return tuple(sorted(models, key=key))
+
+    def record(self, model: str, seconds: float) -> None:
+        previous = self._latency.get(model)
+        self._latency[model] = seconds if previous is None else self.alpha * seconds + (1 - self.alpha) * previous
+        self._cooldown_until.pop(model, None)
+
+    def penalize(self, model: str) -> None:
+        self._cooldown_until[model] = time.monotonic() + self.cooldown_seconds
+
+
+_MODEL_BALANCER = _ModelBalancer(LLM_MODEL_ROUTING, LLM_MODEL_COOLDOWN_SECONDS)
+
+
+def primary_model(models: tuple[str, ...]) -> str:
+    """The model a single-shot (non-failover) request should use right now."""
+    return _MODEL_BALANCER.ordered(models)[0]
+
+
+async def _post_with_failover(models: tuple[str, ...], build_request) -> dict:
+    """
+    POST to each candidate model until one succeeds.
+
+    build_request(model) returns (url, request kwargs). Rate limits, 5xx and
+    transport errors move on to the next model; other errors are raised.
+    """
+    last_error: Optional[Exception] = None
+    for model in _MODEL_BALANCER.ordered(models):
+        url, kwargs = build_request(model)
+        started = time.monotonic()
+        try:
+            response = await get_http_client().post(url, **kwargs)
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
+            status = exc.response.status_code
+            if status != 429 and status < 500:
+                raise
+            _MODEL_BALANCER.penalize(model)
+            last_error = exc
+            continue
+        except httpx.TransportError as exc:
+            _MODEL_BALANCER.penalize(model)
+            last_error = exc
+            continue
+        _MODEL_BALANCER.record(model, time.monotonic() - started)
+        return orjson.loads(response.content)
+
+    raise last_error or LLMProviderError("No model configured")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Process-wide HTTP client so provider, Zotero, Google and Firecrawl calls
+    reuse warm keep-alive connections. Callers pass per-request timeouts.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                retries=2,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=256, max_keepalive_connections=64),
+            ),
+            timeout=120.0,
+        )
+    return _http_client
+
+
+async def aclose_http_client() -> None:
+    """Close the shared HTTP client (called on app shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 
 def has_provider(use_search: bool = False) -> bool:
@@ -72,6 +282,7 @@ async def generate_json(
     max_tokens: int = 4096,
     temperature: float = 0.2,
     search_prompt: Optional[str] = None,
+    semantic_key: Optional[str] = None,
 ) -> Any:
     """Generate and parse JSON using the configured provider chain."""
     text = await generate_text(
@@ -82,6 +293,7 @@ async def generate_json(
         max_tokens=max_tokens,
         temperature=temperature,
         search_prompt=search_prompt,
+        semantic_key=semantic_key,
     )
     try:
         return extract_json_from_response(text)
@@ -115,71 +327,302 @@ async def generate_text(
     max_tokens: int = 4096,
     temperature: float = 0.3,
     search_prompt: Optional[str] = None,
+    semantic_key: Optional[str] = None,
+    cache_ttl: Optional[float] = None,
 ) -> str:
     """
     Generate text through Claude first, then fall back to configured legacy providers.
 
     LLM_PROVIDER can be "auto", "claude", "gemini", or "openrouter".
     LLM_FALLBACK_ENABLED defaults to true so production has safety rails.
+
+    Identical prompts are served from an exact-match cache (LLM_CACHE_ENABLED,
+    LLM_CACHE_TTL_SECONDS, optional REDIS_URL). When semantic_key is given (the
+    topic or title interpolated into a templated prompt), a completion for a
+    near-duplicate key with an otherwise identical prompt is reused as well.
+    Concurrent identical calls are coalesced into one provider request.
+    cache_ttl overrides LLM_CACHE_TTL_SECONDS for the stored exact-match entry.
+    """
+    namespace = _cache_namespace(
+        task=task,
+        use_search=use_search,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        system=system,
+        search_prompt=search_prompt,
+    )
+    exact_key = None
+    if LLM_CACHE_ENABLED:
+        exact_key = ExactCache.key_for(namespace, prompt)
+        cached = await _EXACT_CACHE.get(exact_key)
+        if cached is not None:
+            return cached
+
+    semantic_gate = None
+    if semantic_key and LLM_CACHE_ENABLED:
+        semantic_gate = SemanticCache.gate_for(namespace, prompt, semantic_key)
+        cached = _SEMANTIC_CACHE.get(semantic_gate, semantic_key)
+        if cached is not None:
+            return cached
+
+    flight_key = exact_key or ExactCache.key_for(namespace, prompt)
+    flight = _INFLIGHT.get(flight_key)
+    if flight is None:
+        flight = asyncio.ensure_future(_generate_and_store(
+            prompt,
+            system=system,
+            task=task,
+            use_search=use_search,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            search_prompt=search_prompt,
+            exact_key=exact_key,
+            semantic_gate=semantic_gate,
+            semantic_key=semantic_key,
+            cache_ttl=cache_ttl,
+        ))
+        _INFLIGHT[flight_key] = flight
+        flight.add_done_callback(lambda _: _INFLIGHT.pop(flight_key, None))
+    # Shielded so one caller disconnecting doesn't cancel the shared call
+    return await asyncio.shield(flight)
+
+
+async def _generate_and_store(
+    prompt: str,
+    *,
+    exact_key: Optional[str],
+    semantic_gate: Optional[str],
+    semantic_key: Optional[str],
+    cache_ttl: Optional[float] = None,
+    **kwargs: Any,
+) -> str:
+    text = await _generate_uncached(prompt, **kwargs)
+    if exact_key:
+        await _EXACT_CACHE.set(exact_key, text, cache_ttl)
+    if semantic_gate:
+        _SEMANTIC_CACHE.set(semantic_gate, semantic_key, text)
+    return text
+
+
+async def generate_text_stream(
+    prompt: str,
+    *,
+    system: str = "",
+    task: str = "general",
+    max_tokens: int = 4096,
+    temperature: float = 0.3,
+) -> AsyncIterator[str]:
+    """
+    Stream text deltas from the first provider that accepts the request.
+
+    A provider is only skipped for the next one if it fails before producing
+    any text. Cached completions are replayed as a single chunk, and the full
+    streamed completion is stored in the exact-match cache afterwards.
     """
+    exact_key = None
+    if LLM_CACHE_ENABLED:
+        namespace = _cache_namespace(
+            task=task,
+            use_search=False,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system,
+            search_prompt=None,
+        )
+        exact_key = ExactCache.key_for(namespace, prompt)
+        cached = await _EXACT_CACHE.get(exact_key)
+        if cached is not None:
+            yield cached
+            return
+
+    fast = _use_fast_tier(prompt, system=system, task=task, use_search=False, max_tokens=max_tokens)
+    errors: list[str] = []
+    for provider in _provider_order(use_search=False):
+        parts: list[str] = []
+        # The provider slot is held only until the upstream stream produces its
+        # first delta, never across a yield: the SSE client decides when each
+        # yield resumes, and a stalled client must not starve generate_text
+        semaphore = _PROVIDER_SEMAPHORES[provider]
+        await semaphore.acquire()
+        holding = True
+        try:
+            async for delta in _STREAMERS[provider](
+                prompt, system=system, max_tokens=max_tokens, temperature=temperature, fast=fast
+            ):
+                if holding:
+                    semaphore.release()
+                    holding = False
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as exc:
+            if parts:
+                raise
+            errors.append(f"{provider.value}: {exc}")
+            continue
+        finally:
+            if holding:
+                semaphore.release()
+
+        if exact_key and parts:
+            await _EXACT_CACHE.set(exact_key, "".join(parts))
+        return
+
+    suffix = f" Errors: {'; '.join(errors)}" if errors else ""
+    raise LLMProviderError(f"No LLM provider succeeded for task '{task}'.{suffix}")
+
+
+def _cache_namespace(
+    *,
+    task: str,
+    use_search: bool,
+    max_tokens: int,
+    temperature: float,
+    system: str,
+    search_prompt: Optional[str],
+) -> str:
+    return "|".join([
+        task,
+        ",".join(provider.value for provider in _provider_order(use_search=use_search)),
+        str(use_search),
+        str(max_tokens),
+        str(temperature),
+        system,
+        search_prompt or "",
+    ])
+
+
+def _use_fast_tier(prompt: str, *, system: str, task: str, use_search: bool, max_tokens: int) -> bool:
+    """Whether a call is simple enough for the fast model tier."""
+    if use_search or FAST_TIER_MAX_PROMPT_TOKENS <= 0:
+        return False
+    if task in _FAST_TIER_TASKS:
+        return True
+    if max_tokens > FAST_TIER_MAX_OUTPUT_TOKENS:
+        return False
+    prompt_tokens = (
+        count_tokens(prompt, TOKEN_COUNT_EXACT_MAX_CHARS)
+        + count_tokens(system, TOKEN_COUNT_EXACT_MAX_CHARS)
+    )
+    return prompt_tokens < FAST_TIER_MAX_PROMPT_TOKENS or bool(_SIMPLE_PROMPT_RE.match(prompt))
+
+
+async def _generate_uncached(
+    prompt: str,
+    *,
+    system: str,
+    task: str,
+    use_search: bool,
+    max_tokens: int,
+    temperature: float,
+    search_prompt: Optional[str],
+) -> str:
+    fast = _use_fast_tier(prompt, system=system, task=task, use_search=use_search, max_tokens=max_tokens)
     errors: list[str] = []
     for provider in _provider_order(use_search=use_search):
         try:
-            if provider == "claude":
-                return await _call_claude(
-                    prompt,
-                    system=system,
-                    task=task,
-                    use_search=use_search,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    search_prompt=search_prompt,
-                )
-            if provider == "gemini":
-                return await _call_gemini(prompt, max_tokens=max_tokens, temperature=temperature)
-            if provider == "openrouter":
-                return await _call_openrouter(
-                    prompt,
-                    system=system,
-                    use_search=use_search,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    search_prompt=search_prompt,
-                )
+            async with _PROVIDER_SEMAPHORES[provider]:
+                match provider:
+                    case Provider.CLAUDE:
+                        return await _call_claude(
+                            prompt,
+                            system=system,
+                            task=task,
+                            use_search=use_search,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            search_prompt=search_prompt,
+                            fast=fast,
+                        )
+                    case Provider.GEMINI:
+                        return await _call_gemini(
+                            prompt, system=system, max_tokens=max_tokens, temperature=temperature, fast=fast
+                        )
+                    case Provider.OPENROUTER:
+                        return await _call_openrouter(
+                            prompt,
+                            system=system,
+                            use_search=use_search,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            search_prompt=search_prompt,
+                            fast=fast,
+                        )
         except Exception as exc:
-            errors.append(f"{provider}: {exc}")
+            errors.append(f"{provider.value}: {exc}")
             continue
 
     suffix = f" Errors: {'; '.join(errors)}" if errors else ""
     raise LLMProviderError(f"No LLM provider succeeded for task '{task}'.{suffix}")
 
 
-def _provider_order(*, use_search: bool) -> list[str]:
-    preferred = os.getenv("LLM_PROVIDER", "auto").strip().lower()
-    fallback_enabled = os.getenv("LLM_FALLBACK_ENABLED", "true").lower() != "false"
-    claude_search_enabled = os.getenv("CLAUDE_SEARCH_ENABLED", "true").lower() != "false"
+_SEARCH_ORDER = (Provider.CLAUDE, Provider.OPENROUTER, Provider.GEMINI)
+_DEFAULT_ORDER = (Provider.CLAUDE, Provider.GEMINI, Provider.OPENROUTER)
+_PROVIDER_KEYS = MappingProxyType({
+    Provider.CLAUDE: ANTHROPIC_API_KEY,
+    Provider.GEMINI: GEMINI_API_KEY,
+    Provider.OPENROUTER: OPENROUTER_API_KEY,
+})
+# Caps in-flight requests per provider in each worker, so bursts queue here
+# instead of tripping provider rate limits and model cooldowns.
+_PROVIDER_SEMAPHORES = MappingProxyType({
+    Provider.CLAUDE: asyncio.Semaphore(int(os.getenv("CLAUDE_MAX_CONCURRENCY", "16"))),
+    Provider.GEMINI: asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))),
+    Provider.OPENROUTER: asyncio.Semaphore(int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "16"))),
+})
 
-    if preferred not in {"auto", "claude", "gemini", "openrouter"}:
-        preferred = "auto"
 
-    available = {
-        "claude": bool(os.getenv("ANTHROPIC_API_KEY")),
-        "gemini": bool(os.getenv("GEMINI_API_KEY")),
-        "openrouter": bool(os.getenv("OPENROUTER_API_KEY")),
-    }
+def _build_provider_order(*, use_search: bool) -> tuple[Provider, ...]:
+    chain = _SEARCH_ORDER if use_search else _DEFAULT_ORDER
 
-    if preferred != "auto":
-        order = [preferred]
-        if fallback_enabled:
-            order.extend(["claude", "openrouter", "gemini"] if use_search else ["claude", "gemini", "openrouter"])
+    try:
+        preferred_provider = Provider(LLM_PROVIDER)
+    except ValueError:
+        preferred_provider = None  # "auto" or unrecognized
+
+    if preferred_provider is not None:
+        order: tuple[Provider, ...] = (preferred_provider, *(chain if LLM_FALLBACK_ENABLED else ()))
+    elif use_search and not CLAUDE_SEARCH_ENABLED:
+        order = (Provider.OPENROUTER, Provider.CLAUDE, Provider.GEMINI)
     else:
-        if use_search and not claude_search_enabled:
-            order = ["openrouter", "claude", "gemini"]
-        else:
-            order = ["claude", "openrouter", "gemini"] if use_search else ["claude", "gemini", "openrouter"]
+        order = chain
 
     seen = set()
-    return [p for p in order if available.get(p) and not (p in seen or seen.add(p))]
+    return tuple(
+        p for p in order
+        if _PROVIDER_KEYS[p] and not (p in seen or seen.add(p))
+    )
+
+
+# Provider configuration comes from the environment at process start, so the
+# fallback chain for each search mode is resolved once.
+_PROVIDER_ORDER = MappingProxyType({
+    flag: _build_provider_order(use_search=flag) for flag in (False, True)
+})
+
+
+def _provider_order(*, use_search: bool) -> tuple[Provider, ...]:
+    return _PROVIDER_ORDER[bool(use_search)]
+
+
+def _claude_system(system: str) -> Any:
+    """Mark long system prompts as a cacheable prefix for Claude prompt caching."""
+    if PROMPT_CACHE_MIN_TOKENS > 0 and count_tokens(system, TOKEN_COUNT_EXACT_MAX_CHARS) >= PROMPT_CACHE_MIN_TOKENS:
+        return [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+    return system
+
+
+def _gemini_payload(prompt: str, *, system: str, max_tokens: int, temperature: float) -> dict:
+    payload: dict[str, Any] = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": temperature,
+            "maxOutputTokens": max_tokens,
+        },
+    }
+    if system:
+        payload["systemInstruction"] = {"parts": [{"text": system}]}
+    return payload
 
 
 async def _call_claude(
@@ -191,23 +634,23 @@ async def _call_claude(
     max_tokens: int,
     temperature: float,
     search_prompt: Optional[str],
+    fast: bool = False,
 ) -> str:
-    api_key = os.getenv("ANTHROPIC_API_KEY", "")
+    api_key = ANTHROPIC_API_KEY
     if not api_key:
         raise LLMProviderError("ANTHROPIC_API_KEY is not configured")
 
-    model = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-6")
+    models = (CLAUDE_FAST_MODEL,) if fast else CLAUDE_MODELS
     payload: dict[str, Any] = {
-        "model": model,
         "max_tokens": max_tokens,
         "temperature": temperature,
         "messages": [{"role": "user", "content": prompt}],
     }
     if system:
-        payload["system"] = system
+        payload["system"] = _claude_system(system)
 
-    if use_search and os.getenv("CLAUDE_SEARCH_ENABLED", "true").lower() != "false":
-        max_uses = int(os.getenv("CLAUDE_SEARCH_MAX_USES", "3"))
+    if use_search and CLAUDE_SEARCH_ENABLED:
+        max_uses = CLAUDE_SEARCH_MAX_USES
         payload["tools"] = [{
             "type": "web_search_20250305",
             "name": "web_search",
@@ -218,14 +661,14 @@ async def _call_claude(
 
     headers = {
         "x-api-key": api_key,
-        "anthropic-version": os.getenv("ANTHROPIC_VERSION", "2023-06-01"),
+        "anthropic-version": ANTHROPIC_VERSION,
         "content-type": "application/json",
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(ANTHROPIC_URL, headers=headers, json=payload, timeout=120.0)
-        response.raise_for_status()
-        data = response.json()
+    data = await _post_with_failover(
+        models,
+        lambda model: (ANTHROPIC_URL, {"headers": headers, "json": {**payload, "model": model}}),
+    )
 
     parts = []
     for block in data.get("content", []):
@@ -238,25 +681,20 @@ async def _call_claude(
     return text
 
 
-async def _call_gemini(prompt: str, *, max_tokens: int, temperature: float) -> str:
-    api_key = os.getenv("GEMINI_API_KEY", "")
+async def _call_gemini(
+    prompt: str, *, system: str = "", max_tokens: int, temperature: float, fast: bool = False
+) -> str:
+    api_key = GEMINI_API_KEY
     if not api_key:
         raise LLMProviderError("GEMINI_API_KEY is not configured")
 
-    model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-    url = f"{GEMINI_URL.format(model=model)}?key={api_key}"
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "temperature": temperature,
-            "maxOutputTokens": max_tokens,
-        },
-    }
+    models = (GEMINI_FAST_MODEL,) if fast else GEMINI_MODELS
+    payload = _gemini_payload(prompt, system=system, max_tokens=max_tokens, temperature=temperature)
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json=payload, timeout=120.0)
-        response.raise_for_status()
-        data = response.json()
+    data = await _post_with_failover(
+        models,
+        lambda model: (GEMINI_URL.format(model=model), {"params": {"key": api_key}, "json": payload}),
+    )
     return data["candidates"][0]["content"]["parts"][0]["text"]
 
 
@@ -268,22 +706,22 @@ async def _call_openrouter(
     max_tokens: int,
     temperature: float,
     search_prompt: Optional[str],
+    fast: bool = False,
 ) -> str:
-    api_key = os.getenv("OPENROUTER_API_KEY", "")
+    api_key = OPENROUTER_API_KEY
     if not api_key:
         raise LLMProviderError("OPENROUTER_API_KEY is not configured")
 
-    model = os.getenv(
-        "OPENROUTER_SEARCH_MODEL" if use_search else "OPENROUTER_MODEL",
-        "openai/gpt-4o-mini:online" if use_search else os.getenv("DEFAULT_MODEL", "openai/gpt-4o-mini"),
-    )
+    if fast:
+        models = (OPENROUTER_FAST_MODEL,)
+    else:
+        models = OPENROUTER_SEARCH_MODELS if use_search else OPENROUTER_MODELS
     messages = []
     if system:
         messages.append({"role": "system", "content": system})
     messages.append({"role": "user", "content": prompt})
 
     payload: dict[str, Any] = {
-        "model": model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
@@ -291,19 +729,128 @@ async def _call_openrouter(
     if use_search:
         payload["plugins"] = [{
             "id": "web",
-            "max_results": int(os.getenv("OPENROUTER_SEARCH_MAX_RESULTS", "3")),
+            "max_results": OPENROUTER_SEARCH_MAX_RESULTS,
             "search_prompt": search_prompt or "Search for accurate educational sources.",
         }]
 
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
-        "HTTP-Referer": os.getenv("LLM_HTTP_REFERER", "https://arxlearn.app"),
-        "X-Title": os.getenv("LLM_APP_TITLE", "arXlearn"),
+        "HTTP-Referer": LLM_HTTP_REFERER,
+        "X-Title": LLM_APP_TITLE,
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(OPENROUTER_URL, headers=headers, json=payload, timeout=120.0)
-        response.raise_for_status()
-        data = response.json()
+    data = await _post_with_failover(
+        models,
+        lambda model: (OPENROUTER_URL, {"headers": headers, "json": {**payload, "model": model}}),
+    )
     return data["choices"][0]["message"]["content"]
+
+
+async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[str]:
+    """Yield the payload of each `data:` line of a Server-Sent Events body."""
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            data = line[5:].strip()
+            if data:
+                yield data
+
+
+async def _stream_claude(
+    prompt: str, *, system: str, max_tokens: int, temperature: float, fast: bool = False
+) -> AsyncIterator[str]:
+    api_key = ANTHROPIC_API_KEY
+    if not api_key:
+        raise LLMProviderError("ANTHROPIC_API_KEY is not configured")
+
+    payload: dict[str, Any] = {
+        "model": CLAUDE_FAST_MODEL if fast else primary_model(CLAUDE_MODELS),
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": True,
+    }
+    if system:
+        payload["system"] = _claude_system(system)
+    headers = {
+        "x-api-key": api_key,
+        "anthropic-version": ANTHROPIC_VERSION,
+        "content-type": "application/json",
+    }
+
+    async with get_http_client().stream("POST", ANTHROPIC_URL, headers=headers, json=payload) as response:
+        response.raise_for_status()
+        async for data in _iter_sse_data(response):
+            event = orjson.loads(data)
+            if event.get("type") == "content_block_delta":
+                delta = event.get("delta", {})
+                if delta.get("type") == "text_delta":
+                    yield delta.get("text", "")
+            elif event.get("type") == "error":
+                raise LLMProviderError(f"Claude stream error: {event.get('error')}")
+
+
+async def _stream_gemini(
+    prompt: str, *, system: str, max_tokens: int, temperature: float, fast: bool = False
+) -> AsyncIterator[str]:
+    api_key = GEMINI_API_KEY
+    if not api_key:
+        raise LLMProviderError("GEMINI_API_KEY is not configured")
+
+    model = GEMINI_FAST_MODEL if fast else primary_model(GEMINI_MODELS)
+    url = GEMINI_URL.format(model=model).replace(":generateContent", ":streamGenerateContent")
+    payload = _gemini_payload(prompt, system=system, max_tokens=max_tokens, temperature=temperature)
+
+    async with get_http_client().stream(
+        "POST", url, params={"alt": "sse", "key": api_key}, json=payload
+    ) as response:
+        response.raise_for_status()
+        async for data in _iter_sse_data(response):
+            chunk = orjson.loads(data)
+            for candidate in chunk.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    yield part.get("text", "")
+
+
+async def _stream_openrouter(
+    prompt: str, *, system: str, max_tokens: int, temperature: float, fast: bool = False
+) -> AsyncIterator[str]:
+    api_key = OPENROUTER_API_KEY
+    if not api_key:
+        raise LLMProviderError("OPENROUTER_API_KEY is not configured")
+
+    messages = []
+    if system:
+        messages.append({"role": "system", "content": system})
+    messages.append({"role": "user", "content": prompt})
+    payload = {
+        "model": OPENROUTER_FAST_MODEL if fast else primary_model(OPENROUTER_MODELS),
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+    }
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": LLM_HTTP_REFERER,
+        "X-Title": LLM_APP_TITLE,
+    }
+
+    async with get_http_client().stream("POST", OPENROUTER_URL, headers=headers, json=payload) as response:
+        response.raise_for_status()
+        async for data in _iter_sse_data(response):
+            if data == "[DONE]":
+                break
+            chunk = orjson.loads(data)
+            if "error" in chunk:
+                raise LLMProviderError(f"OpenRouter stream error: {chunk['error']}")
+            for choice in chunk.get("choices", [])[:1]:
+                yield choice.get("delta", {}).get("content") or ""
+
+
+_STREAMERS = MappingProxyType({
+    Provider.CLAUDE: _stream_claude,
+    Provider.GEMINI: _stream_gemini,
+    Provider.OPENROUTER: _stream_openrouter,
+})
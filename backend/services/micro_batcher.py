@@ -0,0 +1,106 @@
+"""
+Micro-batching for concurrent single-item LLM calls.
+
+Requests that arrive within a short window (or until the batch is full) are
+handed to one batched handler, so N concurrent callers cost one provider
+round-trip instead of N. When the whole batch fails, items are retried one by
+one through an optional per-item fallback, so one bad batch doesn't fail
+every caller in it.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Generic, Optional, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Coalesce concurrent submit() calls into batched handler calls.
+
+    Args:
+        handler: Async function mapping a list of items to results in the same order
+        max_batch: Flush as soon as this many items are waiting
+        max_wait_ms: Flush after this long even if the batch is not full
+        fallback: Optional async function for one item, used when a batch of
+            several items fails as a whole
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[list[T]], Awaitable[list[R]]],
+        max_batch: int = 16,
+        max_wait_ms: float = 25,
+        fallback: Optional[Callable[[T], Awaitable[R]]] = None,
+    ):
+        self.handler = handler
+        self.fallback = fallback
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._pending: list[tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> R:
+        """Queue one item and wait for its result from the next batch."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[T, asyncio.Future]]) -> None:
+        try:
+            await self._dispatch(batch)
+        finally:
+            # Cancellation (or any BaseException) of the batch task must not
+            # leave callers awaiting futures that will never resolve
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+
+    async def _dispatch(self, batch: list[tuple[T, asyncio.Future]]) -> None:
+        try:
+            results: list[Any] = await self.handler([item for item, _ in batch])
+        except Exception as exc:
+            if self.fallback is None or len(batch) == 1:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+            results = await asyncio.gather(
+                *(self.fallback(item) for item, _ in batch), return_exceptions=True
+            )
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+        # A handler that returns fewer results must not leave callers waiting
+        for _, future in batch[len(results):]:
+            if not future.done():
+                future.set_exception(RuntimeError("Batch handler returned no result for this item"))
@@ -2,25 +2,111 @@
 PDF Processing Service
 Extracts text and images from PDFs while preserving structure.
 Uses PyMuPDF (fitz) for robust PDF parsing.
+
+PyMuPDF is imported on first use rather than at module import, so app
+startup (once per worker) doesn't pay for it until a PDF is processed.
+
+Parsing is CPU-bound and holds the GIL, so it runs in a process pool
+(PDF_PROCESS_WORKERS) instead of on the event loop. Every app worker owns a
+pool, so the default splits the cores across WEB_CONCURRENCY workers. Set
+PDF_PROCESS_WORKERS=0 to parse on a worker thread instead.
 """
-import fitz  # PyMuPDF
+import asyncio
 import base64
-from typing import List, Dict, Optional
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional
 from dataclasses import dataclass, field
 import io
 
+from .tokenizer import count_tokens
+
+if TYPE_CHECKING:
+    import fitz
+
+
+_WEB_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+PDF_PROCESS_WORKERS = int(os.getenv(
+    "PDF_PROCESS_WORKERS", str(max(1, (os.cpu_count() or 1) // _WEB_WORKERS))
+))
+_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+# Longer texts are estimated at ~4 characters per token instead of encoded,
+# since estimate_tokens runs synchronously inside request handlers
+TOKEN_ESTIMATE_EXACT_MAX_CHARS = 50_000
+
+
+def _fitz():
+    import fitz  # PyMuPDF
+    return fitz
+
+
+def _process_pool() -> Optional[ProcessPoolExecutor]:
+    # Created on first use so each (forked) app worker owns its pool. Pool
+    # processes start from a forkserver rather than forking the app worker,
+    # which would copy its event loop, client connections and held locks.
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None and PDF_PROCESS_WORKERS > 0:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _PROCESS_POOL = ProcessPoolExecutor(
+            max_workers=PDF_PROCESS_WORKERS, mp_context=multiprocessing.get_context(method)
+        )
+    return _PROCESS_POOL
+
+
+async def _run_cpu_bound(func: Callable, *args):
+    pool = _process_pool()
+    if pool is None:
+        return await asyncio.to_thread(func, *args)
+    return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+
+def shutdown_pdf_pool() -> None:
+    """Stop the PDF parsing processes (call on app shutdown)."""
+    global _PROCESS_POOL
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.shutdown(wait=False, cancel_futures=True)
+        _PROCESS_POOL = None
+
+
+def _text_flags(fitz) -> int:
+    # Plain-text extraction only; leaving out TEXT_PRESERVE_IMAGES means image
+    # blocks are never decoded while text is being collected
+    return fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_MEDIABOX_CLIP
+
+
+def _extract_text(source) -> str:
+    # source is raw PDF bytes or a path; a path keeps large files out of the
+    # pickled payload sent to the pool process
+    fitz = _fitz()
+    if isinstance(source, (bytes, bytearray)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source, filetype="pdf")
+
+    flags = _text_flags(fitz)
+    try:
+        return "\n\n---PAGE BREAK---\n\n".join(page.get_text("text", flags=flags) for page in doc)
+    finally:
+        doc.close()
+
 
 @dataclass
 class ExtractedImage:
     """Represents an image extracted from a PDF."""
     page_number: int
     index: int
-    base64_data: str
+    png_bytes: bytes
     width: int
     height: int
     position: Dict[str, float] = field(default_factory=lambda: {"x": 0, "y": 0})
     alt_text: str = ""
 
+    @property
+    def base64_data(self) -> str:
+        """PNG encoded as base64, for multimodal payloads."""
+        return base64.b64encode(self.png_bytes).decode("utf-8")
+
 
 @dataclass
 class PDFExtraction:
@@ -36,8 +122,8 @@ class PDFProcessor:
     """
     Extracts text and images from PDFs.
 
-    Images are returned as base64-encoded PNGs for direct use with
-    Claude's multimodal capabilities.
+    Images are returned as raw PNG bytes; base64_data encodes them on
+    demand for Claude's multimodal capabilities.
     """
 
     def __init__(
@@ -68,7 +154,12 @@ class PDFProcessor:
         Returns:
             PDFExtraction with text, images, and metadata
         """
+        return await _run_cpu_bound(self._extract_content, pdf_bytes)
+
+    def _extract_content(self, pdf_bytes: bytes) -> PDFExtraction:
+        fitz = _fitz()
         doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        flags = _text_flags(fitz)
 
         full_text_parts = []
         images = []
@@ -77,7 +168,7 @@ class PDFProcessor:
         try:
             for page_num, page in enumerate(doc):
                 # Extract text with layout preservation
-                page_text = page.get_text("text")
+                page_text = page.get_text("text", flags=flags)
 
                 # Extract images if enabled
                 if self.extract_images:
@@ -107,8 +198,8 @@ class PDFProcessor:
 
     def _extract_page_images(
         self,
-        doc: fitz.Document,
-        page: fitz.Page,
+        doc: "fitz.Document",
+        page: "fitz.Page",
         page_num: int,
         start_index: int
     ) -> tuple[List[ExtractedImage], int]:
@@ -124,6 +215,7 @@ class PDFProcessor:
         Returns:
             Tuple of (list of ExtractedImage, next available index)
         """
+        fitz = _fitz()
         images = []
         image_index = start_index
 
@@ -165,12 +257,11 @@ class PDFProcessor:
 
                 # Convert to PNG bytes
                 img_bytes = pix.tobytes("png")
-                base64_data = base64.b64encode(img_bytes).decode("utf-8")
 
                 images.append(ExtractedImage(
                     page_number=page_num + 1,  # 1-indexed for display
                     index=image_index,
-                    base64_data=base64_data,
+                    png_bytes=img_bytes,
                     width=pix.width,
                     height=pix.height,
                     position={"x": 0, "y": 0},
@@ -196,20 +287,27 @@ class PDFProcessor:
         Returns:
             Extracted text with page breaks
         """
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        return await _run_cpu_bound(_extract_text, pdf_bytes)
 
-        text_parts = []
-        try:
-            for page in doc:
-                text_parts.append(page.get_text("text"))
-        finally:
-            doc.close()
+    async def extract_text_from_file(self, path: str) -> str:
+        """
+        Extract only text from a PDF on disk, e.g. a streamed download.
+
+        Args:
+            path: Path to the PDF file
 
-        return "\n\n---PAGE BREAK---\n\n".join(text_parts)
+        Returns:
+            Extracted text with page breaks
+        """
+        return await _run_cpu_bound(_extract_text, path)
 
     def estimate_tokens(self, text: str) -> int:
         """
-        Rough estimate of token count (words * 1.3).
+        Estimate token count with the shared tiktoken encoder.
+
+        Texts longer than TOKEN_ESTIMATE_EXACT_MAX_CHARS use the ~4
+        characters per token estimate instead, so a large document never
+        holds the event loop while it is encoded.
 
         Args:
             text: Text to estimate tokens for
@@ -217,5 +315,6 @@ class PDFProcessor:
         Returns:
             Estimated token count
         """
-        words = len(text.split())
-        return int(words * 1.3)
+        if len(text) <= TOKEN_ESTIMATE_EXACT_MAX_CHARS:
+            return count_tokens(text)
+        return len(text) // 4
@@ -0,0 +1,257 @@
+"""
+Response caches for LLM calls.
+
+ExactCache keys completions by a hash of the normalized prompt and call
+parameters. It keeps a small in-process LRU and, when REDIS_URL is set and
+the redis package is installed, a shared tier so every worker sees the same
+hot set.
+
+SemanticCache serves a stored completion when a new prompt differs from a
+cached one only by a near-duplicate key phrase (a topic or paper title that
+was re-cased, re-punctuated, or reworded slightly). Both phrases must also
+use the same content words, ignoring stopwords and plurals, so titles that
+differ only in a domain noun never share an answer. Everything else in the
+prompt acts as a lexical gate: it must match exactly, so two prompts for
+different audiences or sessions never share an answer.
+"""
+import hashlib
+import math
+import re
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+# Words that can be added, dropped or swapped without changing what a title is about
+_STOPWORDS = frozenset(
+    "a an and as at by for from in into of on or the to via vs with".split()
+)
+_WHITESPACE_RE = re.compile(r"\s+")
+_MISSING = object()
+
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire after ttl_seconds."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so re-indented templates share a cache key."""
+    return _WHITESPACE_RE.sub(" ", prompt).strip()
+
+
+class ExactCache:
+    """
+    Exact-match completion cache with an optional Redis tier.
+
+    Args:
+        ttl_seconds: Lifetime of a stored completion
+        max_entries: Size of the in-process LRU
+        redis_url: Optional Redis URL for a cache shared across workers
+        prefix: Redis key prefix
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 3600,
+        max_entries: int = 1024,
+        redis_url: Optional[str] = None,
+        prefix: str = "llm:",
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.redis_url = redis_url
+        self._local = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._redis = None
+
+    @staticmethod
+    def key_for(params: str, prompt: str) -> str:
+        """Stable digest of the call parameters and normalized prompt."""
+        raw = f"{params}\x1f{normalize_prompt(prompt)}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=20).hexdigest()
+
+    def _get_redis(self):
+        if self._redis is None and self.redis_url:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError:
+                print("[LLM Cache] REDIS_URL is set but the redis package is not installed; using in-process cache only")
+                self.redis_url = None
+                return None
+            self._redis = redis_asyncio.from_url(self.redis_url, decode_responses=True)
+        return self._redis
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self._local.get(key)
+        if value is not None:
+            return value
+
+        client = self._get_redis()
+        if client is None:
+            return None
+        try:
+            value = await client.get(self.prefix + key)
+        except Exception as exc:
+            print(f"[LLM Cache] Redis get failed: {exc}")
+            return None
+        if value is not None:
+            self._local.set(key, value)
+        return value
+
+    async def set(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._local.set(key, value, ttl)
+        client = self._get_redis()
+        if client is None:
+            return
+        try:
+            await client.set(self.prefix + key, value, ex=int(ttl))
+        except Exception as exc:
+            print(f"[LLM Cache] Redis set failed: {exc}")
+
+
+def _vectorize(text: str) -> dict[str, float]:
+    """L2-normalized bag-of-words vector for a short key phrase."""
+    counts = Counter(_WORD_RE.findall(text.lower()))
+    norm = math.sqrt(sum(c * c for c in counts.values())) or 1.0
+    return {word: count / norm for word, count in counts.items()}
+
+
+def _content_terms(text: str) -> frozenset[str]:
+    """Content words of a key phrase, with stopwords dropped and plurals folded."""
+    terms = set()
+    for word in _WORD_RE.findall(text.lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+    return frozenset(terms)
+
+
+def _cosine(a: dict[str, float], b: dict[str, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(word, 0.0) for word, weight in a.items())
+
+
+@dataclass
+class _SemanticEntry:
+    vector: dict[str, float]
+    numbers: tuple[str, ...]
+    terms: frozenset[str]
+    value: str
+    expires_at: float
+
+
+class SemanticCache:
+    """
+    Bounded near-duplicate cache keyed by (gate, key phrase).
+
+    Args:
+        threshold: Minimum cosine similarity between key phrases for a hit
+        max_entries: Maximum number of gates kept (LRU)
+        max_keys_per_gate: Maximum key phrases remembered per gate
+        ttl_seconds: Lifetime of a stored completion
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        max_keys_per_gate: int = 64,
+        ttl_seconds: float = 3600,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_keys_per_gate = max_keys_per_gate
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, list[_SemanticEntry]] = OrderedDict()
+
+    @staticmethod
+    def gate_for(namespace: str, prompt: str, key: str) -> str:
+        """Hash the prompt with the key phrase masked out, plus call parameters."""
+        masked = prompt.replace(key, "\x00") if key else prompt
+        return hashlib.blake2b(f"{namespace}\x1f{masked}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, gate: str, key: str) -> Optional[str]:
+        entries = self._entries.get(gate)
+        if not entries:
+            return None
+
+        now = time.monotonic()
+        live = [entry for entry in entries if entry.expires_at > now]
+        if len(live) != len(entries):
+            self._entries[gate] = live
+
+        vector = _vectorize(key)
+        numbers = tuple(_NUMBER_RE.findall(key))
+        terms = _content_terms(key)
+        best: Optional[_SemanticEntry] = None
+        best_score = self.threshold
+        for entry in live:
+            # Numbers ("Calculus 2" vs "Calculus 3") must agree exactly.
+            if entry.numbers != numbers:
+                continue
+            # So must content words ("Medical Image" vs "Satellite Image").
+            if entry.terms != terms:
+                continue
+            score = _cosine(vector, entry.vector)
+            if score >= best_score:
+                best, best_score = entry, score
+
+        if best is None:
+            return None
+        self._entries.move_to_end(gate)
+        return best.value
+
+    def set(self, gate: str, key: str, value: str) -> None:
+        entry = _SemanticEntry(
+            vector=_vectorize(key),
+            numbers=tuple(_NUMBER_RE.findall(key)),
+            terms=_content_terms(key),
+            value=value,
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        entries = self._entries.setdefault(gate, [])
+        entries.append(entry)
+        if len(entries) > self.max_keys_per_gate:
+            del entries[0]
+        self._entries.move_to_end(gate)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
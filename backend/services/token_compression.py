@@ -13,6 +13,32 @@ from typing import Optional
 from dataclasses import dataclass
 from functools import partial
 
+# In-flight Token Company calls per worker; bursts queue here instead of
+# hitting the API's rate limit
+_COMPRESSION_SEMAPHORE = asyncio.Semaphore(int(os.getenv("TOKEN_COMPANY_MAX_CONCURRENCY", "8")))
+# Texts longer than this are split at paragraph boundaries and the pieces
+# compressed concurrently, so one large paper isn't a single huge request
+COMPRESSION_CHUNK_CHARS = int(os.getenv("COMPRESSION_CHUNK_CHARS", "64000"))
+
+_PLACEHOLDER_RE = re.compile(r'\[IMAGE_\d+\]')
+_PLACEHOLDER_KEY_RE = re.compile(r'__IMG_PLACEHOLDER_(\d+)__')
+
+
+def _split_for_compression(text: str, limit: int) -> list[str]:
+    """Split text into pieces of at most ~limit chars, breaking between paragraphs."""
+    chunks = []
+    current = []
+    size = 0
+    for paragraph in text.split("\n\n"):
+        if current and size + len(paragraph) > limit:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
 
 @dataclass
 class CompressionResult:
@@ -85,6 +111,10 @@ class TokenCompressionService:
         """
         Compress text while optionally preserving image placeholders.
 
+        Text longer than COMPRESSION_CHUNK_CHARS (without output token bounds)
+        is compressed as concurrent paragraph-aligned pieces whose results are
+        joined back together.
+
         Args:
             text: The text to compress
             aggressiveness: 0.0-1.0 compression intensity (higher = more compression)
@@ -99,28 +129,57 @@ class TokenCompressionService:
 
         # Handle empty or very short text
         if not text or len(text.strip()) < 50:
+            estimated_tokens = self._estimate_tokens(text)
             return CompressionResult(
                 compressed_text=text,
-                original_tokens=self._estimate_tokens(text),
-                compressed_tokens=self._estimate_tokens(text),
+                original_tokens=estimated_tokens,
+                compressed_tokens=estimated_tokens,
                 compression_ratio=1.0,
                 tokens_saved=0,
                 compression_time=0,
                 success=True
             )
 
+        # Output token bounds apply to the whole text, so bounded calls aren't split
+        chunked = (
+            COMPRESSION_CHUNK_CHARS > 0
+            and len(text) > COMPRESSION_CHUNK_CHARS
+            and not max_output_tokens
+            and not min_output_tokens
+        )
+        if chunked:
+            chunks = _split_for_compression(text, COMPRESSION_CHUNK_CHARS)
+            if len(chunks) > 1:
+                results = await asyncio.gather(*(
+                    self._compress_single(chunk, aggressiveness, None, None, preserve_placeholders)
+                    for chunk in chunks
+                ))
+                return self._merge_results(results, time.time() - start_time)
+
+        return await self._compress_single(
+            text, aggressiveness, max_output_tokens, min_output_tokens, preserve_placeholders
+        )
+
+    async def _compress_single(
+        self,
+        text: str,
+        aggressiveness: float,
+        max_output_tokens: Optional[int],
+        min_output_tokens: Optional[int],
+        preserve_placeholders: bool
+    ) -> CompressionResult:
+        start_time = time.time()
         try:
-            # If preserving placeholders, extract and replace them
-            placeholders = {}
+            # If preserving placeholders, swap them for keys in one pass
+            placeholders = []
             processed_text = text
 
             if preserve_placeholders:
-                pattern = r'\[IMAGE_\d+\]'
-                matches = re.findall(pattern, text)
-                for i, match in enumerate(matches):
-                    placeholder_key = f"__IMG_PLACEHOLDER_{i}__"
-                    placeholders[placeholder_key] = match
-                    processed_text = processed_text.replace(match, placeholder_key, 1)
+                def protect(match):
+                    placeholders.append(match.group(0))
+                    return f"__IMG_PLACEHOLDER_{len(placeholders) - 1}__"
+
+                processed_text = _PLACEHOLDER_RE.sub(protect, text)
 
             # Run compression in thread pool (SDK is synchronous)
             loop = asyncio.get_event_loop()
@@ -135,17 +194,21 @@ class TokenCompressionService:
             if min_output_tokens:
                 compress_kwargs["min_output_tokens"] = min_output_tokens
 
-            response = await loop.run_in_executor(
-                None,
-                partial(self._do_compress, **compress_kwargs)
-            )
+            async with _COMPRESSION_SEMAPHORE:
+                response = await loop.run_in_executor(
+                    None,
+                    partial(self._do_compress, **compress_kwargs)
+                )
 
             compressed = response.output
 
             # Restore placeholders
-            if preserve_placeholders:
-                for key, original in placeholders.items():
-                    compressed = compressed.replace(key, original)
+            if placeholders:
+                def restore(match):
+                    i = int(match.group(1))
+                    return placeholders[i] if i < len(placeholders) else match.group(0)
+
+                compressed = _PLACEHOLDER_KEY_RE.sub(restore, compressed)
 
             compression_time = time.time() - start_time
 
@@ -171,10 +234,11 @@ class TokenCompressionService:
             elif "timeout" in error_msg.lower():
                 error_msg = f"Request timed out: {error_msg}"
 
+            estimated_tokens = self._estimate_tokens(text)
             return CompressionResult(
                 compressed_text=text,  # Return original on failure
-                original_tokens=self._estimate_tokens(text),
-                compressed_tokens=self._estimate_tokens(text),
+                original_tokens=estimated_tokens,
+                compressed_tokens=estimated_tokens,
                 compression_ratio=1.0,
                 tokens_saved=0,
                 compression_time=compression_time,
@@ -182,6 +246,28 @@ class TokenCompressionService:
                 error=error_msg
             )
 
+    @staticmethod
+    def _merge_results(results: list[CompressionResult], compression_time: float) -> CompressionResult:
+        """Join per-chunk results; failed chunks keep their original text."""
+        original_tokens = sum(r.original_tokens for r in results)
+        compressed_tokens = sum(r.compressed_tokens for r in results)
+        # Weighting by input size keeps the ratio equal to the whole-text ratio
+        compression_ratio = (
+            sum(r.compression_ratio * r.original_tokens for r in results) / original_tokens
+            if original_tokens else 1.0
+        )
+        errors = [r.error for r in results if r.error]
+        return CompressionResult(
+            compressed_text="\n\n".join(r.compressed_text for r in results),
+            original_tokens=original_tokens,
+            compressed_tokens=compressed_tokens,
+            compression_ratio=compression_ratio,
+            tokens_saved=sum(r.tokens_saved for r in results),
+            compression_time=compression_time,
+            success=any(r.success for r in results),
+            error=errors[0] if errors else None
+        )
+
     def _do_compress(self, **kwargs):
         """Synchronous compression call for thread pool."""
         return self.client.compress_input(**kwargs)
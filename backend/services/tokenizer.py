@@ -0,0 +1,59 @@
+"""
+Token counting for routing and budget decisions.
+
+Uses tiktoken's cl100k_base encoding when the package is installed. The
+encoder is resolved once per process, since building it costs far more than
+encoding a prompt. Without tiktoken, counts fall back to ~4 characters per
+token, which is close enough for thresholds. The same fallback is used when
+the encoding cannot be loaded (get_encoding downloads it on first use).
+"""
+import logging
+from functools import lru_cache
+from typing import Iterable, Optional
+
+logger = logging.getLogger("arxlearn.tokenizer")
+
+
+@lru_cache(maxsize=1)
+def _encoder():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Cached like a missing package so a broken download is not retried per call
+        logger.warning("tiktoken encoding unavailable, estimating tokens: %s", e)
+        return None
+
+
+def count_tokens(text: str, exact_max_chars: Optional[int] = None) -> int:
+    """
+    Return the number of tokens in text.
+
+    Args:
+        text: Text to count
+        exact_max_chars: Texts longer than this are estimated at ~4
+            characters per token instead of encoded
+
+    Returns:
+        Token count
+    """
+    if not text:
+        return 0
+    if exact_max_chars is not None and len(text) > exact_max_chars:
+        return len(text) // 4
+    encoder = _encoder()
+    if encoder is None:
+        return len(text) // 4
+    return len(encoder.encode_ordinary(text))
+
+
+def count_tokens_batch(texts: Iterable[str]) -> list[int]:
+    """Count tokens for many texts; tiktoken encodes the batch across threads."""
+    texts = list(texts)
+    encoder = _encoder()
+    if encoder is None:
+        return [len(text) // 4 for text in texts]
+    return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts)]
@@ -0,0 +1,18 @@
+-- Migration: Stamp ttc_processed_at in the database
+-- Inserts no longer send a client-side timestamp; rows that arrive with
+-- ttc_processed = TRUE get the server's now() instead.
+
+CREATE OR REPLACE FUNCTION set_ttc_processed_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.ttc_processed AND NEW.ttc_processed_at IS NULL THEN
+    NEW.ttc_processed_at := now();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_academia_materials_ttc_processed_at ON academia_materials;
+CREATE TRIGGER trg_academia_materials_ttc_processed_at
+  BEFORE INSERT ON academia_materials
+  FOR EACH ROW EXECUTE FUNCTION set_ttc_processed_at();
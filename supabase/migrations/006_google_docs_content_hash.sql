@@ -0,0 +1,15 @@
+-- Migration: Content hash for Google Docs materials
+-- Re-imported documents with identical text reuse the compressed blob of an
+-- earlier import instead of being compressed and uploaded again.
+
+DO $$
+BEGIN
+  IF to_regclass('public.google_docs_materials') IS NOT NULL THEN
+    ALTER TABLE google_docs_materials
+      ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+    CREATE INDEX IF NOT EXISTS idx_google_docs_materials_content_hash
+      ON google_docs_materials(user_id, content_hash)
+      WHERE compressed_storage_path IS NOT NULL;
+  END IF;
+END $$;
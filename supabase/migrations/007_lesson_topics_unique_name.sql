@@ -0,0 +1,42 @@
+-- Migration: One lesson topic per name within a session
+-- Lets confirmed prerequisites be written with a single upsert instead of a
+-- lookup per topic. Existing duplicates keep their earliest row; activities
+-- of a removed duplicate are moved to the kept topic first (numbered after
+-- its own activities), so no learner progress is lost.
+
+DO $$
+DECLARE
+  merge RECORD;
+BEGIN
+  IF to_regclass('public.lesson_topics') IS NOT NULL THEN
+    FOR merge IN
+      SELECT d.id AS duplicate_id, k.id AS kept_id
+        FROM lesson_topics d
+        JOIN lesson_topics k
+          ON k.session_id = d.session_id
+         AND k.topic_name = d.topic_name
+         AND k.ctid = (
+           SELECT f.ctid FROM lesson_topics f
+             WHERE f.session_id = d.session_id AND f.topic_name = d.topic_name
+             ORDER BY f.ctid LIMIT 1
+         )
+        WHERE d.ctid <> k.ctid
+        ORDER BY k.id, d.ctid
+    LOOP
+      IF to_regclass('public.lesson_activities') IS NOT NULL THEN
+        UPDATE lesson_activities
+          SET topic_id = merge.kept_id,
+              order_index = order_index + (
+                SELECT COALESCE(max(order_index) + 1, 0) FROM lesson_activities
+                  WHERE topic_id = merge.kept_id
+              )
+          WHERE topic_id = merge.duplicate_id;
+      END IF;
+
+      DELETE FROM lesson_topics WHERE id = merge.duplicate_id;
+    END LOOP;
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_lesson_topics_session_topic_name
+      ON lesson_topics(session_id, topic_name);
+  END IF;
+END $$;
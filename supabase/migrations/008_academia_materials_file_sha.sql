@@ -0,0 +1,14 @@
+-- Migration: Content hash for uploaded academia materials
+-- Authored-paper PDFs are stored under their BLAKE2b digest. A resubmitted
+-- paper reuses the stored object and upserts its existing material row.
+
+ALTER TABLE academia_materials
+  ADD COLUMN IF NOT EXISTS file_sha TEXT;
+
+-- Rows without a digest stay unconstrained (NULLs are distinct)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_academia_materials_session_file_sha
+  ON academia_materials(session_id, file_sha);
+
+CREATE INDEX IF NOT EXISTS idx_academia_materials_user_file_sha
+  ON academia_materials(user_id, file_sha)
+  WHERE file_sha IS NOT NULL;
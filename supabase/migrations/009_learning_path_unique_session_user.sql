@@ -0,0 +1,45 @@
+-- Migration: One learning-path analysis per session and user
+-- Lets topic_concepts and user_knowledge_similarity be written with a single
+-- upsert instead of a lookup followed by an insert or update. Existing
+-- duplicates keep their earliest row.
+
+DO $$
+BEGIN
+  IF to_regclass('public.topic_concepts') IS NOT NULL THEN
+    IF to_regclass('public.user_knowledge_similarity') IS NOT NULL THEN
+      -- Point analyses at the topic_concepts row that is kept
+      UPDATE user_knowledge_similarity u
+        SET topic_concepts_id = keep.id
+        FROM topic_concepts t
+        JOIN LATERAL (
+          SELECT k.id FROM topic_concepts k
+            WHERE k.session_id = t.session_id
+              AND k.user_id = t.user_id
+            ORDER BY k.ctid
+            LIMIT 1
+        ) keep ON true
+        WHERE u.topic_concepts_id = t.id
+          AND t.id <> keep.id;
+    END IF;
+
+    DELETE FROM topic_concepts a
+      USING topic_concepts b
+      WHERE a.session_id = b.session_id
+        AND a.user_id = b.user_id
+        AND a.ctid > b.ctid;
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_topic_concepts_session_user
+      ON topic_concepts(session_id, user_id);
+  END IF;
+
+  IF to_regclass('public.user_knowledge_similarity') IS NOT NULL THEN
+    DELETE FROM user_knowledge_similarity a
+      USING user_knowledge_similarity b
+      WHERE a.session_id = b.session_id
+        AND a.user_id = b.user_id
+        AND a.ctid > b.ctid;
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_user_knowledge_similarity_session_user
+      ON user_knowledge_similarity(session_id, user_id);
+  END IF;
+END $$;
@@ -0,0 +1,62 @@
+-- Migration: Complete a lesson activity in one round-trip
+-- Marks the activity complete, recomputes the topic's mastery from its
+-- completed activities and closes the topic when it is mastered, all in one
+-- transaction. Returns no row when the activity does not exist.
+--
+-- Mastery: 0.2 per completed activity, -0.1 when the learner was confused,
+-- +0.15 when it was too easy, capped to [0, 1]. A topic is complete at
+-- mastery >= 0.8 or after 5 completed activities.
+
+CREATE OR REPLACE FUNCTION complete_activity_rpc(
+  p_activity_id lesson_activities.id%TYPE,
+  p_user_response TEXT DEFAULT NULL,
+  p_feedback TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+  topic_id lesson_activities.topic_id%TYPE,
+  completed_count INTEGER,
+  new_mastery DOUBLE PRECISION,
+  topic_complete BOOLEAN
+) AS $$
+DECLARE
+  v_topic_id lesson_activities.topic_id%TYPE;
+  v_count INTEGER;
+  v_mastery DOUBLE PRECISION;
+  v_complete BOOLEAN;
+BEGIN
+  UPDATE lesson_activities a
+    SET completed = TRUE,
+        completed_at = now(),
+        user_response = p_user_response
+    WHERE a.id = p_activity_id
+    RETURNING a.topic_id INTO v_topic_id;
+
+  IF NOT FOUND THEN
+    RETURN;
+  END IF;
+
+  SELECT count(*) INTO v_count
+    FROM lesson_activities a
+    WHERE a.topic_id = v_topic_id AND a.completed;
+
+  v_mastery := v_count * 0.2;
+  IF p_feedback = 'confused' THEN
+    v_mastery := greatest(0, v_mastery - 0.1);
+  ELSIF p_feedback = 'too_easy' THEN
+    v_mastery := v_mastery + 0.15;
+  END IF;
+  v_mastery := least(1.0, v_mastery);
+  v_complete := v_mastery >= 0.8 OR v_count >= 5;
+
+  UPDATE lesson_topics t
+    SET mastery_level = v_mastery,
+        completed_at = CASE WHEN v_complete THEN now() ELSE t.completed_at END
+    WHERE t.id = v_topic_id;
+
+  topic_id := v_topic_id;
+  completed_count := v_count;
+  new_mastery := v_mastery;
+  topic_complete := v_complete;
+  RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,29 @@
+-- Migration: One lesson activity per topic position
+-- The next activity can be generated in the background after a completion
+-- while the learner may also request it, so both writers upsert on
+-- (topic_id, order_index) and keep whichever row landed first. Existing
+-- duplicate positions are renumbered rather than deleted, since completed
+-- activities count towards mastery.
+
+DO $$
+BEGIN
+  IF to_regclass('public.lesson_activities') IS NOT NULL THEN
+    UPDATE lesson_activities a
+      SET order_index = r.position
+      FROM (
+        SELECT ctid AS row_ctid,
+               row_number() OVER (PARTITION BY topic_id ORDER BY order_index, ctid) - 1 AS position
+          FROM lesson_activities
+      ) r
+      WHERE a.ctid = r.row_ctid
+        AND a.topic_id IN (
+          SELECT topic_id FROM lesson_activities
+            GROUP BY topic_id, order_index
+            HAVING count(*) > 1
+        )
+        AND a.order_index IS DISTINCT FROM r.position;
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_lesson_activities_topic_order
+      ON lesson_activities(topic_id, order_index);
+  END IF;
+END $$;
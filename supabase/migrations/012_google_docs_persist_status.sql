@@ -0,0 +1,14 @@
+-- Migration: Persist status for Google Docs materials
+-- Storage uploads and metadata for submitted Google Docs are written after the
+-- response. Each row is recorded as 'pending' before the response returns and
+-- moves to 'stored' or 'failed' (with persist_error) once the deferred write
+-- finishes, so every app worker can report it and it survives restarts.
+
+DO $$
+BEGIN
+  IF to_regclass('public.google_docs_materials') IS NOT NULL THEN
+    ALTER TABLE google_docs_materials
+      ADD COLUMN IF NOT EXISTS persist_status TEXT,
+      ADD COLUMN IF NOT EXISTS persist_error TEXT;
+  END IF;
+END $$;
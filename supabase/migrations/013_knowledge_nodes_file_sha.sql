@@ -0,0 +1,33 @@
+-- Migration: Link authored-paper knowledge nodes to their PDF
+-- A resubmitted authored paper replaces the nodes generated for it. Nodes
+-- carry the file_sha of the paper they came from so the replacement never
+-- touches nodes of another paper that happens to share a title. Existing
+-- authored nodes are linked through the title their relevance_to_topic names.
+
+DO $$
+BEGIN
+  IF to_regclass('public.knowledge_nodes') IS NOT NULL THEN
+    ALTER TABLE knowledge_nodes
+      ADD COLUMN IF NOT EXISTS file_sha TEXT;
+
+    IF to_regclass('public.academia_materials') IS NOT NULL THEN
+      UPDATE knowledge_nodes n
+        SET file_sha = (
+          SELECT m.file_sha
+            FROM academia_materials m
+            WHERE m.session_id = n.session_id
+              AND m.material_type = 'paper_authored'
+              AND m.file_sha IS NOT NULL
+              AND n.relevance_to_topic = 'From your authored paper: ' || m.title
+            ORDER BY m.created_at DESC
+            LIMIT 1
+        )
+        WHERE n.source = 'paper_authored'
+          AND n.file_sha IS NULL;
+    END IF;
+
+    CREATE INDEX IF NOT EXISTS idx_knowledge_nodes_session_file_sha
+      ON knowledge_nodes(session_id, file_sha)
+      WHERE file_sha IS NOT NULL;
+  END IF;
+END $$;